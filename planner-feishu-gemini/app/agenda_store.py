@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .data_io import AGENDAS_DIR, DATA_DIR
+from .shard import current_shard
+
+AGENDA_STORE = os.getenv("AGENDA_STORE", "dir").lower()
+AGENDA_SEGMENTS_DIR = os.path.join(DATA_DIR, "agenda_segments")
+# Rewrite a day's segment on close once superseded records exceed this share of it.
+AGENDA_COMPACT_RATIO = float(os.getenv("AGENDA_COMPACT_RATIO", "0.5"))
+
+
+class DirStore:
+    """The original layout: ``data/agendas/YYYY-MM-DD/{public_id}.json``."""
+
+    def __init__(self, root: str = AGENDAS_DIR) -> None:
+        self.root = root
+
+    def _path(self, public_id: str, date_str: str) -> str:
+        return os.path.join(self.root, date_str, f"{public_id}.json")
+
+    def get(self, public_id: str, date_str: str) -> Optional[Dict]:
+        try:
+            with open(self._path(public_id, date_str), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def put(self, public_id: str, date_str: str, agenda: Dict) -> None:
+        os.makedirs(os.path.join(self.root, date_str), exist_ok=True)
+        path = self._path(public_id, date_str)
+        # Temp file + rename, so a reader (or a crash) never sees a half-written agenda.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(agenda, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def dates(self) -> List[str]:
+        try:
+            return sorted(e.name for e in os.scandir(self.root) if e.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def items(self, date_str: str) -> Iterator[Tuple[str, Dict]]:
+        try:
+            names = sorted(e.name for e in os.scandir(os.path.join(self.root, date_str)) if e.name.endswith(".json"))
+        except FileNotFoundError:
+            return
+        for name in names:
+            agenda = self.get(name[:-5], date_str)
+            if agenda is not None:
+                yield name[:-5], agenda
+
+    def close(self) -> None:
+        pass
+
+
+class _Segment:
+    """In-memory view of one day's segment: public_id -> (offset, length) of the newest record."""
+
+    def __init__(self, size: int, offsets: Dict[str, List[int]], dead: int) -> None:
+        self.size = size
+        self.offsets = offsets
+        self.dead = dead
+        self.dirty = False
+
+
+class SegmentStore:
+    """One append-only ``<date>.seg`` per day plus a ``<date>.idx`` offset index.
+
+    Each record is a single line ``{"public_id": ..., "agenda": {...}}``;
+    rewriting an agenda appends a new line and repoints the index, leaving the
+    old bytes dead until compaction. The index records the segment size it
+    describes, so a segment appended to by a crashed run (or edited by a merge)
+    is detected and re-indexed with one sequential scan, dropping a torn tail.
+    """
+
+    def __init__(self, root: str = AGENDA_SEGMENTS_DIR, compact_ratio: float = AGENDA_COMPACT_RATIO) -> None:
+        self.root = root
+        self.compact_ratio = compact_ratio
+        self._segments: Dict[str, _Segment] = {}
+        # get/put may run on I/O pool threads (app/aio_io.py); the in-memory index is shared.
+        self._lock = threading.RLock()
+
+    def _seg_path(self, date_str: str) -> str:
+        return os.path.join(self.root, f"{date_str}.seg")
+
+    def _idx_path(self, date_str: str) -> str:
+        return os.path.join(self.root, f"{date_str}.idx")
+
+    def _segment(self, date_str: str) -> _Segment:
+        seg = self._segments.get(date_str)
+        if seg is not None:
+            return seg
+        try:
+            size = os.path.getsize(self._seg_path(date_str))
+        except OSError:
+            size = 0
+        seg = None
+        if size:
+            try:
+                with open(self._idx_path(date_str), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("size") == size:
+                    seg = _Segment(size, data["offsets"], data.get("dead", 0))
+            except Exception:
+                pass
+            if seg is None:
+                seg = self._reindex(date_str)
+        else:
+            seg = _Segment(0, {}, 0)
+        self._segments[date_str] = seg
+        return seg
+
+    def _reindex(self, date_str: str) -> _Segment:
+        offsets: Dict[str, List[int]] = {}
+        dead = 0
+        pos = 0
+        with open(self._seg_path(date_str), "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn final record from an interrupted write
+                try:
+                    public_id = json.loads(line)["public_id"]
+                except Exception:
+                    dead += len(line)
+                else:
+                    if public_id in offsets:
+                        dead += offsets[public_id][1]
+                    offsets[public_id] = [pos, len(line)]
+                pos += len(line)
+        if pos != os.path.getsize(self._seg_path(date_str)):
+            with open(self._seg_path(date_str), "r+b") as f:
+                f.truncate(pos)
+        seg = _Segment(pos, offsets, dead)
+        seg.dirty = True
+        return seg
+
+    def get(self, public_id: str, date_str: str) -> Optional[Dict]:
+        with self._lock:
+            loc = self._segment(date_str).offsets.get(public_id)
+        if loc is None:
+            return None
+        try:
+            with open(self._seg_path(date_str), "rb") as f:
+                f.seek(loc[0])
+                return json.loads(f.read(loc[1]))["agenda"]
+        except Exception:
+            return None
+
+    def put(self, public_id: str, date_str: str, agenda: Dict) -> None:
+        line = (json.dumps({"public_id": public_id, "agenda": agenda}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._put(public_id, date_str, line)
+
+    def _put(self, public_id: str, date_str: str, line: bytes) -> None:
+        seg = self._segment(date_str)
+        os.makedirs(self.root, exist_ok=True)
+        fd = os.open(self._seg_path(date_str), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        old = seg.offsets.get(public_id)
+        if old is not None:
+            seg.dead += old[1]
+        seg.offsets[public_id] = [seg.size, len(line)]
+        seg.size += len(line)
+        seg.dirty = True
+
+    def dates(self) -> List[str]:
+        try:
+            return sorted(e.name[:-4] for e in os.scandir(self.root) if e.name.endswith(".seg"))
+        except FileNotFoundError:
+            return []
+
+    def items(self, date_str: str) -> Iterator[Tuple[str, Dict]]:
+        for public_id in sorted(self._segment(date_str).offsets):
+            agenda = self.get(public_id, date_str)
+            if agenda is not None:
+                yield public_id, agenda
+
+    def compact(self, date_str: str) -> int:
+        """Rewrite a day's segment with only the newest record per user; return bytes reclaimed."""
+        seg = self._segment(date_str)
+        if not seg.dead:
+            return 0
+        path = self._seg_path(date_str)
+        tmp = f"{path}.tmp"
+        offsets: Dict[str, List[int]] = {}
+        pos = 0
+        with open(path, "rb") as src, open(tmp, "wb") as dst:
+            for public_id in sorted(seg.offsets):
+                offset, length = seg.offsets[public_id]
+                src.seek(offset)
+                dst.write(src.read(length))
+                offsets[public_id] = [pos, length]
+                pos += length
+        os.replace(tmp, path)
+        reclaimed = seg.size - pos
+        self._segments[date_str] = _Segment(pos, offsets, 0)
+        self._segments[date_str].dirty = True
+        self._save_index(date_str)
+        return reclaimed
+
+    def _save_index(self, date_str: str) -> None:
+        seg = self._segments[date_str]
+        path = self._idx_path(date_str)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"size": seg.size, "dead": seg.dead, "offsets": seg.offsets}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        seg.dirty = False
+
+    def close(self) -> None:
+        """Persist changed indexes, compacting segments that are mostly dead records."""
+        for date_str, seg in list(self._segments.items()):
+            if seg.size and seg.dead > seg.size * self.compact_ratio:
+                self.compact(date_str)
+            elif seg.dirty:
+                self._save_index(date_str)
+
+
+class ShardStore:
+    """A shard's own segment files layered over the shared ones.
+
+    Writes go to ``agenda_segments/<shard>/`` only, so concurrent shards never
+    append to the same segment; reads fall back to the shared store for
+    agendas written before sharding. ``python -m app.shard merge`` folds the
+    shard directory back in.
+    """
+
+    def __init__(self, own: SegmentStore, base: SegmentStore) -> None:
+        self.own = own
+        self.base = base
+
+    def get(self, public_id: str, date_str: str) -> Optional[Dict]:
+        agenda = self.own.get(public_id, date_str)
+        return agenda if agenda is not None else self.base.get(public_id, date_str)
+
+    def put(self, public_id: str, date_str: str, agenda: Dict) -> None:
+        self.own.put(public_id, date_str, agenda)
+
+    def dates(self) -> List[str]:
+        return sorted(set(self.own.dates()) | set(self.base.dates()))
+
+    def items(self, date_str: str) -> Iterator[Tuple[str, Dict]]:
+        merged = dict(self.base.items(date_str))
+        merged.update(self.own.items(date_str))
+        yield from sorted(merged.items())
+
+    def close(self) -> None:
+        self.own.close()  # the shared store is never written here
+
+
+def make_store(name: str = AGENDA_STORE):
+    if name == "segment":
+        shard = current_shard()
+        if shard is not None:
+            return ShardStore(SegmentStore(os.path.join(AGENDA_SEGMENTS_DIR, shard.suffix)), SegmentStore())
+        return SegmentStore()
+    return DirStore()
+
+
+_store = None
+
+
+def get_agenda_store():
+    """Process-wide agenda store selected by AGENDA_STORE (``dir`` default, or ``segment``)."""
+    global _store
+    if _store is None:
+        _store = make_store()
+    return _store
+
+
+def close_agenda_store() -> None:
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def read_agenda(public_id: str, date_str: str) -> Optional[Dict]:
+    return get_agenda_store().get(public_id, date_str)
+
+
+def write_agenda(public_id: str, date_str: str, agenda: Dict) -> None:
+    get_agenda_store().put(public_id, date_str, agenda)
+
+
+def copy_agendas(src, dst, dates: Optional[List[str]] = None) -> int:
+    """Copy every agenda (optionally only some dates) from one store to another."""
+    copied = 0
+    for date_str in dates or src.dates():
+        for public_id, agenda in src.items(date_str):
+            dst.put(public_id, date_str, agenda)
+            copied += 1
+    dst.close()
+    return copied
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.agenda_store")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for cmd, help_text in (
+        ("import", "copy data/agendas/ into segment files"),
+        ("export", "copy segment files back to data/agendas/"),
+        ("compact", "drop superseded records from segment files"),
+    ):
+        p = sub.add_parser(cmd, help=help_text)
+        p.add_argument("dates", nargs="*", help="YYYY-MM-DD (default: all)")
+    args = parser.parse_args(argv)
+    if args.cmd == "import":
+        print(f"imported {copy_agendas(DirStore(), SegmentStore(), args.dates)} agendas")
+    elif args.cmd == "export":
+        print(f"exported {copy_agendas(SegmentStore(), DirStore(), args.dates)} agendas")
+    else:
+        store = SegmentStore()
+        reclaimed = sum(store.compact(d) for d in args.dates or store.dates())
+        store.close()
+        print(f"reclaimed {reclaimed} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from .agenda_store import get_agenda_store
+from .data_io import append_delivery as _append_delivery, load_preferred_plan_md as _load_preferred_plan_md
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+AIO_IO_THREADS = int(os.getenv("AIO_IO_THREADS", "4"))
+LOOP_LAG_INTERVAL_S = float(os.getenv("LOOP_LAG_INTERVAL_S", "0.05"))
+
+
+class AsyncIO:
+    """Run-scoped async facade over the blocking file I/O in ``data_io`` and the agenda store.
+
+    Reads run on a bounded thread pool (AIO_IO_THREADS, 0 = inline on the
+    loop, the old behaviour). Agenda writes and delivery rows are group
+    committed: callers queue a write and await its flush, and whatever queues
+    up while one flush is running goes out together in the next. Writes are
+    applied by one flush at a time, so the store never sees concurrent puts.
+    """
+
+    def __init__(self, threads: int = AIO_IO_THREADS) -> None:
+        self.threads = max(0, threads)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="aio-io") if threads > 0 else None
+        self._agendas: List[Tuple[str, str, Dict, asyncio.Future]] = []
+        self._deliveries: List[Tuple[Tuple, asyncio.Future]] = []
+        self._flushing: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.batched = 0
+
+    async def _call(self, fn, *args):
+        if self._pool is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def load_preferred_plan_md(self, public_id: str, date_str: str) -> Optional[str]:
+        return await self._call(_load_preferred_plan_md, public_id, date_str)
+
+    async def read_agenda(self, public_id: str, date_str: str) -> Optional[Dict]:
+        return await self._call(get_agenda_store().get, public_id, date_str)
+
+    async def write_agenda(self, public_id: str, date_str: str, agenda: Dict) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._agendas.append((public_id, date_str, agenda, fut))
+        self._kick()
+        await fut
+
+    async def append_delivery(self, public_id: str, date_str: str, channel: str, ok: bool, provider_msg: str) -> None:
+        """For callers outside a DeliveryJournal; the pipeline's journal batches its own rows."""
+        fut = asyncio.get_running_loop().create_future()
+        self._deliveries.append(((public_id, date_str, channel, ok, provider_msg), fut))
+        self._kick()
+        await fut
+
+    def _kick(self) -> None:
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while self._agendas or self._deliveries:
+            agendas, self._agendas = self._agendas, []
+            deliveries, self._deliveries = self._deliveries, []
+            errors = await self._call(self._write_batch, agendas, deliveries)
+            self.flushes += 1
+            self.batched += len(agendas) + len(deliveries)
+            for (*_, fut), error in zip(agendas + deliveries, errors):
+                if fut.done():
+                    continue
+                if error is None:
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(error)
+
+    @staticmethod
+    def _write_batch(agendas: List, deliveries: List) -> List[Optional[Exception]]:
+        """Apply one batch; a failed write fails only its own caller."""
+        store = get_agenda_store()
+        errors: List[Optional[Exception]] = []
+        for public_id, date_str, agenda, _ in agendas:
+            try:
+                store.put(public_id, date_str, agenda)
+                errors.append(None)
+            except Exception as exc:
+                errors.append(exc)
+        for row, _ in deliveries:
+            try:
+                _append_delivery(*row)
+                errors.append(None)
+            except Exception as exc:
+                errors.append(exc)
+        return errors
+
+    async def run_in_pool(self, fn, *args):
+        """Run any other blocking call (e.g. a journal flush) on the same bounded pool."""
+        return await self._call(fn, *args)
+
+    async def aclose(self) -> None:
+        if self._flushing is not None:
+            await self._flushing
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"threads": self.threads, "flushes": self.flushes, "batched": self.batched}
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag: how late a ``LOOP_LAG_INTERVAL_S`` sleep wakes up.
+
+    Any blocking call on the loop thread shows up here as a late wake-up, so
+    the "loop_lag" histogram is the stall every in-flight request saw.
+    """
+
+    def __init__(self, metrics: "Metrics", interval: float = LOOP_LAG_INTERVAL_S) -> None:
+        self.metrics = metrics
+        self.interval = interval
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            self.metrics.observe("loop_lag", lag)
+
+    def start(self) -> None:
+        if self.metrics.enabled and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from typing import Dict, List, NamedTuple
+
+from .prompts import Template, estimate_tokens, plan_content
+
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "0"))
+GEMINI_BATCH_TOKEN_BUDGET = int(os.getenv("GEMINI_BATCH_TOKEN_BUDGET", "6000"))
+# Output room per user; generateContent caps maxOutputTokens at 8192 for flash models.
+BATCH_OUTPUT_TOKENS_PER_USER = 1000
+BATCH_MAX_OUTPUT_TOKENS = 8192
+
+
+class BatchEntry(NamedTuple):
+    user: Dict
+    local_now: datetime
+    plan_md: str
+    tokens: int
+
+
+def user_section(user: Dict, plan_md: str, date_str: str) -> str:
+    content = plan_content(plan_md, date_str).text
+    return f"### {user['public_id']}\n用户偏好/边界：{user.get('prefs') or ''}\n用户计划：\n---\n{content}\n---\n"
+
+
+def make_entry(user: Dict, local_now: datetime, plan_md: str) -> BatchEntry:
+    section = user_section(user, plan_md, local_now.strftime("%Y-%m-%d"))
+    return BatchEntry(user, local_now, plan_md, estimate_tokens(section))
+
+
+def plan_batches(entries: List[BatchEntry], size: int, token_budget: int) -> List[List[BatchEntry]]:
+    """Greedily pack entries in order into batches of at most ``size`` users and ``token_budget`` tokens.
+
+    An entry that alone exceeds the budget still gets a batch of its own.
+    """
+    batches: List[List[BatchEntry]] = []
+    current: List[BatchEntry] = []
+    used = 0
+    for entry in entries:
+        if current and (len(current) >= size or used + entry.tokens > token_budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(entry)
+        used += entry.tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_batch_prompt(template: Template, today: str, entries: List[BatchEntry]) -> str:
+    users = "\n".join(user_section(e.user, e.plan_md, today) for e in entries)
+    return template.render(today=today, users=users)
+
+
+def max_output_tokens(entries: List[BatchEntry]) -> int:
+    return min(BATCH_MAX_OUTPUT_TOKENS, BATCH_OUTPUT_TOKENS_PER_USER * len(entries))
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from .metrics import percentile
+from .scheduler import Scheduler
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+HTTP_MAX_CONN_PER_HOST = int(os.getenv("HTTP_MAX_CONN_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP2 = os.getenv("HTTP2", "0").lower() in ("1", "true", "yes")
+
+
+class RequestClock:
+    """Notes when the current task's latest request went on the wire, after any scheduler wait.
+
+    Set one as ``request_clock`` around a call to time the provider without
+    the queueing in front of it.
+    """
+
+    def __init__(self) -> None:
+        self.started: Optional[float] = None
+        self.sent = asyncio.Event()
+
+    def mark(self) -> None:
+        self.started = time.monotonic()
+        self.sent.set()
+
+
+request_clock: ContextVar[Optional[RequestClock]] = ContextVar("request_clock", default=None)
+
+
+def _mark_sent() -> None:
+    clock = request_clock.get()
+    if clock is not None:
+        clock.mark()
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _HostStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.opened = 0
+        self.reused = 0
+        self.errors = 0
+        self.latencies: List[float] = []
+
+    def as_dict(self) -> Dict:
+        p50 = percentile(self.latencies, 50)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.opened,
+            "connections_reused": self.reused,
+            "errors": self.errors,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+        }
+
+
+class ClientRegistry:
+    """Run-scoped pool of keep-alive HTTP clients, one per (scheme, host, port).
+
+    Each host gets its own connection limits so a slow provider cannot starve the
+    other. When a ``scheduler`` is given, every request is admitted through it
+    under its ``provider``/``key``. Create once per run and close it with
+    ``aclose()`` (or ``async with``).
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections_per_host: int = HTTP_MAX_CONN_PER_HOST,
+        max_keepalive: int = HTTP_MAX_KEEPALIVE,
+        keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        http2: bool = HTTP2,
+        scheduler: Optional[Scheduler] = None,
+        metrics: Optional["Metrics"] = None,
+    ) -> None:
+        self._limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._connect_timeout = connect_timeout
+        self._http2 = http2 and _h2_available()
+        self._scheduler = scheduler
+        self._metrics = metrics
+        self._clients: Dict[Tuple[str, str, Optional[int]], httpx.AsyncClient] = {}
+        self._stats: Dict[str, _HostStats] = {}
+
+    async def __aenter__(self) -> "ClientRegistry":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    def _client_for(self, url: str) -> Tuple[httpx.AsyncClient, _HostStats]:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname or "", parts.port)
+        client = self._clients.get(key)
+        if client is None:
+            client = httpx.AsyncClient(limits=self._limits, http2=self._http2)
+            self._clients[key] = client
+        host = parts.hostname or ""
+        stats = self._stats.get(host)
+        if stats is None:
+            stats = self._stats[host] = _HostStats()
+        return client, stats
+
+    async def post(
+        self,
+        url: str,
+        *,
+        content: bytes,
+        headers: Dict[str, str],
+        timeout: float,
+        provider: Optional[str] = None,
+        key: Optional[str] = None,
+        method: str = "POST",
+    ) -> httpx.Response:
+        async with self.stream(
+            url, content=content, headers=headers, timeout=timeout, provider=provider, key=key, method=method
+        ) as resp:
+            await resp.aread()
+            return resp
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        url: str,
+        *,
+        content: bytes,
+        headers: Dict[str, str],
+        timeout: float,
+        provider: Optional[str] = None,
+        key: Optional[str] = None,
+        method: str = "POST",
+    ) -> AsyncIterator[httpx.Response]:
+        """Send (POST by default) and yield the response before its body is read (for SSE endpoints)."""
+        if self._scheduler is None:
+            async with self._open(method, url, provider, content=content, headers=headers, timeout=timeout) as resp:
+                yield resp
+            return
+        async with self._scheduler.slot(provider, key) as slot:
+            async with self._open(method, url, provider, content=content, headers=headers, timeout=timeout) as resp:
+                slot.record(resp.status_code)
+                yield resp
+
+    @asynccontextmanager
+    async def _open(
+        self,
+        method: str,
+        url: str,
+        provider: Optional[str],
+        *,
+        content: bytes,
+        headers: Dict[str, str],
+        timeout: float,
+    ) -> AsyncIterator[httpx.Response]:
+        client, stats = self._client_for(url)
+        opened = False
+        status = "error"
+
+        async def trace(event_name: str, info: Dict) -> None:
+            nonlocal opened
+            if event_name == "connection.connect_tcp.started":
+                opened = True
+
+        request = client.build_request(
+            method,
+            url,
+            headers=headers,
+            content=content,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, self._connect_timeout)),
+            extensions={"trace": trace},
+        )
+        stats.requests += 1
+        _mark_sent()
+        started = time.perf_counter()
+        try:
+            resp = await client.send(request, stream=True)
+            status = str(resp.status_code)
+            try:
+                yield resp
+            finally:
+                await resp.aclose()
+        except asyncio.CancelledError:
+            # Abandoned by the caller (e.g. a losing hedge): neither an error nor a finished request.
+            if status == "error":
+                status = "cancelled"
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if self._metrics is not None:
+                self._metrics.observe("http_request", elapsed, provider=provider or urlsplit(url).hostname, status=status)
+            if opened:
+                stats.opened += 1
+            if status != "cancelled":
+                stats.latencies.append(elapsed)
+                if not opened:
+                    stats.reused += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per-host request, connection reuse and p50 latency counters for this run."""
+        return {host: s.as_dict() for host, s in self._stats.items()}
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+async def post(
+    registry: Optional[ClientRegistry],
+    url: str,
+    *,
+    content: bytes,
+    headers: Dict[str, str],
+    timeout: float,
+    provider: Optional[str] = None,
+    key: Optional[str] = None,
+    method: str = "POST",
+) -> httpx.Response:
+    """POST (or ``method``) through ``registry`` when given, else through a one-off client."""
+    if registry is not None:
+        return await registry.post(
+            url, content=content, headers=headers, timeout=timeout, provider=provider, key=key, method=method
+        )
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        _mark_sent()
+        return await client.request(method, url, headers=headers, content=content)
+
+
+@asynccontextmanager
+async def stream(
+    registry: Optional[ClientRegistry],
+    url: str,
+    *,
+    content: bytes,
+    headers: Dict[str, str],
+    timeout: float,
+    provider: Optional[str] = None,
+    key: Optional[str] = None,
+    method: str = "POST",
+) -> AsyncIterator[httpx.Response]:
+    """Streaming counterpart of ``post``."""
+    if registry is not None:
+        async with registry.stream(
+            url, content=content, headers=headers, timeout=timeout, provider=provider, key=key, method=method
+        ) as resp:
+            yield resp
+        return
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        _mark_sent()
+        async with client.stream(method, url, headers=headers, content=content) as resp:
+            yield resp
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import os
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .local_planner import parse_windows
+
+CONSTRAINTS_REPROMPT = os.getenv("CONSTRAINTS_REPROMPT", "1") == "1"
+MIN_BLOCK_MIN = 10
+_OVERTIME_WORDS = ("不加班", "no overtime")
+_KIND_TEXT = {
+    "invalid_time": "时间格式无效",
+    "end_before_start": "结束时间不晚于开始时间",
+    "overlap": "与其他时间块重叠",
+    "break": "占用了休息时段",
+    "after_hours": "超出下班时间",
+}
+
+
+class Violation(NamedTuple):
+    kind: str  # invalid_time | end_before_start | overlap | break | after_hours
+    index: int
+    detail: str
+
+
+class IntervalTree:
+    """Static interval tree over half-open [start, end) minute ranges.
+
+    Intervals are sorted by start once and viewed as an implicit balanced BST
+    over the array, each node caching the largest end in its subtree, so an
+    overlap query costs O(log n + hits) and building costs O(n log n).
+    """
+
+    def __init__(self, intervals: Sequence[Tuple[int, int, object]]) -> None:
+        self._items = sorted(intervals, key=lambda iv: (iv[0], iv[1]))
+        self._max_end = [0] * len(self._items)
+        self._build(0, len(self._items))
+
+    def _build(self, lo: int, hi: int) -> int:
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        best = max(self._items[mid][1], self._build(lo, mid), self._build(mid + 1, hi))
+        self._max_end[mid] = best
+        return best
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def overlapping(self, start: int, end: int) -> List[Tuple[int, int, object]]:
+        out: List[Tuple[int, int, object]] = []
+        self._query(0, len(self._items), start, end, out)
+        return out
+
+    def _query(self, lo: int, hi: int, start: int, end: int, out: List) -> None:
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] <= start:
+            return
+        self._query(lo, mid, start, end, out)
+        item = self._items[mid]
+        if item[0] < end:
+            if item[1] > start:
+                out.append(item)
+            self._query(mid + 1, hi, start, end, out)
+
+
+class Constraints(NamedTuple):
+    breaks: IntervalTree  # (start, end, label)
+    latest_end: Optional[int]
+
+
+@lru_cache(maxsize=1024)
+def constraints_for(prefs: str, weekday: int) -> Constraints:
+    """Parse ``prefs`` once per (prefs, weekday) into break intervals and an evening cut-off."""
+    windows, breaks, notes = parse_windows(prefs, weekday)
+    latest_end = None
+    if windows and any(w in note.lower() for note in notes for w in _OVERTIME_WORDS):
+        latest_end = max(end for _, end in windows)
+    return Constraints(IntervalTree([(s, e, label) for label, s, e in breaks]), latest_end)
+
+
+def constraints_for_date(prefs: str, date_str: str) -> Constraints:
+    return constraints_for(prefs or "", date.fromisoformat(date_str).weekday())
+
+
+def _minutes(hhmm: str) -> Optional[int]:
+    try:
+        h, m = str(hhmm).strip().split(":")
+        value = int(h) * 60 + int(m)
+    except ValueError:
+        return None
+    return value if 0 <= value <= 24 * 60 else None
+
+
+def _hhmm(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def validate(agenda: Dict, cons: Constraints) -> List[Violation]:
+    """All constraint violations of an agenda's blocks, in O(n log n)."""
+    violations: List[Violation] = []
+    spans: List[Tuple[int, int, int]] = []
+    for i, block in enumerate(agenda.get("blocks") or []):
+        start, end = _minutes(block.get("start", "")), _minutes(block.get("end", ""))
+        if start is None or end is None:
+            violations.append(Violation("invalid_time", i, f"{block.get('start')}-{block.get('end')}"))
+            continue
+        if end <= start:
+            violations.append(Violation("end_before_start", i, f"{block['start']}-{block['end']}"))
+            continue
+        spans.append((start, end, i))
+        for bs, be, label in cons.breaks.overlapping(start, end):
+            violations.append(Violation("break", i, f"{label or '休息'} {_hhmm(bs)}-{_hhmm(be)}"))
+        if cons.latest_end is not None and end > cons.latest_end:
+            violations.append(Violation("after_hours", i, f"ends {block['end']} after {_hhmm(cons.latest_end)}"))
+    tree = IntervalTree(spans)
+    for start, end, i in spans:
+        for _, _, j in tree.overlapping(start, end):
+            if j > i:
+                violations.append(Violation("overlap", j, f"overlaps block {i}"))
+    return violations
+
+
+def repair(agenda: Dict, cons: Constraints) -> Tuple[Dict, List[str], List[str]]:
+    """Fix violations locally by swapping, merging, shifting, splitting and trimming blocks.
+
+    Blocks keep their order and duration where possible: each is shifted past
+    the previous one and out of breaks, split around a break it runs into,
+    and trimmed at the evening cut-off.
+
+    Returns:
+        (agenda, actions, lost) where lost lists tasks that could not keep their
+        full duration; a non-empty ``lost`` is the cue for one targeted re-prompt.
+    """
+    actions: List[str] = []
+    lost: List[str] = []
+    items: List[List] = []
+    for block in agenda.get("blocks") or []:
+        start, end = _minutes(block.get("start", "")), _minutes(block.get("end", ""))
+        if start is None or end is None or start == end:
+            actions.append("drop")
+            lost.append(block.get("task", ""))
+            continue
+        if end < start:
+            start, end = end, start
+            actions.append("swap")
+        items.append([start, end, block])
+    items.sort(key=lambda it: (it[0], it[1]))
+
+    merged: List[List] = []
+    for item in items:
+        prev = merged[-1] if merged else None
+        if prev and prev[2].get("task") == item[2].get("task") and item[0] <= prev[1]:
+            prev[1] = max(prev[1], item[1])
+            actions.append("merge")
+            continue
+        merged.append(item)
+
+    limit = cons.latest_end if cons.latest_end is not None else 24 * 60
+    blocks: List[Dict] = []
+    cursor = 0
+    for start, end, block in merged:
+        left = end - start
+        if start < cursor:
+            start = cursor
+            actions.append("shift")
+        while left > 0:
+            hits = cons.breaks.overlapping(start, start + left)
+            if hits:
+                bs, be, _ = min(hits)
+                if start >= bs:
+                    start = be
+                    actions.append("shift")
+                    continue
+                # Runs into a break: keep the part before it, continue after it.
+                blocks.append(dict(block, start=_hhmm(start), end=_hhmm(bs)))
+                actions.append("split")
+                cursor = bs
+                left -= bs - start
+                start = be
+                continue
+            end = min(start + left, limit)
+            if end - start < MIN_BLOCK_MIN:
+                lost.append(block.get("task", ""))
+                break
+            if end < start + left:
+                actions.append("trim")
+                lost.append(block.get("task", ""))
+            blocks.append(dict(block, start=_hhmm(start), end=_hhmm(end)))
+            cursor = end
+            break
+    repaired = dict(agenda, blocks=blocks)
+    return repaired, actions, lost
+
+
+def describe(violations: Sequence[Violation], agenda: Dict) -> str:
+    """Violations as prompt lines for the targeted re-prompt."""
+    blocks = agenda.get("blocks") or []
+    lines = []
+    for v in violations:
+        task = blocks[v.index].get("task", "") if v.index < len(blocks) else ""
+        lines.append(f"- 第{v.index + 1}块「{task}」：{_KIND_TEXT.get(v.kind, v.kind)}（{v.detail}）")
+    return "\n".join(lines)
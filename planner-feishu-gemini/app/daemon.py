@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import os
+import signal
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from . import main as app
+from .data_io import DATA_DIR, load_users_by_tz
+from .metrics import Metrics
+from .prompts import PROMPT_PATHS, template
+from .timewin import PushWindowIndex, next_push_utc, now_utc, to_local
+
+DAEMON_POLL_S = float(os.getenv("DAEMON_POLL_S", "30"))
+DAEMON_RETRY_MIN = float(os.getenv("DAEMON_RETRY_MIN", "5"))
+USERS_CSV = os.path.join(DATA_DIR, "users.csv")
+
+PUSH, RETRY, PREGEN = "push", "retry", "pregen"
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class FireSchedule:
+    """Min-heap of (UTC fire time, kind, timezone) for every timezone bucket.
+
+    All users of a zone share one push instant (local PUSH_HOUR:00), so the
+    heap holds one entry per zone and kind rather than one per user. ``push``
+    fires exactly at the local push hour, ``retry`` DAEMON_RETRY_MIN later for
+    anyone the ledger still lists as pending, and ``pregen`` PREGEN_LEAD_HOURS
+    ahead of the push.
+    """
+
+    def __init__(self, index: PushWindowIndex, utc_now: datetime) -> None:
+        self.index = index
+        self._heap: List[Tuple[datetime, str, str]] = []
+        for tz_name in index.buckets:
+            if tz_name in index.invalid:
+                continue
+            self._schedule(tz_name, utc_now)
+
+    def _schedule(self, tz_name: str, after: datetime) -> None:
+        push = next_push_utc(after, tz_name, app.PUSH_HOUR)
+        heapq.heappush(self._heap, (push, PUSH, tz_name))
+        if app.PREGEN_LEAD_HOURS > 0:
+            lead = timedelta(hours=app.PREGEN_LEAD_HOURS)
+            # The next push whose pregen instant is still ahead of us.
+            pregen_push = next_push_utc(after + lead, tz_name, app.PUSH_HOUR)
+            heapq.heappush(self._heap, (pregen_push - lead, PREGEN, tz_name))
+
+    def next_fire(self) -> Optional[datetime]:
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, utc_now: datetime) -> Tuple[List, List]:
+        """Pop every entry due by ``utc_now`` and return (due, pregen) lists of (user, local_now)."""
+        due: List = []
+        pregen: List = []
+        while self._heap and self._heap[0][0] <= utc_now:
+            fire, kind, tz_name = heapq.heappop(self._heap)
+            users = self.index.buckets.get(tz_name, [])
+            local_now = to_local(utc_now, tz_name)
+            if kind == PREGEN:
+                pregen.extend((u, local_now) for u in users)
+                lead = timedelta(hours=app.PREGEN_LEAD_HOURS)
+                next_pregen = next_push_utc(fire + lead, tz_name, app.PUSH_HOUR) - lead
+                heapq.heappush(self._heap, (next_pregen, PREGEN, tz_name))
+                continue
+            due.extend((u, local_now) for u in users)
+            if kind == PUSH:
+                heapq.heappush(self._heap, (next_push_utc(fire, tz_name, app.PUSH_HOUR), PUSH, tz_name))
+                if DAEMON_RETRY_MIN > 0:
+                    heapq.heappush(self._heap, (fire + timedelta(minutes=DAEMON_RETRY_MIN), RETRY, tz_name))
+        return due, pregen
+
+
+def _reload_prompts(mtimes: Dict[str, Optional[int]]) -> bool:
+    """Drop compiled prompt templates when any prompt file changed on disk."""
+    current = {path: _mtime(path) for path in PROMPT_PATHS}
+    if current == mtimes:
+        return False
+    mtimes.clear()
+    mtimes.update(current)
+    template.cache_clear()
+    return True
+
+
+async def run_daemon(stop: Optional[asyncio.Event] = None) -> None:
+    """Serve pushes until SIGINT/SIGTERM (or ``stop``), sleeping until the next timezone's push hour.
+
+    Starts with one cron-style tick so users already inside their window are
+    served, and repeats it whenever users.csv changes (the ledger keeps
+    anyone from being served twice). Plans are read at fire time and the plan
+    index refreshes itself on directory changes, and prompt templates are
+    recompiled when their files change.
+    """
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    users_mtime: Optional[int] = -1
+    prompt_mtimes: Dict[str, Optional[int]] = {}
+    schedule: Optional[FireSchedule] = None
+    while not stop.is_set():
+        mtime = _mtime(USERS_CSV)
+        if mtime != users_mtime:
+            users_mtime = mtime
+            index = PushWindowIndex(load_users_by_tz())
+            schedule = FireSchedule(index, now_utc())
+            await app.main()  # catch up with users already inside their push window
+            next_fire = schedule.next_fire()
+            print(json.dumps({
+                "daemon": "loaded",
+                "timezones": len(index.buckets),
+                "next_fire": next_fire.isoformat() if next_fire else None,
+            }))
+        _reload_prompts(prompt_mtimes)
+        fire_at = schedule.next_fire() if schedule else None
+        delay = DAEMON_POLL_S
+        if fire_at is not None:
+            delay = min(delay, max(0.0, (fire_at - now_utc()).total_seconds()))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=delay)
+            break
+        except asyncio.TimeoutError:
+            pass
+        due, pregen = schedule.pop_due(now_utc()) if schedule else ([], [])
+        if due or pregen:
+            await app.run_due(due, pregen, time.perf_counter(), Metrics())
+    print(json.dumps({"daemon": "stopped"}))
@@ -1,11 +1,13 @@
 from __future__ import annotations
 
 import csv
+import hashlib
 import json
 import os
+import re
+import threading
 from datetime import datetime
-from glob import glob
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import pytz
 
@@ -13,6 +15,10 @@ DATA_DIR = "data"
 PLANS_DIR = os.path.join(DATA_DIR, "plans")
 AGENDAS_DIR = os.path.join(DATA_DIR, "agendas")
 DELIVERIES_CSV = os.path.join(DATA_DIR, "deliveries.csv")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+PLAN_INDEX_PATH = os.path.join(CACHE_DIR, "plan_index.json")
+
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
 
 
 def _ensure_dir(path: str) -> None:
@@ -50,64 +56,192 @@ def load_users() -> List[Dict]:
     return users
 
 
-def load_latest_plan_md(public_id: str) -> Optional[str]:
-    pattern = os.path.join(PLANS_DIR, f"{public_id}.*.md")
-    files = glob(pattern)
-    if not files:
-        return None
-    # pick latest modified
-    latest = max(files, key=lambda p: os.path.getmtime(p))
-    try:
-        with open(latest, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception:
-        return None
+def load_users_by_tz() -> Dict[str, List[Dict]]:
+    """Active users from ``load_users`` grouped by their timezone name."""
+    buckets: Dict[str, List[Dict]] = {}
+    for user in load_users():
+        buckets.setdefault(user["timezone"], []).append(user)
+    return buckets
 
 
-def load_preferred_plan_md(public_id: str, date_str: str) -> Optional[str]:
-    """Prefer a plan file for the given date: {public_id}.{YYYY-MM-DD}*.md; else fallback to latest.
+class PlanIndex:
+    """One-pass index of ``data/plans``: public_id -> {date -> candidate files, all files}.
+
+    Built from a single ``os.scandir``, persisted to ``data/cache/plan_index.json``
+    and rebuilt only when the directory mtime changes (files added, removed or
+    renamed). Editing or touching a file leaves the directory mtime alone, so
+    the index keeps only the file names and a lookup stats that user's
+    candidates to pick the newest. Matching mirrors the old globs:
+    ``{public_id}.*.md`` for latest and ``{public_id}.{YYYY-MM-DD}*.md`` for a date.
     """
-    pattern_today = os.path.join(PLANS_DIR, f"{public_id}.{date_str}*.md")
-    files_today = glob(pattern_today)
-    if files_today:
-        latest_today = max(files_today, key=lambda p: os.path.getmtime(p))
+
+    VERSION = 2
+
+    def __init__(self, plans_dir: str = PLANS_DIR) -> None:
+        self.plans_dir = plans_dir
+        self.dir_mtime_ns: Optional[int] = None
+        # public_id -> {"files": [name, ...], "dates": {date: [name, ...]}}
+        self.entries: Dict[str, Dict] = {}
+
+    @classmethod
+    def load(cls, path: str = PLAN_INDEX_PATH, plans_dir: str = PLANS_DIR) -> "PlanIndex":
+        index = cls(plans_dir)
         try:
-            with open(latest_today, "r", encoding="utf-8") as f:
-                return f.read()
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("plans_dir") == plans_dir and data.get("version") == cls.VERSION:
+                index.dir_mtime_ns = data.get("dir_mtime_ns")
+                index.entries = data.get("entries") or {}
         except Exception:
             pass
-    return load_latest_plan_md(public_id)
+        if index.refresh():
+            try:
+                index.save(path)
+            except OSError:
+                pass
+        return index
+
+    def refresh(self) -> bool:
+        """Rescan if the plans directory changed since the last scan; return True if rescanned."""
+        try:
+            mtime_ns = os.stat(self.plans_dir).st_mtime_ns
+        except OSError:
+            changed = self.dir_mtime_ns is not None or bool(self.entries)
+            self.dir_mtime_ns, self.entries = None, {}
+            return changed
+        if mtime_ns == self.dir_mtime_ns:
+            return False
+        self._scan()
+        self.dir_mtime_ns = mtime_ns
+        return True
+
+    def _scan(self) -> None:
+        entries: Dict[str, Dict] = {}
+        with os.scandir(self.plans_dir) as it:
+            for entry in it:
+                name = entry.name
+                if not name.endswith(".md") or not entry.is_file():
+                    continue
+                stem = name[:-3]
+                # A public_id may itself contain dots, so register every dot prefix.
+                pos = stem.find(".")
+                while pos != -1:
+                    slot = entries.setdefault(stem[:pos], {"files": [], "dates": {}})
+                    slot["files"].append(name)
+                    m = _DATE_RE.match(stem, pos + 1)
+                    if m:
+                        slot["dates"].setdefault(m.group(0), []).append(name)
+                    pos = stem.find(".", pos + 1)
+        self.entries = entries
+
+    def save(self, path: str = PLAN_INDEX_PATH) -> None:
+        _ensure_dir(os.path.dirname(path))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "plans_dir": self.plans_dir,
+                    "dir_mtime_ns": self.dir_mtime_ns,
+                    "entries": self.entries,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp, path)
+
+    def _newest(self, names: List[str]) -> Optional[str]:
+        """Stat the candidates now, so an edited older file wins; ties go to the larger name."""
+        best: Optional[Tuple[int, str]] = None
+        for name in names:
+            try:
+                item = (os.stat(os.path.join(self.plans_dir, name)).st_mtime_ns, name)
+            except OSError:
+                continue
+            if best is None or item > best:
+                best = item
+        return os.path.join(self.plans_dir, best[1]) if best else None
+
+    def latest_path(self, public_id: str) -> Optional[str]:
+        slot = self.entries.get(public_id)
+        return self._newest(slot["files"]) if slot else None
+
+    def preferred_path(self, public_id: str, date_str: str) -> Optional[str]:
+        slot = self.entries.get(public_id)
+        if slot and date_str in slot["dates"]:
+            path = self._newest(slot["dates"][date_str])
+            if path:
+                return path
+        return self.latest_path(public_id)
 
 
-def _agenda_path(public_id: str, date_str: str) -> str:
-    date_dir = os.path.join(AGENDAS_DIR, date_str)
-    _ensure_dir(date_dir)
-    return os.path.join(date_dir, f"{public_id}.json")
+_plan_index: Optional[PlanIndex] = None
+_plan_index_lock = threading.Lock()
 
 
-def read_agenda(public_id: str, date_str: str) -> Optional[Dict]:
-    path = _agenda_path(public_id, date_str)
-    if not os.path.exists(path):
+def get_plan_index() -> PlanIndex:
+    """Process-wide PlanIndex, loaded from disk once and refreshed on directory changes.
+
+    Thread-safe, since plan reads may run on the async I/O pool.
+    """
+    global _plan_index
+    with _plan_index_lock:
+        if _plan_index is None:
+            _plan_index = PlanIndex.load()
+        elif _plan_index.refresh():
+            try:
+                _plan_index.save()
+            except OSError:
+                pass
+        return _plan_index
+
+
+def _read_plan(path: Optional[str]) -> Optional[str]:
+    if not path:
         return None
     try:
         with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            return f.read()
     except Exception:
         return None
 
 
-def write_agenda(public_id: str, date_str: str, agenda: Dict) -> None:
-    path = _agenda_path(public_id, date_str)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(agenda, f, ensure_ascii=False, indent=2)
+def load_latest_plan_md(public_id: str, index: Optional[PlanIndex] = None) -> Optional[str]:
+    return _read_plan((index or get_plan_index()).latest_path(public_id))
 
 
-def append_delivery(public_id: str, date_str: str, channel: str, ok: bool, provider_msg: str) -> None:
-    header = ["ts", "public_id", "date", "channel", "status", "provider_message"]
-    need_header = not os.path.exists(DELIVERIES_CSV)
-    with open(DELIVERIES_CSV, "a", encoding="utf-8", newline="") as f:
+def load_preferred_plan_md(public_id: str, date_str: str, index: Optional[PlanIndex] = None) -> Optional[str]:
+    """Prefer a plan file for the given date: {public_id}.{YYYY-MM-DD}*.md; else fallback to latest.
+    """
+    index = index or get_plan_index()
+    text = _read_plan(index.preferred_path(public_id, date_str))
+    if text is None:
+        text = _read_plan(index.latest_path(public_id))
+    return text
+
+
+def plan_hash(plan_md: str) -> str:
+    """Content hash stored with generated agendas to detect plan edits."""
+    return hashlib.sha256(plan_md.encode("utf-8")).hexdigest()[:16]
+
+
+DELIVERY_HEADER = ["ts", "public_id", "date", "channel", "status", "provider_message"]
+
+
+def delivery_row(public_id: str, date_str: str, channel: str, ok: bool, provider_msg: str) -> List[str]:
+    ts = datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
+    return [ts, public_id, date_str, channel, "ok" if ok else "fail", provider_msg]
+
+
+def write_delivery_rows(rows: List[List[str]], path: str = DELIVERIES_CSV) -> None:
+    """Append rows to the deliveries CSV with one open/close, writing the header for a new file."""
+    need_header = not os.path.exists(path)
+    with open(path, "a", encoding="utf-8", newline="") as f:
         writer = csv.writer(f)
         if need_header:
-            writer.writerow(header)
-        ts = datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
-        writer.writerow([ts, public_id, date_str, channel, "ok" if ok else "fail", provider_msg])
+            writer.writerow(DELIVERY_HEADER)
+        writer.writerows(rows)
+
+
+def append_delivery(public_id: str, date_str: str, channel: str, ok: bool, provider_msg: str) -> None:
+    write_delivery_rows([delivery_row(public_id, date_str, channel, ok, provider_msg)])
@@ -4,10 +4,13 @@ import base64
 import hashlib
 import hmac
 import json
+import os
 import time
 from typing import Optional, Tuple
 
-import httpx
+from .clients import ClientRegistry, post
+
+FEISHU_TIMEOUT = float(os.getenv("FEISHU_TIMEOUT", "15"))
 
 
 def gen_signature(secret: str) -> tuple[str, str]:
@@ -24,10 +27,13 @@ def gen_signature(secret: str) -> tuple[str, str]:
     return timestamp, sign
 
 
-async def send_text(webhook: str, text: str, secret: Optional[str] = None) -> tuple[bool, str]:
+async def send_text(
+    webhook: str, text: str, secret: Optional[str] = None, clients: Optional[ClientRegistry] = None
+) -> tuple[bool, str]:
     """Send text message to Feishu custom bot webhook.
 
     If secret is provided, append &timestamp=...&sign=... query params.
+    Pass the run's ``clients`` registry to reuse pooled keep-alive connections.
 
     Returns (ok, response_text). Non-200 or Feishu StatusCode != 0 => ok=False.
     """
@@ -46,11 +52,18 @@ async def send_text(webhook: str, text: str, secret: Optional[str] = None) -> tu
     payload = {"msg_type": "text", "content": {"text": text}}
     headers = {"Content-Type": "application/json"}
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        try:
-            resp = await client.post(url, headers=headers, content=json.dumps(payload, ensure_ascii=False).encode("utf-8"))
-        except Exception as exc:
-            return False, f"http_error: {exc}"
+    try:
+        resp = await post(
+            clients,
+            url,
+            headers=headers,
+            content=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            timeout=FEISHU_TIMEOUT,
+            provider="feishu",
+            key=webhook,
+        )
+    except Exception as exc:
+        return False, f"http_error: {exc}"
 
     if resp.status_code != 200:
         return False, f"http_status_{resp.status_code}: {resp.text}"
@@ -1,12 +1,28 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
 import os
-from typing import Optional
+import time
+from typing import Awaitable, Callable, Dict, Optional
 
 import httpx
 
+from .clients import ClientRegistry, post, stream
+from .data_io import CACHE_DIR
+from .llm_cache import LLMCache, cache_key
+from .resilience import Resilience
+from .scheduler import is_congestion_status
+
 DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+GEMINI_STREAM = os.getenv("GEMINI_STREAM", "0").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "0").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_TTL_S = int(os.getenv("GEMINI_CONTEXT_TTL_S", "3600"))
+GEMINI_CONTEXT_RETRY_H = float(os.getenv("GEMINI_CONTEXT_RETRY_H", "24"))
+CONTEXT_CACHE_PATH = os.path.join(CACHE_DIR, "gemini_context.json")
 
 
 def _get_temperature() -> float:
@@ -18,53 +34,385 @@ def _get_temperature() -> float:
 
 
 class GeminiError(RuntimeError):
-    pass
+    """``status`` is the HTTP status if a response arrived; ``retryable`` marks 429/5xx and transport errors."""
+
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = False) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class CircuitOpen(GeminiError):
+    """Raised without a request while the resilience breaker considers Gemini degraded."""
+
+
+def _status_error(status: int, text: str) -> GeminiError:
+    return GeminiError(f"status_{status}: {text}", status=status, retryable=is_congestion_status(status))
+
+
+def _transport_error(exc: Exception) -> GeminiError:
+    return GeminiError(f"http_error: {exc}", retryable=True)
+
+
+def build_payload(prompt: str, max_output_tokens: int = 1000, system: Optional[str] = None) -> dict:
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": _get_temperature(),
+            "maxOutputTokens": max_output_tokens,
+            "responseMimeType": "application/json"
+        },
+    }
+    if system:
+        payload["systemInstruction"] = {"parts": [{"text": system}]}
+    return payload
+
+
+def _api_key() -> str:
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise GeminiError("Missing GOOGLE_API_KEY env")
+    return api_key
+
+
+async def _call_json(method: str, path: str, body: dict, clients: Optional[ClientRegistry], query: str = "") -> dict:
+    url = f"{GEMINI_BASE_URL}/v1beta/{path}?key={_api_key()}{query}"
+    try:
+        resp = await post(
+            clients,
+            url,
+            headers={"Content-Type": "application/json"},
+            content=json.dumps(body, ensure_ascii=False).encode("utf-8"),
+            timeout=GEMINI_TIMEOUT,
+            provider="gemini",
+            method=method,
+        )
+    except Exception as exc:
+        raise _transport_error(exc) from exc
+    if resp.status_code != 200:
+        raise _status_error(resp.status_code, resp.text)
+    try:
+        return resp.json()
+    except Exception as exc:
+        raise GeminiError(f"invalid_json_response: {resp.text[:500]}") from exc
+
+
+class ContextCache:
+    """``cachedContents`` handles for static system instructions, reused across runs.
+
+    Handles are keyed by model and instruction hash and persisted with their
+    expiry in ``data/cache/gemini_context.json``. A handle close to expiry has
+    its TTL extended; a missing or expired one is recreated. If the API will
+    not create one, callers send the instruction inline instead. A refusal
+    (4xx, e.g. the instruction is below the model's minimum cacheable size)
+    is saved with the handles and the key is not retried for
+    GEMINI_CONTEXT_RETRY_H; a transient failure skips the key for this run only.
+    """
+
+    def __init__(
+        self, path: str = CONTEXT_CACHE_PATH, ttl_s: int = GEMINI_CONTEXT_TTL_S, retry_s: float = GEMINI_CONTEXT_RETRY_H * 3600
+    ) -> None:
+        self.path = path
+        self.ttl_s = ttl_s
+        self.retry_s = retry_s
+        self.refresh_s = max(60, ttl_s // 4)
+        self._handles: Dict[str, Dict] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # key -> time until which a refusal is remembered across runs, or None for this run only
+        self._unavailable: Dict[str, Optional[float]] = {}
+        self._dirty = False
+        self.created = 0
+        self.refreshed = 0
+        self.reused = 0
+        self.fallbacks = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            data = {}
+        now = time.time()
+        for key, entry in data.items():
+            if entry.get("unavailable"):
+                if entry["expires"] > now:
+                    self._unavailable[key] = entry["expires"]
+            else:
+                self._handles[key] = entry
+
+    @staticmethod
+    def _key(mdl: str, system: str) -> str:
+        return f"{mdl}:{hashlib.sha256(system.encode('utf-8')).hexdigest()[:16]}"
+
+    async def handle(self, mdl: str, system: str, clients: Optional[ClientRegistry]) -> Optional[str]:
+        """Name of a live cachedContents entry holding ``system``, or None to send it inline."""
+        key = self._key(mdl, system)
+        if key in self._unavailable:
+            return None
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            if key in self._unavailable:  # a concurrent caller's create just failed
+                return None
+            entry = self._handles.get(key)
+            now = time.time()
+            if entry and entry["expires"] - now > self.refresh_s:
+                self.reused += 1
+                return entry["name"]
+            ttl = {"ttl": f"{self.ttl_s}s"}
+            if entry and entry["expires"] > now:
+                try:
+                    await _call_json("PATCH", entry["name"], ttl, clients, "&updateMask=ttl")
+                    entry["expires"] = now + self.ttl_s
+                    self.refreshed += 1
+                    self._dirty = True
+                    return entry["name"]
+                except GeminiError:
+                    pass
+            body = dict(ttl, model=f"models/{mdl}", systemInstruction={"parts": [{"text": system}]})
+            try:
+                data = await _call_json("POST", "cachedContents", body, clients)
+                name = data["name"]
+            except (GeminiError, KeyError, TypeError) as exc:
+                self._handles.pop(key, None)
+                # A 4xx answer (or a malformed one) will not change by itself; 429 and 5xx may.
+                refused = not isinstance(exc, GeminiError) or (exc.status is not None and 400 <= exc.status < 500 and not exc.retryable)
+                self._unavailable[key] = now + self.retry_s if refused else None
+                self._dirty = True
+                return None
+            self._handles[key] = {"name": name, "expires": now + self.ttl_s}
+            self.created += 1
+            self._dirty = True
+            return name
+
+    def invalidate(self, mdl: str, system: str) -> None:
+        if self._handles.pop(self._key(mdl, system), None) is not None:
+            self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        now = time.time()
+        data = {k: v for k, v in self._handles.items() if v["expires"] > now}
+        data.update({k: {"unavailable": True, "expires": until} for k, until in self._unavailable.items() if until and until > now})
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def stats(self) -> Dict[str, int]:
+        return {"created": self.created, "refreshed": self.refreshed, "reused": self.reused, "fallbacks": self.fallbacks}
 
 
-async def generate_text(prompt: str, model: Optional[str] = None) -> str:
+def _is_cache_miss(exc: GeminiError) -> bool:
+    # An unknown, expired or foreign cachedContent name is rejected as 400/403/404.
+    return exc.status in (400, 403, 404)
+
+
+async def _with_context(
+    payload: dict,
+    mdl: str,
+    clients: Optional[ClientRegistry],
+    context: Optional[ContextCache],
+    call: Callable[[dict], Awaitable[str]],
+) -> str:
+    """Run ``call`` with the payload's systemInstruction swapped for a cached handle when one is available."""
+    system = payload.get("systemInstruction")
+    if context is None or not system:
+        return await call(payload)
+    text = system["parts"][0]["text"]
+    name = await context.handle(mdl, text, clients)
+    if name is None:
+        return await call(payload)
+    cached = {k: v for k, v in payload.items() if k != "systemInstruction"}
+    cached["cachedContent"] = name
+    try:
+        return await call(cached)
+    except GeminiError as exc:
+        if not _is_cache_miss(exc):
+            raise
+        context.invalidate(mdl, text)
+        context.fallbacks += 1
+        return await call(payload)
+
+
+async def generate_text(
+    prompt: str,
+    model: Optional[str] = None,
+    clients: Optional[ClientRegistry] = None,
+    cache: Optional[LLMCache] = None,
+    max_output_tokens: int = 1000,
+    system: Optional[str] = None,
+    context: Optional[ContextCache] = None,
+    usage: Optional[Dict] = None,
+    resilience: Optional[Resilience] = None,
+) -> str:
     """Call Google Generative Language API v1beta generateContent and return text.
 
     Args:
         prompt: The prompt string.
         model: Optional model name; defaults to env GEMINI_MODEL or gemini-1.5-flash.
+        clients: Optional run-scoped client registry; a one-off client is used if omitted.
+        cache: Optional LLM result cache; identical requests are served from it and
+            concurrent duplicates share one in-flight call.
+        max_output_tokens: generationConfig.maxOutputTokens; raise it for batched prompts.
+        system: Optional static instruction, sent as systemInstruction.
+        context: Optional ContextCache; ``system`` then goes through a cachedContents
+            handle, falling back to inline if the handle is missing or rejected.
+        usage: Optional dict that receives the response's usageMetadata and ``latency_ms``.
+        resilience: Optional run-scoped Resilience; adds retries with backoff, hedged
+            duplicates for slow responses and a circuit breaker.
 
     Returns:
         The text from candidates[0].content.parts[0].text.
 
     Raises:
-        GeminiError on HTTP or payload errors.
+        GeminiError on HTTP or payload errors; CircuitOpen while the breaker is open.
     """
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise GeminiError("Missing GOOGLE_API_KEY env")
     mdl = model or DEFAULT_MODEL
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{mdl}:generateContent?key={api_key}"
+    payload = build_payload(prompt, max_output_tokens, system)
+
+    def attempt(m: str) -> Awaitable[str]:
+        return _with_context(payload, m, clients, context, lambda p: _generate(p, m, clients, usage))
+
+    def factory() -> Awaitable[str]:
+        if resilience is None:
+            return attempt(mdl)
+        return _resilient(resilience, attempt, mdl)
+
+    if cache is None:
+        return await factory()
+    return await cache.get_or_create(cache_key(mdl, payload), factory)
+
+
+async def stream_generate_text(
+    prompt: str,
+    model: Optional[str] = None,
+    clients: Optional[ClientRegistry] = None,
+    cache: Optional[LLMCache] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    timings: Optional[Dict[str, float]] = None,
+    system: Optional[str] = None,
+    context: Optional[ContextCache] = None,
+    resilience: Optional[Resilience] = None,
+) -> str:
+    """Like ``generate_text`` but via the streamGenerateContent SSE endpoint.
+
+    Each text delta is passed to ``on_text`` as it arrives; an exception raised
+    there aborts the stream and propagates, so callers can bail out early on
+    output that cannot be used. ``timings["ttft_ms"]`` receives the time to the
+    first text delta and ``timings["usage"]`` the final usageMetadata. A cache
+    hit returns immediately without streaming. With ``resilience`` a stream is
+    retried only if it failed before any text reached ``on_text``, and is never
+    hedged.
+    """
+    mdl = model or DEFAULT_MODEL
+    payload = build_payload(prompt, system=system)
+    emitted = []
+
+    def forward(delta: str) -> None:
+        emitted.append(True)
+        if on_text is not None:
+            on_text(delta)
+
+    def attempt(m: str) -> Awaitable[str]:
+        return _with_context(payload, m, clients, context, lambda p: _stream(p, m, clients, forward, timings))
+
+    def factory() -> Awaitable[str]:
+        if resilience is None:
+            return attempt(mdl)
+        return _resilient(resilience, attempt, mdl, hedge=False, can_retry=lambda: not emitted)
+
+    if cache is None:
+        return await factory()
+    return await cache.get_or_create(cache_key(mdl, payload), factory)
 
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "temperature": _get_temperature(),
-            "maxOutputTokens": 1000,
-            "responseMimeType": "application/json"
-        },
-    }
+
+async def _resilient(resilience: Resilience, attempt: Callable[[str], Awaitable[str]], mdl: str, **kwargs) -> str:
+    if not resilience.admit():
+        raise CircuitOpen("circuit_open: Gemini marked degraded, request skipped")
+    return await resilience.run(attempt, mdl, **kwargs)
+
+
+async def _stream(
+    payload: dict,
+    mdl: str,
+    clients: Optional[ClientRegistry],
+    on_text: Optional[Callable[[str], None]],
+    timings: Optional[Dict[str, float]],
+) -> str:
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{mdl}:streamGenerateContent?alt=sse&key={_api_key()}"
 
     headers = {"Content-Type": "application/json"}
+    started = time.perf_counter()
+    pieces = []
+    try:
+        async with stream(
+            clients,
+            url,
+            headers=headers,
+            content=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            timeout=GEMINI_TIMEOUT,
+            provider="gemini",
+        ) as resp:
+            if resp.status_code != 200:
+                await resp.aread()
+                raise _status_error(resp.status_code, resp.text)
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                try:
+                    data = json.loads(line[5:])
+                    if timings is not None and "usageMetadata" in data:
+                        timings["usage"] = data["usageMetadata"]
+                    parts = data["candidates"][0]["content"]["parts"]
+                except Exception:
+                    continue
+                delta = "".join(p.get("text", "") for p in parts)
+                if not delta:
+                    continue
+                if not pieces and timings is not None:
+                    timings["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                pieces.append(delta)
+                if on_text is not None:
+                    on_text(delta)
+    except httpx.HTTPError as exc:
+        raise _transport_error(exc) from exc
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        try:
-            resp = await client.post(url, headers=headers, content=json.dumps(payload, ensure_ascii=False).encode("utf-8"))
-        except Exception as exc:
-            raise GeminiError(f"http_error: {exc}") from exc
+    text = "".join(pieces).strip()
+    if not text:
+        raise GeminiError("empty_text: stream produced no text")
+    return text
+
+
+async def _generate(payload: dict, mdl: str, clients: Optional[ClientRegistry], usage: Optional[Dict] = None) -> str:
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{mdl}:generateContent?key={_api_key()}"
+
+    headers = {"Content-Type": "application/json"}
+
+    started = time.perf_counter()
+    try:
+        resp = await post(
+            clients,
+            url,
+            headers=headers,
+            content=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            timeout=GEMINI_TIMEOUT,
+            provider="gemini",
+        )
+    except Exception as exc:
+        raise _transport_error(exc) from exc
 
     if resp.status_code != 200:
-        raise GeminiError(f"status_{resp.status_code}: {resp.text}")
+        raise _status_error(resp.status_code, resp.text)
 
     try:
         data = resp.json()
     except Exception as exc:
         raise GeminiError(f"invalid_json_response: {resp.text[:500]}") from exc
 
+    if usage is not None:
+        usage.update(data.get("usageMetadata") or {})
+        usage["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
     try:
         text = (
             data.get("candidates", [{}])[0]
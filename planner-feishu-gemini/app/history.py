@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .agenda_store import get_agenda_store
+from .data_io import CACHE_DIR
+from .timewin import now_utc
+
+HISTORY_DIR = os.path.join(CACHE_DIR, "history")
+_EPOCH = date(1970, 1, 1).toordinal()
+
+# One flat binary file per column; categorical columns hold dictionary codes.
+COLUMNS = {
+    "user": np.int32,
+    "date": np.int32,  # days since 1970-01-01
+    "start": np.int16,  # minutes after local midnight
+    "end": np.int16,
+    "task": np.int32,
+    "priority": np.int8,
+}
+_DICTS = {"user": "users", "task": "tasks", "priority": "priorities"}
+
+
+def _minutes(hhmm: str) -> Optional[int]:
+    try:
+        h, m = str(hhmm).strip().split(":")
+        value = int(h) * 60 + int(m)
+    except ValueError:
+        return None
+    return value if 0 <= value <= 24 * 60 else None
+
+
+def _day(date_str: str) -> int:
+    return date.fromisoformat(date_str).toordinal() - _EPOCH
+
+
+def _date_str(day: int) -> str:
+    return date.fromordinal(int(day) + _EPOCH).isoformat()
+
+
+def closed_before(today: Optional[date] = None) -> str:
+    """First date that may still change: every timezone has left earlier dates behind."""
+    today = today or now_utc().date()
+    return (today - timedelta(days=1)).isoformat()
+
+
+class History:
+    """Columnar index of every agenda Block under ``data/cache/history``.
+
+    ``meta.json`` holds the row count, the ingested dates and the user/task/
+    priority dictionaries; it is replaced atomically after the columns are
+    appended, so bytes past ``rows`` left by an interrupted ingest are ignored
+    and overwritten next time. Columns are opened as read-only memmaps and all
+    queries are vectorized over them.
+    """
+
+    def __init__(self, root: str = HISTORY_DIR) -> None:
+        self.root = root
+        meta: Dict = {}
+        try:
+            with open(os.path.join(root, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            pass
+        self.rows: int = meta.get("rows", 0)
+        self.dates: List[str] = meta.get("dates", [])
+        self.users: List[str] = meta.get("users", [])
+        self.tasks: List[str] = meta.get("tasks", [])
+        self.priorities: List[str] = meta.get("priorities", [])
+        self._cols: Dict[str, np.ndarray] = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, f"{name}.bin")
+
+    def col(self, name: str) -> np.ndarray:
+        arr = self._cols.get(name)
+        if arr is None:
+            if self.rows:
+                arr = np.memmap(self._path(name), dtype=COLUMNS[name], mode="r", shape=(self.rows,))
+            else:
+                arr = np.empty(0, dtype=COLUMNS[name])
+            self._cols[name] = arr
+        return arr
+
+    # -- ingest ---------------------------------------------------------------
+
+    def ingest(self, store=None, until: Optional[str] = None) -> int:
+        """Append Blocks for dates not yet indexed and before ``until``; return rows added."""
+        store = store or get_agenda_store()
+        until = until or closed_before()
+        done = set(self.dates)
+        new_dates = [d for d in store.dates() if d not in done and d < until]
+        if not new_dates:
+            return 0
+        codes = {key: {v: i for i, v in enumerate(getattr(self, attr))} for key, attr in _DICTS.items()}
+        buf: Dict[str, List[int]] = {name: [] for name in COLUMNS}
+        for date_str in new_dates:
+            try:
+                day = _day(date_str)
+            except ValueError:
+                continue
+            for public_id, agenda in store.items(date_str):
+                for block in agenda.get("blocks") or []:
+                    start, end = _minutes(block.get("start", "")), _minutes(block.get("end", ""))
+                    if start is None or end is None:
+                        continue
+                    if end < start:
+                        end += 24 * 60  # runs past midnight
+                    row = {
+                        "user": public_id,
+                        "task": str(block.get("task", "")).strip(),
+                        "priority": block.get("priority") or "S",
+                    }
+                    for key, value in row.items():
+                        table = codes[key]
+                        if value not in table:
+                            table[value] = len(table)
+                            getattr(self, _DICTS[key]).append(value)
+                        buf[key].append(table[value])
+                    buf["date"].append(day)
+                    buf["start"].append(start)
+                    buf["end"].append(end)
+        added = len(buf["date"])
+        os.makedirs(self.root, exist_ok=True)
+        for name, dtype in COLUMNS.items():
+            with open(self._path(name), "ab") as f:
+                f.truncate(self.rows * np.dtype(dtype).itemsize)
+                f.write(np.asarray(buf[name], dtype=dtype).tobytes())
+        self.rows += added
+        self.dates = sorted(done.union(new_dates))
+        self._save_meta()
+        self._cols = {}
+        return added
+
+    def _save_meta(self) -> None:
+        path = os.path.join(self.root, "meta.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "rows": self.rows,
+                    "dates": self.dates,
+                    "users": self.users,
+                    "tasks": self.tasks,
+                    "priorities": self.priorities,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp, path)
+
+    # -- queries --------------------------------------------------------------
+
+    def mask(
+        self,
+        users: Optional[Iterable[str]] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        from_minute: Optional[int] = None,
+        to_minute: Optional[int] = None,
+    ) -> np.ndarray:
+        """Row filter: users, dates in [since, until], blocks overlapping [from_minute, to_minute)."""
+        m = np.ones(self.rows, dtype=bool)
+        if users is not None:
+            wanted = [self.users.index(u) for u in users if u in self.users]
+            m &= np.isin(self.col("user"), wanted)
+        if since:
+            m &= self.col("date") >= _day(since)
+        if until:
+            m &= self.col("date") <= _day(until)
+        if from_minute is not None:
+            m &= self.col("end") > from_minute
+        if to_minute is not None:
+            m &= self.col("start") < to_minute
+        return m
+
+    def durations(self) -> np.ndarray:
+        return np.maximum(self.col("end").astype(np.int32) - self.col("start"), 0)
+
+    def minutes_by(self, by: str, mask: Optional[np.ndarray] = None) -> Dict[str, int]:
+        """Total scheduled minutes grouped by ``user``, ``date``, ``task`` or ``priority``."""
+        m = self.mask() if mask is None else mask
+        keys = self.col(by)[m]
+        dur = self.durations()[m]
+        if by == "date":
+            uniq, inverse = np.unique(keys, return_inverse=True)
+            sums = np.bincount(inverse, weights=dur, minlength=len(uniq))
+            return {_date_str(d): int(s) for d, s in zip(uniq, sums)}
+        labels = getattr(self, _DICTS[by])
+        sums = np.bincount(keys, weights=dur, minlength=len(labels))
+        return {labels[i]: int(sums[i]) for i in np.flatnonzero(sums)}
+
+    def priority_mix(self, mask: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """Share of scheduled minutes per priority."""
+        totals = self.minutes_by("priority", mask)
+        total = sum(totals.values()) or 1
+        return {k: round(v / total, 4) for k, v in totals.items()}
+
+    def day_loads(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scheduled minutes per (user, date) pair present in the selection."""
+        m = self.mask() if mask is None else mask
+        pairs = self.col("user")[m].astype(np.int64) << 32 | self.col("date")[m].astype(np.int64)
+        _, inverse = np.unique(pairs, return_inverse=True)
+        return np.bincount(inverse, weights=self.durations()[m])
+
+    def overloaded_days(self, threshold_minutes: int, mask: Optional[np.ndarray] = None) -> Dict[str, float]:
+        loads = self.day_loads(mask)
+        over = int((loads > threshold_minutes).sum())
+        return {"days": int(loads.size), "overloaded": over, "share": round(over / loads.size, 4) if loads.size else 0.0}
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.history")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    ing = sub.add_parser("ingest", help="index agenda dates not seen before")
+    ing.add_argument("--until", help="only ingest dates before this YYYY-MM-DD (default: yesterday UTC)")
+    rep = sub.add_parser("report", help="print aggregates as JSON")
+    rep.add_argument("--user", action="append", help="restrict to a public_id (repeatable)")
+    rep.add_argument("--since", help="first date, YYYY-MM-DD")
+    rep.add_argument("--until", help="last date, YYYY-MM-DD")
+    rep.add_argument("--from", dest="from_time", help="only blocks overlapping HH:MM ...")
+    rep.add_argument("--to", dest="to_time", help="... to HH:MM")
+    rep.add_argument("--by", choices=["user", "date", "task", "priority"], default="task")
+    rep.add_argument("--top", type=int, default=20)
+    rep.add_argument("--overload-hours", type=float, default=8.0)
+    args = parser.parse_args(argv)
+
+    history = History()
+    if args.cmd == "ingest":
+        added = history.ingest(until=args.until)
+        print(json.dumps({"rows_added": added, "rows": history.rows, "dates": len(history.dates)}))
+        return
+    mask = history.mask(
+        users=args.user,
+        since=args.since,
+        until=args.until,
+        from_minute=_minutes(args.from_time) if args.from_time else None,
+        to_minute=_minutes(args.to_time) if args.to_time else None,
+    )
+    grouped = sorted(history.minutes_by(args.by, mask).items(), key=lambda kv: (-kv[1], kv[0]))
+    report = {
+        "rows": int(mask.sum()),
+        f"minutes_by_{args.by}": dict(grouped[: args.top]),
+        "priority_mix": history.priority_mix(mask),
+        "overload": history.overloaded_days(int(args.overload_hours * 60), mask),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import os
+import sqlite3
+import threading
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from .data_io import DATA_DIR, DELIVERIES_CSV, DELIVERY_HEADER, delivery_row, write_delivery_rows
+from .shard import sharded_path
+
+DELIVERY_BACKEND = os.getenv("DELIVERY_BACKEND", "csv").lower()
+DELIVERY_FLUSH_EVERY = int(os.getenv("DELIVERY_FLUSH_EVERY", "100"))
+DELIVERIES_DB = os.path.join(DATA_DIR, "deliveries.sqlite")
+
+
+class CsvBackend:
+    """The historical ``data/deliveries.csv`` log, appended in batches.
+
+    ``shared`` is a log that lookups also read: the merged file, for a shard.
+    """
+
+    def __init__(self, path: str = DELIVERIES_CSV, shared: Optional[str] = None) -> None:
+        self.path = path
+        self.shared = shared
+        self._delivered: Optional[Set[Tuple[str, str]]] = None
+        self._lock = threading.Lock()  # lookups and writes may run on different pool threads
+
+    def write_rows(self, rows: List[List[str]]) -> None:
+        with self._lock:
+            write_delivery_rows(rows, self.path)
+            if self._delivered is not None:
+                self._delivered.update((r[1], r[2]) for r in rows if r[4] == "ok")
+
+    def was_delivered(self, public_id: str, date_str: str) -> bool:
+        with self._lock:
+            if self._delivered is None:
+                # One scan per run, then set lookups.
+                delivered: Set[Tuple[str, str]] = set()
+                for path in filter(None, (self.path, self.shared)):
+                    if os.path.exists(path):
+                        with open(path, "r", encoding="utf-8", newline="") as f:
+                            for row in csv.DictReader(f):
+                                if row.get("status") == "ok":
+                                    delivered.add((row.get("public_id", ""), row.get("date", "")))
+                self._delivered = delivered
+            return (public_id, date_str) in self._delivered
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteBackend:
+    """SQLite (WAL) delivery log with an index on (public_id, date).
+
+    ``shared`` is a database that lookups also read: the merged one, for a shard.
+    """
+
+    def __init__(self, path: str = DELIVERIES_DB, shared: Optional[str] = None) -> None:
+        self.path = path
+        self.shared = shared
+        # Writes and lookups may come from different I/O pool threads; the lock serializes them.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{name} TEXT" for name in DELIVERY_HEADER)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS deliveries ({columns})")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_user_date ON deliveries(public_id, date)")
+        self._conn.commit()
+
+    def write_rows(self, rows: List[List[str]]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO deliveries VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def was_delivered(self, public_id: str, date_str: str) -> bool:
+        query = "SELECT 1 FROM deliveries WHERE public_id = ? AND date = ? AND status = 'ok' LIMIT 1"
+        with self._lock:
+            if self._conn.execute(query, (public_id, date_str)).fetchone() is not None:
+                return True
+        if not self.shared or not os.path.exists(self.shared):
+            return False
+        conn = sqlite3.connect(f"file:{self.shared}?mode=ro", uri=True)
+        try:
+            return conn.execute(query, (public_id, date_str)).fetchone() is not None
+        except sqlite3.DatabaseError:
+            return False
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        # Fold the WAL back into the main file so only deliveries.sqlite needs committing.
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.close()
+
+
+def make_backend(name: str = DELIVERY_BACKEND):
+    # Each shard keeps its own log (merged by ``python -m app.shard merge``), so shards never share a file.
+    if name == "sqlite":
+        path = sharded_path(DELIVERIES_DB)
+        return SqliteBackend(path, DELIVERIES_DB if path != DELIVERIES_DB else None)
+    path = sharded_path(DELIVERIES_CSV)
+    return CsvBackend(path, DELIVERIES_CSV if path != DELIVERIES_CSV else None)
+
+
+class DeliveryJournal:
+    """Run-scoped delivery log with a single writer task.
+
+    ``append`` only enqueues a row; the writer drains the queue and hands rows
+    to the backend in batches of ``flush_every`` and once more on close, so
+    concurrent coroutines never interleave partial rows. With ``run_blocking``
+    (the run's AsyncIO pool) batches are written off the event loop.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        flush_every: int = DELIVERY_FLUSH_EVERY,
+        run_blocking: Optional[Callable[..., Awaitable]] = None,
+    ) -> None:
+        self.backend = backend if backend is not None else make_backend()
+        self.flush_every = max(1, flush_every)
+        self.run_blocking = run_blocking
+        self.written = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "DeliveryJournal":
+        self._writer = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    def append(self, public_id: str, date_str: str, channel: str, ok: bool, provider_msg: str) -> None:
+        self._queue.put_nowait(delivery_row(public_id, date_str, channel, ok, provider_msg))
+
+    def was_delivered(self, public_id: str, date_str: str) -> bool:
+        """Whether a successful delivery for (public_id, date) has been written (by an earlier run).
+
+        Blocking (a CSV scan on first use): call it through ``run_blocking``.
+        """
+        return self.backend.was_delivered(public_id, date_str)
+
+    async def _run(self) -> None:
+        buffer: List[List[str]] = []
+        while True:
+            row = await self._queue.get()
+            if row is None:
+                break
+            buffer.append(row)
+            if len(buffer) >= self.flush_every:
+                await self._flush(buffer)
+                buffer = []
+        if buffer:
+            await self._flush(buffer)
+
+    async def _flush(self, rows: List[List[str]]) -> None:
+        if self.run_blocking is not None:
+            await self.run_blocking(self.backend.write_rows, rows)
+        else:
+            self.backend.write_rows(rows)
+        self.written += len(rows)
+
+    async def aclose(self) -> None:
+        if self._writer is not None:
+            self._queue.put_nowait(None)
+            await self._writer
+            self._writer = None
+        self.backend.close()
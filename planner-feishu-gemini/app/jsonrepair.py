@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, List, Tuple
+
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_BARE_RE = re.compile(r"[^\s:,{}\[\]\"']+")
+_LITERALS = {"true": True, "false": False, "null": None}
+_PY_LITERALS = {"True": True, "False": False, "None": None}
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_KV_START_RE = re.compile(r'\s*"[^"\n]*"\s*:')
+_DECODER = json.JSONDecoder()
+_SPECIAL_DQ = re.compile(r'["\\\n]')
+_SPECIAL_SQ = re.compile(r"['\\\n]")
+
+
+class JSONRepairError(ValueError):
+    pass
+
+
+class _Truncated(Exception):
+    pass
+
+
+def loads(text: str) -> Tuple[Any, List[str]]:
+    """Parse an LLM's JSON-ish answer into an object, repairing it on the way.
+
+    Handles Markdown fences and prose around the object, trailing or missing
+    commas, single-quoted or bare keys/strings, ``//``/``/* */`` comments,
+    Python literals and output truncated mid-value (open containers are
+    closed and a half-written array item is dropped; "truncated" is then
+    among the repairs). Well-formed input is decoded by the C scanner
+    straight from its first ``{``; anything else goes through one tolerant
+    left-to-right pass.
+
+    Returns:
+        (value, repairs) where repairs names each fix that was applied.
+
+    Raises:
+        JSONRepairError if no value can be recovered.
+    """
+    repairs: List[str] = []
+    start = text.find("{")
+    if start == -1 or _KV_START_RE.match(text):
+        # Outer braces missing: treat the text as the body of an object ("k": v lines).
+        parser = _Parser(text, 0, repairs)
+        repairs.append("missing_braces")
+        value = parser.object_body(closing=None)
+        if not value or "missing_colon" in repairs:
+            raise JSONRepairError("no JSON object found")
+        return value, repairs
+    prefix = text[:start]
+    if prefix.strip():
+        repairs.append("code_fence" if "```" in prefix else "leading_text")
+    try:
+        value, end = _DECODER.raw_decode(text, start)
+    except ValueError:
+        parser = _Parser(text, start, repairs)
+        try:
+            value = parser.value()
+        except _Truncated:
+            raise JSONRepairError("truncated before any value") from None
+        end = parser.pos
+    rest = text[end:].strip()
+    if rest and rest.strip("`").strip():
+        repairs.append("trailing_text")
+    return value, repairs
+
+
+class _Parser:
+    def __init__(self, text: str, pos: int, repairs: List[str]) -> None:
+        self.text = text
+        self.pos = pos
+        self.repairs = repairs
+        self.truncated = False
+
+    def _repair(self, name: str) -> None:
+        if name == "truncated":
+            self.truncated = True
+        if name not in self.repairs:
+            self.repairs.append(name)
+
+    def _skip(self) -> None:
+        text, n = self.text, len(self.text)
+        while self.pos < n:
+            ch = text[self.pos]
+            if ch in " \t\r\n":
+                self.pos += 1
+            elif text.startswith("//", self.pos):
+                end = text.find("\n", self.pos)
+                self.pos = n if end == -1 else end + 1
+                self._repair("comment")
+            elif text.startswith("/*", self.pos):
+                end = text.find("*/", self.pos + 2)
+                self.pos = n if end == -1 else end + 2
+                self._repair("comment")
+            else:
+                return
+
+    def _peek(self) -> str:
+        self._skip()
+        if self.pos >= len(self.text):
+            raise _Truncated()
+        return self.text[self.pos]
+
+    def value(self) -> Any:
+        ch = self._peek()
+        if ch == "{":
+            self.pos += 1
+            return self.object_body(closing="}")
+        if ch == "[":
+            self.pos += 1
+            return self._array()
+        if ch in "\"'":
+            return self._string()
+        m = _NUMBER_RE.match(self.text, self.pos)
+        if m:
+            self.pos = m.end()
+            return json.loads(m.group(0))
+        m = _BARE_RE.match(self.text, self.pos)
+        if not m:
+            raise JSONRepairError(f"unexpected {ch!r} at {self.pos}")
+        word = m.group(0)
+        self.pos = m.end()
+        if word in _LITERALS:
+            return _LITERALS[word]
+        if word in _PY_LITERALS:
+            self._repair("python_literal")
+            return _PY_LITERALS[word]
+        self._repair("unquoted_string")
+        return word
+
+    def object_body(self, closing: Any) -> dict:
+        obj: dict = {}
+        separated = True
+        while True:
+            try:
+                ch = self._peek()
+            except _Truncated:
+                if closing:
+                    self._repair("truncated")
+                return obj
+            if ch == closing:
+                self.pos += 1
+                return obj
+            if ch == ",":
+                self.pos += 1
+                self._repair("extra_comma")
+                continue
+            if ch in "}]":
+                # Stray closer: stop this object here.
+                self.pos += 1
+                self._repair("mismatched_bracket")
+                return obj
+            if not separated:
+                self._repair("missing_comma")
+            key = self._key()
+            try:
+                if self._peek() == ":":
+                    self.pos += 1
+                else:
+                    self._repair("missing_colon")
+                obj[key] = self.value()
+            except _Truncated:
+                self._repair("truncated")
+                return obj
+            separated = self._comma(closing)
+
+    def _array(self) -> list:
+        arr: list = []
+        separated = True
+        while True:
+            try:
+                ch = self._peek()
+            except _Truncated:
+                self._repair("truncated")
+                return arr
+            if ch == "]":
+                self.pos += 1
+                return arr
+            if ch == ",":
+                self.pos += 1
+                self._repair("extra_comma")
+                continue
+            if ch == "}":
+                self.pos += 1
+                self._repair("mismatched_bracket")
+                return arr
+            if not separated:
+                self._repair("missing_comma")
+            try:
+                item = self.value()
+            except _Truncated:
+                self._repair("truncated")
+                return arr
+            if self.truncated and isinstance(item, (dict, list)):
+                # The output ended inside this item; keep only the complete ones.
+                self._repair("dropped_partial_item")
+                return arr
+            arr.append(item)
+            separated = self._comma("]")
+
+    def _comma(self, closing: Any) -> bool:
+        """Consume a separator; flag a trailing comma before the closer."""
+        try:
+            ch = self._peek()
+        except _Truncated:
+            return True
+        if ch != ",":
+            return False
+        self.pos += 1
+        try:
+            if self._peek() == closing:
+                self._repair("trailing_comma")
+        except _Truncated:
+            pass
+        return True
+
+    def _key(self) -> str:
+        ch = self._peek()
+        if ch in "\"'":
+            return self._string()
+        m = _BARE_RE.match(self.text, self.pos)
+        if not m:
+            raise JSONRepairError(f"unexpected {ch!r} at {self.pos}")
+        self.pos = m.end()
+        self._repair("unquoted_key")
+        return m.group(0)
+
+    def _string(self) -> str:
+        text = self.text
+        quote = text[self.pos]
+        if quote == "'":
+            self._repair("single_quotes")
+        special = _SPECIAL_DQ if quote == '"' else _SPECIAL_SQ
+        self.pos += 1
+        out: List[str] = []
+        while True:
+            m = special.search(text, self.pos)
+            if m is None:
+                out.append(text[self.pos:])
+                self.pos = len(text)
+                self._repair("truncated")
+                return "".join(out)
+            idx = m.start()
+            out.append(text[self.pos:idx])
+            ch = text[idx]
+            if ch == quote:
+                self.pos = idx + 1
+                return "".join(out)
+            if ch == "\n":
+                self._repair("newline_in_string")
+                out.append(ch)
+                self.pos = idx + 1
+                continue
+            esc = text[idx + 1:idx + 2]
+            if esc == "u" and idx + 6 <= len(text):
+                try:
+                    out.append(chr(int(text[idx + 2:idx + 6], 16)))
+                    self.pos = idx + 6
+                    continue
+                except ValueError:
+                    pass
+            out.append(_ESCAPES.get(esc, esc))
+            self.pos = idx + 2
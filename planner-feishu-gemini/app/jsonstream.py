@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from typing import List
+
+
+class StreamAbort(ValueError):
+    """Raised as soon as streamed output can no longer become an agenda object."""
+
+
+class IncrementalJSONChecker:
+    """Cheap structural check of a JSON object arriving in chunks.
+
+    Tolerates surrounding whitespace and a leading Markdown code fence (the
+    parser strips those), and otherwise aborts on the first character that
+    rules out a single top-level object: prose before ``{``, a top-level
+    array/scalar, or a closing bracket that does not match its opener.
+    """
+
+    def __init__(self) -> None:
+        self._stack: List[str] = []
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._prefix = ""
+        self.complete = False
+
+    def feed(self, chunk: str) -> None:
+        for ch in chunk:
+            if self.complete:
+                return
+            if not self._started:
+                self._feed_prefix(ch)
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append("}" if ch == "{" else "]")
+            elif ch in "}]":
+                if not self._stack or self._stack.pop() != ch:
+                    raise StreamAbort(f"unbalanced {ch!r}")
+                if not self._stack:
+                    self.complete = True
+
+    def _feed_prefix(self, ch: str) -> None:
+        if ch == "{":
+            self._started = True
+            self._stack.append("}")
+            return
+        if ch.isspace():
+            if self._prefix and not (self._prefix.startswith("```") or self._prefix.lower() == "json"):
+                raise StreamAbort(f"prose before object: {self._prefix[:40]!r}")
+            if ch == "\n":
+                self._prefix = ""
+            return
+        self._prefix += ch
+        # Only an opening fence (optionally with a language tag) or a bare "json" tag may precede the object.
+        p = self._prefix
+        if not ("```".startswith(p) or p.startswith("```") or "json".startswith(p.lower())):
+            raise StreamAbort(f"prose before object: {p[:40]!r}")
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .data_io import DATA_DIR
+from .shard import current_shard, sharded_path
+from .timewin import PUSH_HOUR
+
+LEDGER_DIR = os.path.join(DATA_DIR, "ledger")
+LEDGER_SLOT = f"{PUSH_HOUR:02d}:00"
+LEDGER_MAX_ATTEMPTS = int(os.getenv("LEDGER_MAX_ATTEMPTS", "3"))
+LEDGER_LOCK_TTL_MIN = float(os.getenv("LEDGER_LOCK_TTL_MIN", "30"))
+LEDGER_LOCK_REFRESH_S = LEDGER_LOCK_TTL_MIN * 60 / 3
+_SHARD_LOCK_RE = re.compile(r"\.lock\.shard\d+of(\d+)$")
+
+GENERATED = "generated"
+SENDING = "sending"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+
+def _advance(entry: Optional[Tuple[str, int]], state: str) -> Tuple[str, int]:
+    """Apply a transition; every send, or failure before sending, is one attempt."""
+    prev, attempts = entry if entry else (None, 0)
+    if state == SENDING or (state == FAILED and prev != SENDING):
+        attempts += 1
+    return state, attempts
+
+
+class LedgerBusy(RuntimeError):
+    """Another run holds the ledger lock."""
+
+
+class Ledger:
+    """Idempotency ledger keyed by (public_id, local date, slot).
+
+    Each local date has an append-only ``data/ledger/<date>.jsonl`` of state
+    transitions (generated -> sending -> delivered | failed); the last line per
+    key wins. A run takes ``data/ledger/.lock`` via atomic exclusive creation,
+    so overlapping cron ticks or manual reruns cannot both work on the same
+    users. The holder touches its lock every LEDGER_LOCK_REFRESH_S, so a lock
+    left untouched for LEDGER_LOCK_TTL_MIN is treated as abandoned.
+
+    Under ``--shard i/N`` the lock and the files appended to carry the shard
+    suffix (``<date>.shard0of4.jsonl``), so shards never contend; reads cover
+    the shared file and every shard's, so an unsharded run sees them all.
+    Runs whose users may overlap still exclude each other: after taking its
+    own lock a run backs off if it sees a live lock of the other kind (the
+    unsharded ``.lock`` against any shard's, or shards of a different N).
+    """
+
+    def __init__(self, root: str = LEDGER_DIR, max_attempts: int = LEDGER_MAX_ATTEMPTS) -> None:
+        self.root = root
+        self.max_attempts = max_attempts
+        self.run_id = f"{os.getpid()}-{int(time.time())}"
+        self._lock_path = sharded_path(os.path.join(root, ".lock"))
+        self._locked = False
+        self._heartbeat: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # date -> {(public_id, slot): (state, attempts)}
+        self._days: Dict[str, Dict[Tuple[str, str], Tuple[str, int]]] = {}
+
+    def __enter__(self) -> "Ledger":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    def acquire(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self._lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._remove_stale():
+                    raise LedgerBusy(f"ledger locked by another run ({self._lock_path})")
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(self.run_id)
+            self._locked = True
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._refresh, name="ledger-lock", daemon=True)
+            self._heartbeat.start()
+            # Both sides create before they look, so two overlapping runs never both proceed.
+            conflict = self._conflicting_lock()
+            if conflict:
+                self.release()
+                raise LedgerBusy(f"ledger locked by an overlapping run ({conflict})")
+            return
+        raise LedgerBusy(f"could not acquire {self._lock_path}")
+
+    def _remove_stale(self) -> bool:
+        """Take away an abandoned lock; False while its run is still alive.
+
+        The lock is first renamed aside, so of two runs racing for the same
+        stale lock only one removes it; if what was moved turns out to be
+        fresh (another run took over in between) it is put back.
+        """
+        try:
+            if time.time() - os.path.getmtime(self._lock_path) < LEDGER_LOCK_TTL_MIN * 60:
+                return False
+            aside = os.path.join(self.root, f".stale.{self.run_id}")
+            os.rename(self._lock_path, aside)
+        except OSError:
+            return True  # gone already: try to create it again
+        try:
+            if time.time() - os.path.getmtime(aside) < LEDGER_LOCK_TTL_MIN * 60:
+                try:
+                    os.link(aside, self._lock_path)
+                except OSError:
+                    pass
+                return False
+        finally:
+            try:
+                os.remove(aside)
+            except OSError:
+                pass
+        return True
+
+    def _refresh(self) -> None:
+        while not self._stop.wait(LEDGER_LOCK_REFRESH_S):
+            try:
+                os.utime(self._lock_path)
+            except OSError:
+                pass
+
+    def _owns_lock(self) -> bool:
+        try:
+            with open(self._lock_path, "r", encoding="utf-8") as f:
+                return f.read() == self.run_id
+        except OSError:
+            return False
+
+    def _conflicting_lock(self) -> Optional[str]:
+        shard = current_shard()
+        shared = os.path.join(self.root, ".lock")
+        for path in [shared, *glob.glob(glob.escape(shared) + ".shard*of*")]:
+            if path == self._lock_path:
+                continue
+            m = _SHARD_LOCK_RE.search(path)
+            if shard is not None and m and int(m.group(1)) == shard.count:
+                continue  # a sibling shard: disjoint users
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                continue
+            if age < LEDGER_LOCK_TTL_MIN * 60:
+                return path
+        return None
+
+    def release(self) -> None:
+        if self._locked:
+            self._locked = False
+            self._stop.set()
+            if self._heartbeat is not None:
+                self._heartbeat.join()
+                self._heartbeat = None
+            if not self._owns_lock():
+                return  # taken over after all; leave the new holder's lock alone
+            try:
+                os.remove(self._lock_path)
+            except OSError:
+                pass
+
+    def _day(self, date_str: str) -> Dict[Tuple[str, str], Tuple[str, int]]:
+        day = self._days.get(date_str)
+        if day is not None:
+            return day
+        day = {}
+        shared = os.path.join(self.root, f"{date_str}.jsonl")
+        shards = sorted(glob.glob(os.path.join(glob.escape(self.root), f"{glob.escape(date_str)}.shard*of*.jsonl")))
+        for path in [shared, *shards]:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+            except FileNotFoundError:
+                continue
+            try:
+                # One decode for the whole file; this also runs on the cron tick's pre-check.
+                records = json.loads("[" + ",".join(line for line in lines if line.strip()) + "]")
+            except ValueError:
+                records = []
+                for line in lines:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue  # torn last line from a crash
+            for rec in records:
+                key = (rec["public_id"], rec["slot"])
+                day[key] = _advance(day.get(key), rec["state"])
+        self._days[date_str] = day
+        return day
+
+    def _day_path(self, date_str: str) -> str:
+        return sharded_path(os.path.join(self.root, f"{date_str}.jsonl"))
+
+    def state(self, public_id: str, date_str: str, slot: str) -> Optional[str]:
+        entry = self._day(date_str).get((public_id, slot))
+        return entry[0] if entry else None
+
+    def pending(self, public_id: str, date_str: str, slot: str) -> bool:
+        """True unless delivered, or failed/abandoned on every allowed attempt."""
+        entry = self._day(date_str).get((public_id, slot))
+        if entry is None:
+            return True
+        state, attempts = entry
+        if state == DELIVERED:
+            return False
+        return attempts < self.max_attempts
+
+    def unhandled(self, due: List, pregen: List, slot: str = LEDGER_SLOT) -> Tuple[List, List]:
+        """Drop (user, local_now) pairs already handled: ``due`` keeps pending users, ``pregen`` undelivered ones.
+
+        Reads only, so it also works without the lock as a pre-check.
+        """
+        dates: Dict[object, str] = {}  # users of one timezone share a local_now
+
+        def day(t) -> str:
+            if t not in dates:
+                dates[t] = t.strftime("%Y-%m-%d")
+            return dates[t]
+
+        due = [(u, t) for u, t in due if self.pending(u["public_id"], day(t), slot)]
+        pregen = [(u, t) for u, t in pregen if self.state(u["public_id"], day(t), slot) != DELIVERED]
+        return due, pregen
+
+    def mark(self, public_id: str, date_str: str, slot: str, state: str) -> None:
+        self.append(date_str, self.transition(public_id, date_str, slot, state))
+
+    def transition(self, public_id: str, date_str: str, slot: str, state: str) -> str:
+        """Apply a transition in memory and return its line for ``append``.
+
+        Split from ``mark`` so the async pipeline can update state on the event
+        loop and append the line on its I/O pool.
+        """
+        day = self._day(date_str)
+        day[(public_id, slot)] = _advance(day.get((public_id, slot)), state)
+        return json.dumps(
+            {"public_id": public_id, "slot": slot, "state": state, "ts": int(time.time()), "run": self.run_id},
+            ensure_ascii=False,
+        )
+
+    def append(self, date_str: str, line: str) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        # One O_APPEND write per transition so a crash leaves at most a torn last line.
+        fd = os.open(self._day_path(date_str), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, (line + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .data_io import CACHE_DIR
+
+LLM_CACHE_DIR = os.path.join(CACHE_DIR, "llm")
+LLM_CACHE_STATS_PATH = os.path.join(CACHE_DIR, "llm_stats.json")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "50"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "24"))
+
+
+def cache_key(model: str, payload: Dict) -> str:
+    """Content address of a generateContent call: prompt, model and full generationConfig."""
+    canonical = json.dumps({"model": model, "payload": payload}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """On-disk, content-addressed cache of LLM texts with in-flight request coalescing.
+
+    Entries live under ``data/cache/llm/<key[:2]>/<key>.json``. Entries older than
+    the TTL are ignored and removed; ``evict()`` also trims the oldest entries
+    once the directory grows past the size budget. Failures are never cached.
+    With ``run_blocking`` (the run's AsyncIO pool) ``get_or_create`` reads and
+    writes entries off the event loop.
+    """
+
+    def __init__(
+        self,
+        root: str = LLM_CACHE_DIR,
+        max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds: float = LLM_CACHE_TTL_HOURS * 3600,
+        run_blocking: Optional[Callable[..., Awaitable]] = None,
+    ) -> None:
+        self.root = root
+        self.run_blocking = run_blocking
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evicted = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _load(self, path: str) -> Optional[Dict]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def _expired(self, entry: Optional[Dict], now: float) -> bool:
+        # Age comes from the stored timestamp: a git checkout resets every file mtime.
+        return entry is None or now - entry.get("created", 0) > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        entry = self._load(path)
+        if self._expired(entry, time.time()):
+            self._remove(path)
+            return None
+        return entry.get("text")
+
+    def put(self, key: str, text: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"text": text, "created": int(time.time())}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[str]]) -> str:
+        """Return the cached text for ``key``, awaiting ``factory`` at most once per run.
+
+        The lookup and the factory run as one task and every caller, the first
+        included, awaits it through ``shield``: a caller that is cancelled (e.g.
+        by the local planner's ``wait_for``) leaves the call running for the
+        others. The key stays in flight until the entry is written, so no
+        caller reads the disk between the reply and its cache entry.
+        """
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+        task = asyncio.ensure_future(self._create(key, factory))
+        # Mark a failure retrieved so one nobody is still waiting on is not logged as lost.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _create(self, key: str, factory: Callable[[], Awaitable[str]]) -> str:
+        try:
+            cached = await self._blocking(self.get, key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            text = await factory()
+            try:
+                await self._blocking(self.put, key, text)
+            except OSError:
+                pass
+            return text
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _blocking(self, fn, *args):
+        if self.run_blocking is None:
+            return fn(*args)
+        return await self.run_blocking(fn, *args)
+
+    def evict(self) -> None:
+        """Drop expired entries, then the oldest ones until the cache fits its size budget."""
+        if not os.path.isdir(self.root):
+            return
+        now = time.time()
+        files: List[Tuple[float, int, str]] = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                data = self._load(entry.path)
+                if self._expired(data, now):
+                    self._remove(entry.path)
+                else:
+                    files.append((data["created"], entry.stat().st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+            self.evicted += 1
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "evicted": self.evicted}
+
+    def write_stats(self, path: str = LLM_CACHE_STATS_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.stats(), ts=int(time.time())), f, ensure_ascii=False, indent=2)
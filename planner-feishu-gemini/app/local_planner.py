@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import os
+import re
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .types import Agenda
+
+LOCAL_PLANNER = os.getenv("LOCAL_PLANNER", "auto").lower()  # auto | off | only
+LOCAL_PLANNER_AFTER_S = float(os.getenv("LOCAL_PLANNER_AFTER_S", "20"))
+DEFAULT_WINDOW = (9 * 60, 18 * 60)
+DEFAULT_GOAL_MIN = 60
+MAX_SESSION_MIN = 90
+MIN_SESSION_MIN = 20
+BREAK_MIN = 10
+
+_BULLET_RE = re.compile(r"^\s*(?:[-*•·]|\d+[.、)])\s*(.+?)\s*$")
+_DURATION_RE = re.compile(
+    r"[，,（(]?\s*(?:需要|需|约|大约|预计|用时|耗时)?\s*(\d+(?:\.\d+)?)\s*(min|mins|minutes?|分钟|分|h|hrs?|hours?|小时|个小时)\s*[)）]?",
+    re.IGNORECASE,
+)
+_TIME = r"(\d{1,2})[:：](\d{2})"
+_RANGE_RE = re.compile(_TIME + r"\s*(?:-|~|–|—|至|到)\s*" + _TIME)
+_BEFORE_RE = re.compile(r"(?:before|截止|在)?\s*" + _TIME + r"\s*(?:前|之前)?", re.IGNORECASE)
+_DEADLINE_LINE_RE = re.compile(r"^\s*(?:硬截止|截止|deadline|必须)\s*[:：]?\s*(.+)$", re.IGNORECASE)
+_HEADER_RE = re.compile(r"^\s*(?:#+\s*.*|.{0,20}[:：])\s*$")
+_BREAK_WORDS = ("午休", "休息", "午饭", "午餐", "晚饭", "吃饭", "break", "lunch")
+_STOP_WORDS = ("完成", "学习", "今天", "今日", "需要", "内容", "做完", "必须", "比如", "一下")
+
+
+class Goal(NamedTuple):
+    task: str
+    minutes: int
+    deadline: Optional[int]  # minutes after midnight
+    must: bool
+    order: int
+
+
+def _to_min(h: str, m: str) -> int:
+    return int(h) * 60 + int(m)
+
+
+def _hhmm(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _bigrams(text: str) -> set:
+    for word in _STOP_WORDS:
+        text = text.replace(word, " ")
+    grams = set()
+    for part in text.split():
+        grams.update(part[i:i + 2] for i in range(len(part) - 1))
+    return grams
+
+
+def parse_goals(plan_md: str, strict: bool = True) -> Optional[List[Goal]]:
+    """Bullet goals with durations, plus deadlines from inline times or ``硬截止`` lines.
+
+    Strict mode returns None as soon as a line cannot be understood (a bullet
+    without a duration, free prose), so only fully structured plans qualify;
+    lenient mode gives duration-less bullets DEFAULT_GOAL_MIN and skips prose.
+    """
+    goals: List[Tuple[str, int, Optional[int]]] = []
+    deadline_lines: List[str] = []
+    for line in plan_md.splitlines():
+        if not line.strip():
+            continue
+        m = _DEADLINE_LINE_RE.match(line)
+        if m:
+            deadline_lines.append(m.group(1))
+            continue
+        m = _BULLET_RE.match(line)
+        if not m:
+            if _HEADER_RE.match(line) or not strict:
+                continue
+            return None
+        text = m.group(1)
+        dm = _DURATION_RE.search(text)
+        if dm:
+            value, unit = float(dm.group(1)), dm.group(2).lower()
+            minutes = int(round(value * (60 if unit[0] in "h小个" else 1)))
+            text = (text[:dm.start()] + text[dm.end():]).strip(" ，,。;；")
+        elif strict:
+            return None
+        else:
+            minutes = DEFAULT_GOAL_MIN
+        deadline = None
+        bm = _BEFORE_RE.search(text)
+        if bm and ("前" in bm.group(0) or "before" in bm.group(0).lower() or "截止" in bm.group(0)):
+            deadline = _to_min(bm.group(1), bm.group(2))
+            text = (text[:bm.start()] + text[bm.end():]).strip(" ，,。;；")
+        if minutes <= 0 or not text:
+            if strict:
+                return None
+            continue
+        goals.append((text, minutes, deadline))
+    if not goals:
+        return None
+
+    result: List[Goal] = []
+    for order, (task, minutes, deadline) in enumerate(goals):
+        must = False
+        grams = _bigrams(task)
+        for line in deadline_lines:
+            if grams & _bigrams(line):
+                must = True
+                tm = _BEFORE_RE.search(line)
+                if deadline is None and tm and tm.group(1):
+                    deadline = _to_min(tm.group(1), tm.group(2))
+        result.append(Goal(task, minutes, deadline, must, order))
+    return result
+
+
+def parse_windows(prefs: str, weekday: int) -> Tuple[List[Tuple[int, int]], List[Tuple[str, int, int]], List[str]]:
+    """Split ``prefs`` into (working windows for this weekday, breaks, notes without times)."""
+    windows: List[Tuple[int, int]] = []
+    breaks: List[Tuple[str, int, int]] = []
+    notes: List[str] = []
+    for part in re.split(r"[;；\n]", prefs or ""):
+        part = part.strip()
+        if not part:
+            continue
+        m = _RANGE_RE.search(part)
+        if not m:
+            notes.append(part)
+            continue
+        start, end = _to_min(m.group(1), m.group(2)), _to_min(m.group(3), m.group(4))
+        if end <= start:
+            continue
+        label = part[:m.start()].strip() or part[m.end():].strip()
+        if any(w in part.lower() for w in _BREAK_WORDS):
+            breaks.append((label, start, end))
+        elif "工作日" in part or "weekday" in part.lower():
+            if weekday < 5:
+                windows.append((start, end))
+        elif "周末" in part or "weekend" in part.lower():
+            if weekday >= 5:
+                windows.append((start, end))
+        else:
+            windows.append((start, end))
+    return windows, breaks, notes
+
+
+def free_intervals(windows: List[Tuple[int, int]], breaks: List[Tuple[str, int, int]]) -> List[Tuple[int, int]]:
+    """Merged windows minus break intervals, as sorted disjoint [start, end) pairs."""
+    merged: List[List[int]] = []
+    for start, end in sorted(windows or [DEFAULT_WINDOW]):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    free = [(s, e) for s, e in merged]
+    for _, bs, be in sorted(breaks, key=lambda b: b[1]):
+        nxt: List[Tuple[int, int]] = []
+        for s, e in free:
+            if be <= s or bs >= e:
+                nxt.append((s, e))
+                continue
+            if s < bs:
+                nxt.append((s, bs))
+            if be < e:
+                nxt.append((be, e))
+        free = nxt
+    return free
+
+
+def pack(goals: List[Goal], free: List[Tuple[int, int]], strict: bool = True) -> Optional[List[Dict]]:
+    """Earliest-deadline-first packing of goals into free intervals.
+
+    Goals are split into sessions of at most MAX_SESSION_MIN with BREAK_MIN
+    between consecutive sessions; a session may also be cut at the end of an
+    interval if at least MIN_SESSION_MIN fits. Strict mode fails if any goal
+    cannot finish (by its deadline); lenient mode keeps what fits.
+    """
+    order = sorted(goals, key=lambda g: (g.deadline if g.deadline is not None else 24 * 60, not g.must, g.order))
+    intervals = [list(iv) for iv in free]
+    blocks: List[Dict] = []
+    for goal in order:
+        left = goal.minutes
+        limit = goal.deadline if goal.deadline is not None else 24 * 60
+        for iv in intervals:
+            while left > 0:
+                end_cap = min(iv[1], limit)
+                room = end_cap - iv[0]
+                if room <= 0 or (room < min(left, MIN_SESSION_MIN)):
+                    break
+                length = min(left, MAX_SESSION_MIN, room)
+                blocks.append({
+                    "start": _hhmm(iv[0]),
+                    "end": _hhmm(iv[0] + length),
+                    "task": goal.task,
+                    "priority": "M" if goal.must else "S",
+                })
+                left -= length
+                iv[0] = min(iv[1], iv[0] + length + BREAK_MIN)
+            if left <= 0:
+                break
+        if left > 0 and strict:
+            return None
+    blocks.sort(key=lambda b: b["start"])
+    return blocks
+
+
+def plan(plan_md: Optional[str], prefs: str, date_str: str, strict: bool = True) -> Optional[Dict]:
+    """Build a validated Agenda dict without Gemini, or None if the plan does not qualify."""
+    if not plan_md:
+        return None
+    goals = parse_goals(plan_md, strict=strict)
+    if not goals:
+        return None
+    windows, breaks, notes = parse_windows(prefs, date.fromisoformat(date_str).weekday())
+    blocks = pack(goals, free_intervals(windows, breaks), strict=strict)
+    if not blocks:
+        return None
+    must = [g.task for g in goals if g.must]
+    reminders = [f"{label} {_hhmm(s)}-{_hhmm(e)}".strip() for label, s, e in breaks] + notes
+    scheduled = {b["task"] for b in blocks}
+    risks = [f"未能排入：{g.task}" for g in goals if g.task not in scheduled]
+    agenda = {
+        "date": date_str,
+        "focus": "；".join(must or [g.task for g in goals])[:200],
+        "blocks": blocks,
+        "reminders": reminders,
+        "risks": risks,
+    }
+    return Agenda(**agenda).model_dump()
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from .data_io import DATA_DIR
+from .shard import current_shard, sharded_path
+
+METRICS_ENABLED = os.getenv("METRICS", "1").lower() in ("1", "true", "yes")
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+METRICS_JSON_PATH = os.path.join(METRICS_DIR, "last_run.json")
+METRICS_PROM_PATH = os.path.join(METRICS_DIR, "planner.prom")
+QUANTILES = (50, 95, 99)
+
+_NOOP = nullcontext()
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _labels_key(labels: Dict[str, object]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prom_labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """Run-scoped timing histograms, kept as raw samples and summarised at the end.
+
+    ``span(stage)`` times a block (awaits included, so it measures what a user
+    waits for); ``observe`` records a duration measured elsewhere. Both are
+    no-ops when disabled (METRICS=0), so call sites need no guards.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED) -> None:
+        self.enabled = enabled
+        self._samples: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+
+    def observe(self, name: str, seconds: float, **labels: object) -> None:
+        if self.enabled:
+            self._samples.setdefault((name, _labels_key(labels)), []).append(seconds)
+
+    def span(self, stage: str) -> ContextManager[None]:
+        return self._span(stage) if self.enabled else _NOOP
+
+    @contextmanager
+    def _span(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage", time.perf_counter() - started, stage=stage)
+
+    @staticmethod
+    def _digest(samples: List[float]) -> Dict:
+        out = {"count": len(samples), "sum_ms": round(sum(samples) * 1000, 1)}
+        for q in QUANTILES:
+            out[f"p{q}_ms"] = round(percentile(samples, q) * 1000, 1)
+        return out
+
+    def summary(self) -> Dict:
+        """Digests as ``{"stages": {stage: ...}, "http_status": {provider: {status: ...}}}``."""
+        out: Dict[str, Dict] = {}
+        for (name, labels), samples in sorted(self._samples.items()):
+            lab = dict(labels)
+            if name == "stage":
+                out.setdefault("stages", {})[lab["stage"]] = self._digest(samples)
+            elif name == "http_request":
+                provider = out.setdefault("http_status", {}).setdefault(lab.get("provider", ""), {})
+                provider[lab.get("status", "")] = self._digest(samples)
+            else:
+                key = ",".join(f"{k}={v}" for k, v in labels) or "all"
+                out.setdefault(name, {})[key] = self._digest(samples)
+        return out
+
+    def prometheus(self, run: Dict) -> str:
+        """Textfile-collector exposition: one summary per histogram plus the run's scalar values."""
+        lines: List[str] = []
+        seen = set()
+        shard = current_shard()
+        # Shards write separate textfiles; a shard label keeps their series distinct.
+        extra = {"shard": f"{shard.index}/{shard.count}"} if shard else {}
+        for (name, labels), samples in sorted(self._samples.items()):
+            metric = f"planner_{name}_seconds"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                quantile = _prom_labels(labels, quantile=str(q / 100), **extra)
+                lines.append(f"{metric}{quantile} {percentile(samples, q):.6f}")
+            lines.append(f"{metric}_sum{_prom_labels(labels, **extra)} {sum(samples):.6f}")
+            lines.append(f"{metric}_count{_prom_labels(labels, **extra)} {len(samples)}")
+        scalars = [(k, v) for k, v in run.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        for key, value in scalars:
+            lines.append(f"# TYPE planner_run_{key} gauge")
+            lines.append(f"planner_run_{key}{_prom_labels((), **extra)} {value}")
+        counters = run.get("counters") or {}
+        if counters:
+            lines.append("# TYPE planner_events_total counter")
+            for key, value in sorted(counters.items()):
+                lines.append(f"planner_events_total{_prom_labels((('event', key),), **extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, run: Dict) -> None:
+        """Write the run summary with stage histograms as JSON, and a Prometheus textfile, atomically."""
+        if not self.enabled:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        for path, text in (
+            (sharded_path(METRICS_JSON_PATH), json.dumps(run, ensure_ascii=False, indent=2)),
+            (sharded_path(METRICS_PROM_PATH), self.prometheus(run)),
+        ):
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
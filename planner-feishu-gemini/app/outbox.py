@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from .clients import ClientRegistry
+from .feishu import send_text
+
+FEISHU_COALESCE = os.getenv("FEISHU_COALESCE", "1").lower() in ("1", "true", "yes")
+FEISHU_COALESCE_WAIT_S = float(os.getenv("FEISHU_COALESCE_WAIT_S", "30"))
+# Feishu custom bots reject request bodies over 20 KB; keep some headroom for the envelope.
+FEISHU_MAX_BYTES = int(os.getenv("FEISHU_MAX_BYTES", "19000"))
+SEPARATOR = "\n\n————————\n\n"
+
+Key = Tuple[str, str]
+
+
+def webhook_key(user: Dict) -> Key:
+    return (user.get("feishu_webhook") or "", user.get("feishu_secret") or "")
+
+
+def _size(text: str) -> int:
+    # Size inside the JSON payload, escapes included.
+    return len(json.dumps(text, ensure_ascii=False).encode("utf-8"))
+
+
+def pack(items: List[Tuple], max_bytes: int = FEISHU_MAX_BYTES) -> List[List[Tuple]]:
+    """Split (public_id, text, ...) items into chunks whose merged message fits ``max_bytes``.
+
+    Order is kept; an item that is too big on its own goes alone.
+    """
+    chunks: List[List[Tuple]] = []
+    current: List[Tuple] = []
+    size = 0
+    for item in items:
+        item_size = _size(_section(item[0], item[1])) + _size(SEPARATOR)
+        if current and size + item_size > max_bytes:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += item_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _section(public_id: str, text: str) -> str:
+    return f"【{public_id}】\n{text}"
+
+
+def merge(chunk: List[Tuple]) -> str:
+    """One user's text as is; several users each under a 【public_id】 heading."""
+    if len(chunk) == 1:
+        return chunk[0][1]
+    return SEPARATOR.join(_section(item[0], item[1]) for item in chunk)
+
+
+class _Group:
+    def __init__(self) -> None:
+        self.items: List[Tuple[str, str, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class WebhookOutbox:
+    """Run-scoped delivery stage that coalesces messages for a shared group bot.
+
+    ``expected`` counts this run's due users per (webhook, secret). A message
+    for a key waits until every other user expected on that key has either
+    submitted (``send``) or finished without sending (``finish``), or until
+    FEISHU_COALESCE_WAIT_S passes. The group then goes out as one request, or
+    a few when the merged text would exceed FEISHU_MAX_BYTES, each signed
+    once. Keys with a single user are sent straight away. Every caller gets
+    the (ok, response) of the request that carried its text, so journal and
+    ledger rows stay per user.
+    """
+
+    def __init__(
+        self,
+        clients: Optional[ClientRegistry],
+        expected: Optional[Dict[Key, int]] = None,
+        enabled: bool = FEISHU_COALESCE,
+        wait_s: float = FEISHU_COALESCE_WAIT_S,
+        max_bytes: int = FEISHU_MAX_BYTES,
+    ) -> None:
+        self.clients = clients
+        self.enabled = enabled
+        self.wait_s = wait_s
+        self.max_bytes = max_bytes
+        self._remaining: Dict[Key, int] = dict(expected or {})
+        self._groups: Dict[Key, _Group] = {}
+        self._settled: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.messages = 0
+        self.requests = 0
+
+    @classmethod
+    def for_users(cls, clients: Optional[ClientRegistry], users: List[Dict], **kwargs) -> "WebhookOutbox":
+        expected: Dict[Key, int] = {}
+        for user in users:
+            key = webhook_key(user)
+            if key[0]:
+                expected[key] = expected.get(key, 0) + 1
+        return cls(clients, expected, **kwargs)
+
+    async def send(self, user: Dict, text: str) -> Tuple[bool, str]:
+        key = webhook_key(user)
+        self.messages += 1
+        if not self.enabled or not key[0]:
+            self.requests += 1
+            return await send_text(key[0], text, key[1] or None, self.clients)
+        self._settle(user, key)
+        group = self._groups.setdefault(key, _Group())
+        fut = asyncio.get_running_loop().create_future()
+        group.items.append((user["public_id"], text, fut))
+        if self._remaining.get(key, 0) <= 0:
+            self._flush(key)
+        elif group.timer is None:
+            group.timer = asyncio.get_running_loop().call_later(self.wait_s, self._flush, key)
+        return await fut
+
+    def finish(self, user: Dict) -> None:
+        """Call when a due user's work is over; releases the group if they never sent."""
+        key = webhook_key(user)
+        if not self.enabled or not key[0] or user["public_id"] in self._settled:
+            return
+        self._settle(user, key)
+        if self._remaining.get(key, 0) <= 0 and key in self._groups:
+            self._flush(key)
+
+    def _settle(self, user: Dict, key: Key) -> None:
+        if user["public_id"] not in self._settled:
+            self._settled.add(user["public_id"])
+            self._remaining[key] = self._remaining.get(key, 0) - 1
+
+    def _flush(self, key: Key) -> None:
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        if group.timer is not None:
+            group.timer.cancel()
+        self._tasks.append(asyncio.create_task(self._deliver(key, group)))
+
+    async def _deliver(self, key: Key, group: _Group) -> None:
+        for chunk in pack(group.items, self.max_bytes):
+            self.requests += 1
+            try:
+                result = await send_text(key[0], merge(chunk), key[1] or None, self.clients)
+            except Exception as exc:
+                result = (False, f"http_error: {exc}")
+            for _, _, fut in chunk:
+                if not fut.done():
+                    fut.set_result(result)
+
+    async def aclose(self) -> None:
+        """Send anything still waiting (only possible if a caller never finished)."""
+        for key in list(self._groups):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"messages": self.messages, "requests": self.requests, "coalesced": self.messages - self.requests}
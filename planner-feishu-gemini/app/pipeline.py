@@ -0,0 +1,724 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from . import constraints, gemini, jsonrepair, local_planner
+from .aio_io import AsyncIO, LoopLagMonitor
+from .agenda_store import close_agenda_store
+from .batch import (
+    GEMINI_BATCH_SIZE,
+    GEMINI_BATCH_TOKEN_BUDGET,
+    BatchEntry,
+    build_batch_prompt,
+    make_entry,
+    max_output_tokens,
+    plan_batches,
+)
+from .clients import ClientRegistry
+from .data_io import (
+    CACHE_DIR,
+    plan_hash,
+)
+from .feishu import send_text
+from .journal import DeliveryJournal
+from .jsonstream import IncrementalJSONChecker, StreamAbort
+from .ledger import DELIVERED, FAILED, GENERATED, LEDGER_SLOT, SENDING, Ledger, LedgerBusy
+from .llm_cache import LLM_CACHE_ENABLED, LLM_CACHE_STATS_PATH, LLMCache
+from .local_planner import LOCAL_PLANNER, LOCAL_PLANNER_AFTER_S
+from .metrics import Metrics, percentile
+from .outbox import WebhookOutbox
+from .prompts import (
+    PROMPT_BATCH_PATH,
+    PROMPT_JSON_PATH,
+    PROMPT_JSON_SYSTEM_PATH,
+    PROMPT_PATHS,
+    PROMPT_REPAIR_PATH,
+    PROMPT_TEXT_PATH,
+    estimate_tokens,
+    plan_content,
+    template,
+)
+from .render import render_text
+from .resilience import Resilience
+from .scheduler import Scheduler
+from .shard import current_shard, owned, sharded_path
+from .types import Agenda
+
+STREAM_TIMINGS_PATH = os.path.join(CACHE_DIR, "stream_timings.json")
+PROMPT_SIZES_PATH = os.path.join(CACHE_DIR, "prompt_sizes.json")
+
+PREGEN_CONCURRENCY = int(os.getenv("PREGEN_CONCURRENCY", "2"))
+
+
+@dataclass
+class RunContext:
+    """Run-scoped resources shared by every process_user task."""
+
+    clients: ClientRegistry
+    journal: DeliveryJournal
+    ledger: Ledger
+    llm_cache: Optional[LLMCache] = None
+    context_cache: Optional[gemini.ContextCache] = None
+    resilience: Optional[Resilience] = None
+    metrics: Metrics = field(default_factory=lambda: Metrics(enabled=False))
+    io: AsyncIO = field(default_factory=lambda: AsyncIO(threads=0))
+    outbox: Optional[WebhookOutbox] = None
+    counters: Dict[str, int] = field(default_factory=dict)
+    stream_timings: List[Dict] = field(default_factory=list)
+    prompt_sizes: List[Dict] = field(default_factory=list)
+    gemini_usage: List[Dict] = field(default_factory=list)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+def _loads_json_like(raw: str, ctx: RunContext, partial: bool = False) -> dict:
+    """Parse a model reply; a reply cut off mid-value counts as a parse failure.
+
+    With ``partial`` (a batch reply keyed by public_id), only the entry the cut
+    happened in is dropped and the complete ones before it are kept.
+    """
+    with ctx.metrics.span("json_repair"):
+        obj, repairs = jsonrepair.loads(raw)
+    for name in repairs:
+        ctx.count(f"json_repair.{name}")
+    if "truncated" in repairs:
+        if not partial or not isinstance(obj, dict):
+            raise jsonrepair.JSONRepairError("output truncated")
+        if obj:
+            obj.pop(next(reversed(obj)))
+    return obj
+
+
+def _save_debug(public_id: str, date_str: str, *, raw: str | None, cleaned: str | None, candidate: str | None, err: Exception | None) -> None:
+    return None
+
+
+def _pad_time_component(comp: str) -> str:
+    comp = comp.strip()
+    return comp.zfill(2)
+
+
+def _norm_time(hhmm: str) -> str:
+    # Accept formats like 9:30 or 09:30, return HH:MM
+    parts = hhmm.strip().split(":")
+    if len(parts) != 2:
+        return hhmm.strip()
+    return f"{_pad_time_component(parts[0])}:{_pad_time_component(parts[1])}"
+
+
+def _normalize_schema(obj: dict, today_str: str) -> dict:
+    # If already appears to be our schema, return as-is
+    if isinstance(obj, dict) and "date" in obj and "blocks" in obj:
+        return obj
+
+    # Handle Chinese schema: {"今日行程": { "重点": [...], "上午": [...], "下午": [...], "晚上": {...}|[...] , "温馨提醒": "..." }}
+    root = obj
+    if "今日行程" in obj and isinstance(obj["今日行程"], dict):
+        root = obj["今日行程"]
+
+    focus = ""
+    blocks = []
+    reminders = []
+
+    # 重点 -> focus (join)
+    if isinstance(root.get("重点"), list):
+        focus = "；".join([str(x) for x in root.get("重点") if x is not None])[:200]
+
+    def collect_period(period_value):
+        if isinstance(period_value, list):
+            return period_value
+        if isinstance(period_value, dict):
+            return [period_value]
+        return []
+
+    for period_key in ["上午", "下午", "晚上"]:
+        for item in collect_period(root.get(period_key)):
+            if not isinstance(item, dict):
+                continue
+            time_str = str(item.get("时间", "")).strip()
+            task = str(item.get("活动", "")).strip()
+            # Parse time range e.g., 9:30-11:30
+            if "-" in time_str:
+                start_s, end_s = [x.strip() for x in time_str.split("-", 1)]
+                start_s, end_s = _norm_time(start_s), _norm_time(end_s)
+            else:
+                # Fallback: unknown range, skip
+                continue
+            blocks.append({
+                "start": start_s,
+                "end": end_s,
+                "task": task,
+                "priority": "S",
+            })
+
+    # 温馨提醒 -> reminders
+    if root.get("温馨提醒"):
+        reminders = [str(root.get("温馨提醒"))]
+
+    normalized = {
+        "date": today_str,
+        "focus": focus,
+        "blocks": blocks,
+        "reminders": reminders,
+        "risks": [],
+    }
+    return normalized
+
+
+def _to_agenda(obj: dict, today_str: str) -> dict:
+    try:
+        agenda = Agenda(**obj).model_dump()
+    except Exception:
+        # Normalize alternative schema into our schema
+        agenda = Agenda(**_normalize_schema(obj, today_str)).model_dump()
+    if not agenda["blocks"]:
+        # A header-only message is worse than the text fallback.
+        raise ValueError("agenda has no blocks")
+    return agenda
+
+
+def _stamp(agenda: dict, plan_md: str) -> dict:
+    agenda["plan_hash"] = plan_hash(plan_md)
+    return agenda
+
+
+def _is_fresh(agenda: Optional[dict], plan_md: Optional[str]) -> bool:
+    """An agenda stays valid unless it records a plan hash that no longer matches."""
+    if not agenda:
+        return False
+    recorded = agenda.get("plan_hash")
+    return recorded is None or not plan_md or recorded == plan_hash(plan_md)
+
+
+async def _mark(ctx: RunContext, public_id: str, date_str: str, state: str) -> None:
+    """Ledger transition: state changes on the loop, the line is appended on the I/O pool."""
+    line = ctx.ledger.transition(public_id, date_str, LEDGER_SLOT, state)
+    await ctx.io.run_in_pool(ctx.ledger.append, date_str, line)
+
+
+async def _send(user: Dict, date_str: str, text: str, ctx: RunContext) -> None:
+    """Send one message, bracketing it with ledger states so a crash mid-send is retried.
+
+    The delivery log is checked first: it still knows about an earlier run's
+    send when that run's ledger lines were lost (e.g. a ledger not restored in CI).
+    """
+    public_id = user["public_id"]
+    if await ctx.io.run_in_pool(ctx.journal.was_delivered, public_id, date_str):
+        ctx.count("journal_skipped")
+        await _mark(ctx, public_id, date_str, DELIVERED)
+        return
+    await _mark(ctx, public_id, date_str, SENDING)
+    with ctx.metrics.span("feishu"):
+        if ctx.outbox is not None:
+            ok, resp = await ctx.outbox.send(user, text)
+        else:
+            ok, resp = await send_text(user.get("feishu_webhook"), text, user.get("feishu_secret"), ctx.clients)
+    ctx.journal.append(public_id, date_str, "feishu", ok, resp)
+    await _mark(ctx, public_id, date_str, DELIVERED if ok else FAILED)
+
+
+async def _deliver_agenda(user: Dict, date_str: str, agenda: dict, ctx: RunContext) -> None:
+    with ctx.metrics.span("write_agenda"):
+        await ctx.io.write_agenda(user["public_id"], date_str, agenda)
+    await _mark(ctx, user["public_id"], date_str, GENERATED)
+    with ctx.metrics.span("render"):
+        text = render_text(agenda)
+    await _send(user, date_str, text, ctx)
+
+
+async def _generate_agenda_streaming(
+    public_id: str, prompt: str, system: str, today_str: str, ctx: RunContext
+) -> dict:
+    """Stream the JSON prompt, aborting as soon as the output cannot become an agenda."""
+    record: Dict = {"public_id": public_id}
+    ctx.stream_timings.append(record)
+    started = time.perf_counter()
+    checker = IncrementalJSONChecker()
+    try:
+        raw = await gemini.stream_generate_text(
+            prompt,
+            clients=ctx.clients,
+            cache=ctx.llm_cache,
+            on_text=checker.feed,
+            timings=record,
+            system=system,
+            context=ctx.context_cache,
+            resilience=ctx.resilience,
+        )
+        agenda = _to_agenda(_loads_json_like(raw, ctx), today_str)
+    except StreamAbort as exc:
+        record["aborted"] = str(exc)
+        record["abort_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        raise
+    record["valid_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if "usage" in record:
+        _record_usage(public_id, dict(record.pop("usage"), latency_ms=record["valid_ms"]), ctx)
+    return agenda
+
+
+def _record_usage(public_id: str, usage: Dict, ctx: RunContext) -> None:
+    if "promptTokenCount" not in usage:
+        return  # served from the LLM result cache
+    ctx.gemini_usage.append({
+        "public_id": public_id,
+        "prompt_tokens": usage.get("promptTokenCount", 0),
+        "cached_tokens": usage.get("cachedContentTokenCount", 0),
+        "latency_ms": usage.get("latency_ms"),
+    })
+
+
+def _usage_summary(records: List[Dict]) -> Dict:
+    """Input tokens and latency of JSON calls, split by whether the instruction came from the context cache."""
+    cached = [r for r in records if r["cached_tokens"]]
+    inline = [r for r in records if not r["cached_tokens"]]
+    prompt_tokens = sum(r["prompt_tokens"] for r in records)
+    cached_tokens = sum(r["cached_tokens"] for r in records)
+    return {
+        "calls": len(records),
+        "calls_cached": len(cached),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "uncached_tokens": prompt_tokens - cached_tokens,
+        "latency_p50_ms_cached": percentile([r["latency_ms"] for r in cached if r["latency_ms"] is not None], 50),
+        "latency_p50_ms_inline": percentile([r["latency_ms"] for r in inline if r["latency_ms"] is not None], 50),
+    }
+
+
+def _stream_summary(records: List[Dict]) -> Dict:
+    ttft = [r["ttft_ms"] for r in records if "ttft_ms" in r]
+    valid = [r["valid_ms"] for r in records if "valid_ms" in r]
+    return {
+        "users": len(records),
+        "aborted": sum(1 for r in records if "aborted" in r),
+        "ttft_p50_ms": percentile(ttft, 50),
+        "ttft_p95_ms": percentile(ttft, 95),
+        "valid_p50_ms": percentile(valid, 50),
+        "valid_p95_ms": percentile(valid, 95),
+    }
+
+
+async def _enforce_constraints(user: Dict, date_str: str, agenda: dict, ctx: RunContext) -> dict:
+    """Check blocks against the user's prefs; repair locally, else re-prompt once for the violations."""
+    prefs = user.get("prefs") or ""
+    cons = constraints.constraints_for_date(prefs, date_str)
+    ctx.count("constraints.checked")
+    violations = constraints.validate(agenda, cons)
+    if not violations:
+        return agenda
+    for v in violations:
+        ctx.count(f"constraints.{v.kind}")
+    repaired, _, lost = constraints.repair(agenda, cons)
+    remaining = constraints.validate(repaired, cons)
+    if not lost and not remaining:
+        ctx.count("constraints.repaired")
+        return repaired
+    if constraints.CONSTRAINTS_REPROMPT and LOCAL_PLANNER != "only":
+        ctx.count("constraints.reprompted")
+        try:
+            prompt = template(PROMPT_REPAIR_PATH).render(
+                today=date_str,
+                prefs=prefs,
+                violations=constraints.describe(violations, agenda),
+                agenda=json.dumps(agenda, ensure_ascii=False),
+            )
+            raw = await gemini.generate_text(
+                prompt, clients=ctx.clients, cache=ctx.llm_cache, resilience=ctx.resilience
+            )
+            fixed = _to_agenda(_loads_json_like(raw, ctx), date_str)
+            if not constraints.validate(fixed, cons):
+                ctx.count("constraints.reprompt_fixed")
+                return fixed
+        except Exception:
+            pass
+    ctx.count("constraints.unresolved")
+    if remaining:
+        # Never deliver an agenda that still breaks the constraints; the caller falls back.
+        raise ValueError(f"constraints unresolved: {constraints.describe(remaining, repaired)}")
+    return repaired
+
+
+def _plan_prompt(path: str, user: Dict, date_str: str, plan_md: str, ctx: RunContext) -> str:
+    """Render a single-user prompt with today's part of the plan and record its input size."""
+    with ctx.metrics.span("prompt"):
+        content = plan_content(plan_md, date_str)
+        prompt = template(path).render(today=date_str, prefs=user.get("prefs") or "", content=content.text)
+    ctx.prompt_sizes.append({
+        "public_id": user["public_id"],
+        "prompt": os.path.basename(path),
+        "plan_tokens": estimate_tokens(plan_md),
+        "content_tokens": content.tokens,
+        "prompt_tokens": estimate_tokens(prompt),
+        "section": content.section,
+        "truncated": content.truncated,
+    })
+    return prompt
+
+
+def _prompt_summary(records: List[Dict]) -> Dict:
+    tokens = [r["prompt_tokens"] for r in records]
+    return {
+        "prompts": len(records),
+        "plan_tokens": sum(r["plan_tokens"] for r in records),
+        "content_tokens": sum(r["content_tokens"] for r in records),
+        "prompt_tokens": sum(tokens),
+        "prompt_tokens_p50": percentile(tokens, 50),
+        "prompt_tokens_p95": percentile(tokens, 95),
+        "sectioned": sum(1 for r in records if r["section"]),
+        "truncated": sum(1 for r in records if r["truncated"]),
+    }
+
+
+async def _generate_agenda(
+    user: Dict, date_str: str, plan_md: str, ctx: RunContext, local_fallback: bool = True
+) -> dict:
+    """Local fast path, else JSON-prompt generation; raises on any HTTP, parse or validation failure.
+
+    With LOCAL_PLANNER=auto a fully structured plan never reaches Gemini, and a
+    Gemini call that errors or takes longer than LOCAL_PLANNER_AFTER_S falls
+    back to a lenient local plan when ``local_fallback`` is set.
+    """
+    prefs = user.get("prefs") or ""
+    today_plan = plan_content(plan_md, date_str).text
+    if LOCAL_PLANNER != "off":
+        with ctx.metrics.span("local_planner"):
+            agenda = local_planner.plan(today_plan, prefs, date_str, strict=LOCAL_PLANNER != "only")
+        if agenda is not None:
+            ctx.count("local_planner_fast")
+            return _stamp(agenda, plan_md)
+        if LOCAL_PLANNER == "only":
+            raise ValueError("local planner could not plan")
+    json_prompt = _plan_prompt(PROMPT_JSON_PATH, user, date_str, plan_md, ctx)
+    system = template(PROMPT_JSON_SYSTEM_PATH).render()
+    usage: Dict = {}
+    try:
+        if gemini.GEMINI_STREAM:
+            call = _generate_agenda_streaming(user["public_id"], json_prompt, system, date_str, ctx)
+        else:
+            call = gemini.generate_text(
+                json_prompt,
+                clients=ctx.clients,
+                cache=ctx.llm_cache,
+                system=system,
+                context=ctx.context_cache,
+                usage=usage,
+                resilience=ctx.resilience,
+            )
+        with ctx.metrics.span("gemini"):
+            if LOCAL_PLANNER == "auto" and local_fallback and LOCAL_PLANNER_AFTER_S > 0:
+                result = await asyncio.wait_for(call, LOCAL_PLANNER_AFTER_S)
+            else:
+                result = await call
+    except (gemini.GeminiError, asyncio.TimeoutError):
+        agenda = local_planner.plan(today_plan, prefs, date_str, strict=False) if local_fallback else None
+        if LOCAL_PLANNER != "auto" or agenda is None:
+            raise
+        ctx.count("local_planner_fallback")
+        return _stamp(agenda, plan_md)
+    _record_usage(user["public_id"], usage, ctx)
+    if gemini.GEMINI_STREAM:
+        agenda = result
+    else:
+        obj = _loads_json_like(result, ctx)
+        with ctx.metrics.span("validate"):
+            agenda = _to_agenda(obj, date_str)
+    with ctx.metrics.span("constraints"):
+        agenda = await _enforce_constraints(user, date_str, agenda, ctx)
+    return _stamp(agenda, plan_md)
+
+
+async def process_user(user: Dict, local_now, ctx: RunContext) -> None:
+    with ctx.metrics.span("process_user"):
+        try:
+            await _process_user(user, local_now, ctx)
+        finally:
+            if ctx.outbox is not None:
+                ctx.outbox.finish(user)
+
+
+async def _process_user(user: Dict, local_now, ctx: RunContext) -> None:
+    public_id = user["public_id"]
+
+    date_str = local_now.strftime("%Y-%m-%d")
+
+    with ctx.metrics.span("load_agenda"):
+        existing = await ctx.io.read_agenda(public_id, date_str)
+    with ctx.metrics.span("load_plan"):
+        plan_md = await ctx.io.load_preferred_plan_md(public_id, date_str)
+    if _is_fresh(existing, plan_md):
+        with ctx.metrics.span("render"):
+            text = render_text(existing)
+        await _send(user, date_str, text, ctx)
+        return
+
+    if not plan_md:
+        ctx.journal.append(public_id, date_str, "feishu", False, "no_plan_md")
+        await _mark(ctx, public_id, date_str, FAILED)
+        return
+
+    today_str = date_str
+    try:
+        agenda = await _generate_agenda(user, date_str, plan_md, ctx)
+        await _deliver_agenda(user, date_str, agenda, ctx)
+        return
+    except Exception as exc:
+        try:
+            _save_debug(public_id, date_str, raw=None, cleaned=None, candidate=None, err=exc)
+        except Exception:
+            pass
+        if isinstance(exc, gemini.CircuitOpen):
+            # Gemini is degraded: an agenda from an older plan beats a text fallback that would short-circuit too.
+            if existing:
+                ctx.count("breaker_stale_agenda")
+                await _send(user, date_str, render_text(existing), ctx)
+            else:
+                ctx.journal.append(public_id, date_str, "feishu", False, "circuit_open")
+                await _mark(ctx, public_id, date_str, FAILED)
+            return
+
+    if LOCAL_PLANNER == "only":
+        ctx.journal.append(public_id, date_str, "feishu", False, "local_planner_failed")
+        await _mark(ctx, public_id, date_str, FAILED)
+        return
+
+    try:
+        txt_prompt = _plan_prompt(PROMPT_TEXT_PATH, user, today_str, plan_md, ctx)
+        with ctx.metrics.span("gemini_text"):
+            text = await gemini.generate_text(
+                txt_prompt, clients=ctx.clients, cache=ctx.llm_cache, resilience=ctx.resilience
+            )
+        # If fallback looks like JSON, parse -> normalize -> render -> send
+        sent = False
+        if text and '{' in text and '}' in text:
+            try:
+                obj_fb = _loads_json_like(text, ctx)
+                agenda_fb = await _enforce_constraints(user, date_str, _to_agenda(obj_fb, today_str), ctx)
+                agenda_fb = _stamp(agenda_fb, plan_md)
+                await _deliver_agenda(user, date_str, agenda_fb, ctx)
+                sent = True
+            except Exception:
+                sent = False
+        if not sent:
+            await _send(user, date_str, text, ctx)
+    except Exception as exc:
+        ctx.journal.append(public_id, date_str, "feishu", False, f"fallback_error: {exc}")
+        await _mark(ctx, public_id, date_str, FAILED)
+
+
+async def pregenerate_user(user: Dict, local_now, ctx: RunContext, limit: asyncio.Semaphore) -> None:
+    """Write today's agenda ahead of the push window; nothing is sent.
+
+    Skips users whose stored agenda was generated from the same plan content.
+    Failures are left for the push tick, which retries with the full fallback chain.
+    """
+    public_id = user["public_id"]
+    date_str = local_now.strftime("%Y-%m-%d")
+    plan_md = await ctx.io.load_preferred_plan_md(public_id, date_str)
+    if not plan_md:
+        return
+    if _is_fresh(await ctx.io.read_agenda(public_id, date_str), plan_md):
+        ctx.count("pregen_fresh")
+        return
+    async with limit:
+        try:
+            agenda = await _generate_agenda(user, date_str, plan_md, ctx, local_fallback=False)
+        except Exception:
+            ctx.count("pregen_failed")
+            return
+    await ctx.io.write_agenda(public_id, date_str, agenda)
+    await _mark(ctx, public_id, date_str, GENERATED)
+    ctx.count("pregen_generated")
+
+
+async def process_batch(date_str: str, entries: List[BatchEntry], ctx: RunContext) -> None:
+    """Generate agendas for several same-day users with one Gemini call.
+
+    The response must be a JSON object keyed by public_id; any user whose entry is
+    missing or fails validation goes through the single-user process_user path.
+    """
+    ctx.count("batch_requests")
+    for e in entries:
+        content = plan_content(e.plan_md, date_str)
+        ctx.prompt_sizes.append({
+            "public_id": e.user["public_id"],
+            "prompt": os.path.basename(PROMPT_BATCH_PATH),
+            "plan_tokens": estimate_tokens(e.plan_md),
+            "content_tokens": content.tokens,
+            "prompt_tokens": e.tokens,
+            "section": content.section,
+            "truncated": content.truncated,
+        })
+    try:
+        prompt = build_batch_prompt(template(PROMPT_BATCH_PATH), date_str, entries)
+        raw = await gemini.generate_text(
+            prompt,
+            clients=ctx.clients,
+            cache=ctx.llm_cache,
+            max_output_tokens=max_output_tokens(entries),
+            resilience=ctx.resilience,
+        )
+        obj = _loads_json_like(raw, ctx, partial=True)
+    except Exception:
+        obj = {}
+    leftovers: List[BatchEntry] = []
+    ready: List = []
+    for entry in entries:
+        try:
+            agenda = _to_agenda(obj[entry.user["public_id"]], date_str)
+        except Exception:
+            leftovers.append(entry)
+            continue
+        ctx.count("batch_users_ok")
+        ready.append((entry, agenda))
+    ctx.count("batch_users_fallback", len(leftovers))
+
+    async def deliver(entry: BatchEntry, agenda: dict) -> None:
+        try:
+            agenda = _stamp(await _enforce_constraints(entry.user, date_str, agenda, ctx), entry.plan_md)
+            await _deliver_agenda(entry.user, date_str, agenda, ctx)
+        finally:
+            if ctx.outbox is not None:
+                ctx.outbox.finish(entry.user)
+
+    # Concurrently, so batch users sharing a group bot can be coalesced into one message.
+    await asyncio.gather(
+        *(deliver(entry, agenda) for entry, agenda in ready),
+        *(process_user(e.user, e.local_now, ctx) for e in leftovers),
+    )
+
+
+async def _start_tasks(due: List, ctx: RunContext) -> List[asyncio.Task]:
+    if GEMINI_BATCH_SIZE <= 1 or LOCAL_PLANNER == "only":
+        return [asyncio.create_task(process_user(u, local_now, ctx)) for u, local_now in due]
+    tasks: List[asyncio.Task] = []
+    pending: Dict[str, List[BatchEntry]] = {}
+    dates = [local_now.strftime("%Y-%m-%d") for _, local_now in due]
+    with ctx.metrics.span("batch_prefetch"):
+        plans = await asyncio.gather(*(ctx.io.load_preferred_plan_md(u["public_id"], d) for (u, _), d in zip(due, dates)))
+        agendas = await asyncio.gather(*(ctx.io.read_agenda(u["public_id"], d) for (u, _), d in zip(due, dates)))
+    for (u, local_now), date_str, plan_md, existing in zip(due, dates, plans, agendas):
+        if not _is_fresh(existing, plan_md):
+            local = LOCAL_PLANNER != "off" and plan_md and local_planner.plan(
+                plan_content(plan_md, date_str).text, u.get("prefs") or "", date_str
+            )
+            if plan_md and not local:
+                pending.setdefault(date_str, []).append(make_entry(u, local_now, plan_md))
+                continue
+        tasks.append(asyncio.create_task(process_user(u, local_now, ctx)))
+    for date_str, entries in pending.items():
+        for chunk in plan_batches(entries, GEMINI_BATCH_SIZE, GEMINI_BATCH_TOKEN_BUDGET):
+            tasks.append(asyncio.create_task(process_batch(date_str, chunk, ctx)))
+    return tasks
+
+
+async def run_due(due: List, pregen: List, started: float, metrics: Metrics, skipped: int = 0) -> None:
+    """Serve ``due`` and pregenerate ``pregen`` (lists of (user, local_now)) under the ledger lock.
+
+    Shared by the cron tick and the daemon's timed fires (via ``main.run_due``). Under
+    ``--shard i/N`` only this shard's users are kept. ``skipped`` counts due users
+    the caller's lock-free ledger pre-check already dropped.
+    """
+    due, pregen = owned(due), owned(pregen)
+    if not due and not pregen:
+        return
+    ledger = Ledger()
+    try:
+        ledger.acquire()
+    except LedgerBusy as exc:
+        print(json.dumps({"skipped": str(exc)}, ensure_ascii=False))
+        return
+    try:
+        await _run(due, pregen, ledger, started, metrics, skipped)
+    finally:
+        ledger.release()
+
+
+async def _run(due: List, pregen: List, ledger: Ledger, started: float, metrics: Metrics, skipped: int) -> None:
+    # Ledger lookups only: no plan, agenda or network I/O for users already handled.
+    # Repeated under the lock, since another run may have finished since the caller's pre-check.
+    due_total = len(due) + skipped
+    with metrics.span("ledger_filter"):
+        due, pregen = ledger.unhandled(due, pregen)
+    if not due and not pregen:
+        return
+    with metrics.span("compile_prompts"):
+        for path in PROMPT_PATHS:
+            template(path)  # compile every prompt once, failing fast on a broken file
+    scheduler = Scheduler()
+    io = AsyncIO()
+    lag = LoopLagMonitor(metrics)
+    lag.start()
+    async with ClientRegistry(scheduler=scheduler, metrics=metrics) as clients, DeliveryJournal(
+        run_blocking=io.run_in_pool
+    ) as journal:
+        ctx = RunContext(
+            clients=clients,
+            journal=journal,
+            ledger=ledger,
+            llm_cache=LLMCache(run_blocking=io.run_in_pool) if LLM_CACHE_ENABLED else None,
+            # Both constructors read their state files, so they load on the pool.
+            context_cache=await io.run_in_pool(gemini.ContextCache) if gemini.GEMINI_CONTEXT_CACHE else None,
+            resilience=await io.run_in_pool(Resilience),
+            metrics=metrics,
+            io=io,
+            outbox=WebhookOutbox.for_users(clients, [u for u, _ in due]),
+        )
+        limit = asyncio.Semaphore(max(1, PREGEN_CONCURRENCY))
+        tasks = await _start_tasks(due, ctx)
+        tasks += [asyncio.create_task(pregenerate_user(u, local_now, ctx, limit)) for u, local_now in pregen]
+        with metrics.span("users"):
+            # One user's unexpected error (or cancellation) must not abort everyone else's delivery.
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, BaseException):
+                    ctx.count("task_errors")
+        await ctx.outbox.aclose()
+    await io.aclose()  # after the journal's last flush, which runs on the same pool
+    await lag.stop()
+    with metrics.span("close_store"):
+        close_agenda_store()
+    summary = {
+        "users": len(due),
+        "ledger_skipped": due_total - len(due),
+        "pregen_users": len(pregen),
+        "wall_s": round(time.perf_counter() - started, 3),
+        "http": clients.stats(),
+        "scheduler": scheduler.stats(),
+        "counters": ctx.counters,
+        "deliveries_written": journal.written,
+        "io": io.stats(),
+        "outbox": ctx.outbox.stats(),
+    }
+    shard = current_shard()
+    if shard is not None:
+        summary["shard"] = f"{shard.index}/{shard.count}"
+    if ctx.llm_cache is not None:
+        ctx.llm_cache.evict()
+        ctx.llm_cache.write_stats(sharded_path(LLM_CACHE_STATS_PATH))
+        summary["llm_cache"] = ctx.llm_cache.stats()
+    if ctx.context_cache is not None:
+        ctx.context_cache.save()
+        summary["context_cache"] = ctx.context_cache.stats()
+    if ctx.resilience is not None and ctx.resilience.calls:
+        ctx.resilience.save()
+        summary["resilience"] = ctx.resilience.stats()
+    if ctx.gemini_usage:
+        summary["gemini_usage"] = _usage_summary(ctx.gemini_usage)
+    if ctx.prompt_sizes:
+        summary["prompt"] = _prompt_summary(ctx.prompt_sizes)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(sharded_path(PROMPT_SIZES_PATH), "w", encoding="utf-8") as f:
+            json.dump(ctx.prompt_sizes, f, ensure_ascii=False, indent=2)
+    if ctx.stream_timings:
+        summary["stream"] = _stream_summary(ctx.stream_timings)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(sharded_path(STREAM_TIMINGS_PATH), "w", encoding="utf-8") as f:
+            json.dump(ctx.stream_timings, f, ensure_ascii=False, indent=2)
+    if metrics.enabled:
+        summary.update(metrics.summary())
+        metrics.write(summary)
+    print(json.dumps(summary, ensure_ascii=False))
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import os
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+PROMPT_JSON_PATH = os.path.join(ROOT_DIR, "prompt.json.txt")
+PROMPT_JSON_SYSTEM_PATH = os.path.join(ROOT_DIR, "prompt.json.system.txt")
+PROMPT_TEXT_PATH = os.path.join(ROOT_DIR, "prompt.text.txt")
+PROMPT_BATCH_PATH = os.path.join(ROOT_DIR, "prompt.batch.txt")
+PROMPT_REPAIR_PATH = os.path.join(ROOT_DIR, "prompt.repair.txt")
+PROMPT_PATHS = (PROMPT_JSON_PATH, PROMPT_JSON_SYSTEM_PATH, PROMPT_TEXT_PATH, PROMPT_BATCH_PATH, PROMPT_REPAIR_PATH)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+TRUNCATION_MARK = "…（计划过长，已截断）"
+
+_PLACEHOLDER_RE = re.compile(r"\{\{|\}\}|\{([A-Za-z_][A-Za-z0-9_]*)\}")
+_WEEKDAYS = [
+    ("一", "monday", "mon"),
+    ("二", "tuesday", "tue"),
+    ("三", "wednesday", "wed"),
+    ("四", "thursday", "thu"),
+    ("五", "friday", "fri"),
+    ("六", "saturday", "sat"),
+    ("日", "sunday", "sun"),
+]
+_CN_WEEKDAY_RE = re.compile(r"(?:周|星期|礼拜)([一二三四五六日天])")
+_EN_WEEKDAY_RE = re.compile(r"\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b", re.IGNORECASE)
+_RANGE_SEP = r"\s*(?:至|到|~|～|-|–|—)\s*"
+_RANGE_SEP_RE = re.compile(_RANGE_SEP)
+_CN_WEEKDAY_RANGE_RE = re.compile(rf"(?:周|星期|礼拜)([一二三四五六日天]){_RANGE_SEP}(?:周|星期|礼拜)?([一二三四五六日天])")
+_EN_WEEKDAY_RANGE_RE = re.compile(
+    r"\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\s*(?:-|–|—|~|\bto\b|\bthrough\b|\bthru\b)\s*(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b",
+    re.IGNORECASE,
+)
+_WEEK_GROUPS = {"工作日": range(0, 5), "weekday": range(0, 5), "周末": range(5, 7), "双休日": range(5, 7), "weekend": range(5, 7)}
+_WEEK_GROUP_RE = re.compile(r"工作日|周末|双休日|\b(?:weekday|weekend)s?\b", re.IGNORECASE)
+# A separator between a marker and a bare day ("9月26日-28日", "26-9月28日") is a range we cannot read.
+_SEP_AFTER_RE = re.compile(r"\s*(?:至|到|~|～|-|–|—)\s*[\d一二三四五六日天]")
+_SEP_BEFORE_RE = re.compile(r"\d\s*(?:至|到|~|～|-|–|—)\s*$")
+MAX_RANGE_DAYS = 62
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+_MD_DATE_RE = re.compile(r"(\d{1,2})\s*(?:月|/)\s*(\d{1,2})\s*(?:日|号)?")
+_MD_HEADING_RE = re.compile(r"^\s*#{1,6}\s+.+$")
+_DAY_TOKEN = (
+    r"(?:\d{4}-\d{1,2}-\d{1,2}|\d{1,2}\s*(?:月|/)\s*\d{1,2}\s*(?:日|号)?|(?:周|星期|礼拜)[一二三四五六日天]"
+    r"|工作日|周末|双休日|\b(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+    r"|mon|tues?|wed|thu(?:rs?)?|fri|sat|sun|weekdays?|weekends?)\b\.?)"
+)
+_DAY_TOKEN_RE = re.compile(_DAY_TOKEN, re.IGNORECASE)
+_DAY_LABEL_START_RE = re.compile(rf"\s*(?:\*\*|__|[【\[])?\s*{_DAY_TOKEN}", re.IGNORECASE)
+_DAY_NOTE_RE = re.compile(r"[(（][^)）]{0,20}[)）]")
+# What may sit between the markers of a day label: separators, emphasis and bare range ends ("周一到五").
+_DAY_LABEL_REST_RE = re.compile(r"(?:[\s,，、/&~～\-–—*_【】\[\]\d一二三四五六日天号至到和及.]|\b(?:to|through|thru|and)\b)*", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per four other characters."""
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class Template:
+    """A prompt file compiled once into literal chunks and ``{name}`` slots.
+
+    Only ``{identifier}`` is a placeholder; any other brace (a JSON example in
+    the template) is literal, and ``{{``/``}}`` still collapse to one brace so
+    existing templates render unchanged. Values are inserted verbatim, so
+    braces inside a user's plan are never interpreted.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.parts: List[Tuple[bool, str]] = []  # (is_placeholder, literal-or-name)
+        pos = 0
+        literal: List[str] = []
+        for m in _PLACEHOLDER_RE.finditer(text):
+            literal.append(text[pos:m.start()])
+            pos = m.end()
+            if m.group(1) is None:
+                literal.append(m.group(0)[0])
+                continue
+            self.parts.append((False, "".join(literal)))
+            literal = []
+            self.parts.append((True, m.group(1)))
+        literal.append(text[pos:])
+        self.parts.append((False, "".join(literal)))
+        self.names = {value for is_slot, value in self.parts if is_slot}
+
+    def render(self, **values: object) -> str:
+        missing = self.names - values.keys()
+        if missing:
+            raise KeyError(f"missing prompt values: {sorted(missing)}")
+        return "".join(str(values[value]) if is_slot else value for is_slot, value in self.parts)
+
+
+@lru_cache(maxsize=None)
+def template(path: str) -> Template:
+    """Compiled template for ``path``, read from disk once per process."""
+    with open(path, "r", encoding="utf-8") as f:
+        return Template(f.read())
+
+
+DayKey = Tuple[Optional[int], int, int]  # (year or None, month, day)
+
+
+class Section(NamedTuple):
+    title: str
+    dates: Set[DayKey]
+    weekdays: Set[int]
+    lines: List[str]
+    unclear: bool = False  # a range the heading names but that could not be read
+
+
+def _weekday(name: str) -> int:
+    name = "日" if name == "天" else name.lower()[:3]
+    return next(i for i, names in enumerate(_WEEKDAYS) if name in (names[0], names[2]))
+
+
+def _date_range(start: DayKey, end: DayKey) -> Optional[Set[DayKey]]:
+    """Every day from ``start`` to ``end``; None if either is not a date or the span is implausible."""
+    year = start[0] or end[0]
+    try:
+        # Without a year use a leap year, and let a range like 12/30-1/2 run into the next one.
+        first = date(year or 2000, start[1], start[2])
+        last = date(year or 2000, end[1], end[2])
+        if last < first and year is None:
+            last = last.replace(year=2001)
+    except ValueError:
+        return None
+    span = (last - first).days
+    if not 0 <= span <= MAX_RANGE_DAYS:
+        return None
+    days = (first + timedelta(days=i) for i in range(span + 1))
+    return {(d.year if year else None, d.month, d.day) for d in days}
+
+
+def _day_markers(line: str) -> Tuple[Set[DayKey], Set[int], bool]:
+    """Dates, weekdays and whether the line names a range that could not be read.
+
+    Ranges (``周一至周五``, ``周一到五``, ``Mon-Fri``, ``9/26-9/28``) and
+    ``工作日``/``周末`` expand to every day they cover. A lone marker next to a
+    range separator (``9月26日-28日``) makes the line unclear.
+    """
+    dates: Set[DayKey] = set()
+    weekdays: Set[int] = set()
+    taken: List[Tuple[int, int]] = []
+    singles: List[Tuple[int, int]] = []
+
+    def free(m: "re.Match") -> bool:
+        return not any(s < m.end() and m.start() < e for s, e in taken)
+
+    for regex in (_CN_WEEKDAY_RANGE_RE, _EN_WEEKDAY_RANGE_RE):
+        for m in regex.finditer(line):
+            first, last = _weekday(m.group(1)), _weekday(m.group(2))
+            weekdays.update((first + i) % 7 for i in range((last - first) % 7 + 1))
+            taken.append(m.span())
+    for m in _WEEK_GROUP_RE.finditer(line):
+        weekdays.update(_WEEK_GROUPS[m.group(0).lower().rstrip("s")])
+        taken.append(m.span())
+    for regex in (_CN_WEEKDAY_RE, _EN_WEEKDAY_RE):
+        for m in regex.finditer(line):
+            if free(m):
+                weekdays.add(_weekday(m.group(1)))
+                singles.append(m.span())
+
+    markers = [(m.span(), (int(m.group(1)), int(m.group(2)), int(m.group(3)))) for m in _ISO_DATE_RE.finditer(line)]
+    if not markers:
+        markers = [(m.span(), (None, int(m.group(1)), int(m.group(2)))) for m in _MD_DATE_RE.finditer(line)]
+    unclear = False
+    i = 0
+    while i < len(markers):
+        span, key = markers[i]
+        if i + 1 < len(markers) and _RANGE_SEP_RE.fullmatch(line[span[1]:markers[i + 1][0][0]]):
+            covered = _date_range(key, markers[i + 1][1])
+            if covered is None:
+                unclear = True
+            else:
+                dates |= covered
+            i += 2
+            continue
+        dates.add(key)
+        if _SEP_BEFORE_RE.search(line, 0, span[0]):
+            unclear = True
+        singles.append(span)
+        i += 1
+    if any(_SEP_AFTER_RE.match(line, end) for _, end in singles):
+        unclear = True
+    return dates, weekdays, unclear
+
+
+def _is_heading(line: str) -> bool:
+    """A ``#`` line, or a day label (``周五``, ``9月26日（周五）``, ``周一至周五：...``).
+
+    A day label opens with a day marker and, up to an optional colon, holds
+    nothing but markers, separators and short notes in brackets, so a body
+    line that mentions a day (``周三前把报告交给老板``) is not a heading.
+    """
+    if _MD_HEADING_RE.match(line):
+        return True
+    if not _DAY_LABEL_START_RE.match(line):
+        return False
+    label = re.split(r"[:：]", line, 1)[0]
+    rest = _DAY_TOKEN_RE.sub(" ", _DAY_NOTE_RE.sub(" ", label))
+    return _DAY_LABEL_REST_RE.fullmatch(rest) is not None
+
+
+def split_sections(plan_md: str) -> Tuple[List[str], List[Section]]:
+    """Split a plan into shared preamble lines and per-day sections.
+
+    A day section starts at a heading naming a date (``2025-09-26``,
+    ``9月26日``, ``9/26``), a weekday (``周一``, ``星期三``, ``Friday``) or a
+    range of either (``周一至周五``, ``工作日``) and runs to the next such
+    heading. A heading is a ``#`` line, or a line made of just those markers,
+    optionally followed by a colon and text (``周五：``, ``9月26日（周五）``);
+    a body line that merely mentions a day (``周三前交报告``) is not one.
+    """
+    preamble: List[str] = []
+    sections: List[Section] = []
+    for line in plan_md.splitlines():
+        if _is_heading(line):
+            dates, weekdays, unclear = _day_markers(line)
+            if dates or weekdays or unclear:
+                sections.append(Section(line.strip(), dates, weekdays, [line], unclear))
+                continue
+        (sections[-1].lines if sections else preamble).append(line)
+    return preamble, sections
+
+
+def _section_matches(section: Section, day: date) -> bool:
+    for year, month, dom in section.dates:
+        if (year is None or year == day.year) and month == day.month and dom == day.day:
+            return True
+    return not section.dates and day.weekday() in section.weekdays
+
+
+class PlanContent(NamedTuple):
+    text: str
+    tokens: int
+    section: Optional[str]  # title of the selected day section, if any
+    truncated: bool
+
+
+def _fit(lines: List[str], budget: int) -> Tuple[List[str], bool]:
+    """Longest prefix of ``lines`` within ``budget`` tokens (newline included)."""
+    kept: List[str] = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            return kept, True
+        kept.append(line)
+        used += cost
+    return kept, False
+
+
+@lru_cache(maxsize=256)
+def plan_content(plan_md: str, date_str: str, budget: int = PROMPT_TOKEN_BUDGET) -> PlanContent:
+    """The part of a plan to put in the prompt for ``date_str``, within ``budget`` tokens.
+
+    If the plan has day sections, the ones for this date (or, lacking dated
+    sections, this weekday) are kept together with the shared preamble; a plan
+    without a matching section, or with a heading whose days cannot be read,
+    is used whole. Truncation is deterministic and
+    line-wise: the day section is kept first, the preamble gets what is left,
+    each is cut from its end, and TRUNCATION_MARK is appended.
+    """
+    preamble, sections = split_sections(plan_md)
+    day = date.fromisoformat(date_str)
+    chosen = [] if any(s.unclear for s in sections) else [s for s in sections if _section_matches(s, day)]
+    if chosen:
+        body = [line for s in chosen for line in s.lines]
+        title: Optional[str] = " / ".join(s.title for s in chosen)
+    else:
+        preamble, body, title = plan_md.splitlines(), [], None
+    limit = max(0, budget - estimate_tokens(TRUNCATION_MARK) - 1)
+    total = sum(estimate_tokens(line) + 1 for line in preamble + body)
+    truncated = total > budget
+    if truncated:
+        body, _ = _fit(body, limit)
+        body_cost = sum(estimate_tokens(line) + 1 for line in body)
+        preamble, _ = _fit(preamble, limit - body_cost)
+    lines = preamble + body + ([TRUNCATION_MARK] if truncated else [])
+    text = "\n".join(lines).strip("\n")
+    return PlanContent(text, estimate_tokens(text), title, truncated)
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from .clients import RequestClock, request_clock
+from .metrics import percentile
+from .data_io import CACHE_DIR
+
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "2"))
+GEMINI_RETRY_BASE_S = float(os.getenv("GEMINI_RETRY_BASE_S", "0.5"))
+GEMINI_RETRY_MAX_S = float(os.getenv("GEMINI_RETRY_MAX_S", "8"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "1").lower() in ("1", "true", "yes")
+GEMINI_HEDGE_MODEL = os.getenv("GEMINI_HEDGE_MODEL", "")
+GEMINI_HEDGE_AFTER_S = float(os.getenv("GEMINI_HEDGE_AFTER_S", "8"))
+GEMINI_HEDGE_BUDGET = float(os.getenv("GEMINI_HEDGE_BUDGET", "0.1"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_COOLDOWN_S = float(os.getenv("GEMINI_BREAKER_COOLDOWN_S", "30"))
+LATENCY_PATH = os.path.join(CACHE_DIR, "gemini_latency.json")
+LATENCY_WINDOW = 512
+LATENCY_VERSION = 2
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_S = 1.0
+
+T = TypeVar("T")
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Errors that carry ``retryable=True`` (no response, 429, 5xx) are worth another attempt."""
+    return bool(getattr(exc, "retryable", False))
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one probe) -> closed.
+
+    After ``threshold`` retryable failures in a row the breaker opens and
+    ``allow()`` refuses calls for ``cooldown_s``; then a single probe is let
+    through, and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, threshold: int = GEMINI_BREAKER_FAILURES, cooldown_s: float = GEMINI_BREAKER_COOLDOWN_S) -> None:
+        self.threshold = max(1, threshold)
+        self.cooldown_s = cooldown_s
+        self.state = "closed"
+        self.opens = 0
+        self.short_circuits = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.cooldown_s:
+                self.short_circuits += 1
+                return False
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            if self._probing:
+                self.short_circuits += 1
+                return False
+            self._probing = True
+        return True
+
+    def record(self, ok: bool) -> None:
+        self._probing = False
+        if ok:
+            self._failures = 0
+            self.state = "closed"
+            return
+        self._failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self._failures >= self.threshold):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self.opens += 1
+
+
+class Resilience:
+    """Run-scoped retry, hedging and circuit-breaking policy for one provider.
+
+    ``run(attempt, model)`` calls ``attempt(model)``; retryable failures are
+    retried with full-jitter exponential backoff. When hedging is on and an
+    attempt is still pending after the hedge delay (the observed p95 latency,
+    or GEMINI_HEDGE_AFTER_S until enough samples exist), a duplicate goes out,
+    optionally to ``hedge_model``, and the first success wins. Hedges are
+    capped at ``hedge_budget`` per call so an overloaded provider does not see
+    double traffic. Latency samples persist across runs in
+    ``data/cache/gemini_latency.json``.
+    """
+
+    def __init__(
+        self,
+        retries: int = GEMINI_RETRIES,
+        retry_base_s: float = GEMINI_RETRY_BASE_S,
+        retry_max_s: float = GEMINI_RETRY_MAX_S,
+        hedge: bool = GEMINI_HEDGE,
+        hedge_model: str = GEMINI_HEDGE_MODEL,
+        hedge_after_s: float = GEMINI_HEDGE_AFTER_S,
+        hedge_budget: float = GEMINI_HEDGE_BUDGET,
+        breaker: Optional[CircuitBreaker] = None,
+        path: Optional[str] = LATENCY_PATH,
+    ) -> None:
+        self.retries = max(0, retries)
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.hedge = hedge
+        self.hedge_model = hedge_model
+        self.hedge_after_s = hedge_after_s
+        self.hedge_budget = hedge_budget
+        self.breaker = breaker or CircuitBreaker()
+        self.path = path
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.attempts = 0
+        self.retried = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+        self.censored = 0
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                # Older files are a bare list timed from before the scheduler wait; drop them.
+                if data.get("version") == LATENCY_VERSION:
+                    self.latencies.extend(float(v) for v in data["samples"])
+            except Exception:
+                pass
+
+    def admit(self) -> bool:
+        return self.breaker.allow()
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return self.hedge_after_s
+        return max(HEDGE_MIN_S, percentile(list(self.latencies), HEDGE_PERCENTILE))
+
+    async def run(
+        self,
+        attempt: Callable[[str], Awaitable[T]],
+        model: str,
+        hedge: bool = True,
+        can_retry: Optional[Callable[[], bool]] = None,
+    ) -> T:
+        """Call ``attempt`` under the policy; the breaker hears the final outcome.
+
+        ``can_retry`` lets a caller veto further attempts, e.g. a stream that
+        has already handed text to its consumer. Only retryable failures (and
+        cancellation, which here means the caller gave up waiting) count
+        against the breaker; a 4xx or a bad payload shows the provider is up.
+        """
+        self.calls += 1
+        try:
+            result = await self._retrying(attempt, model, hedge and self.hedge, can_retry)
+        except asyncio.CancelledError:
+            self.breaker.record(False)
+            raise
+        except Exception as exc:
+            self.failures += 1
+            self.breaker.record(not is_retryable(exc))
+            raise
+        self.breaker.record(True)
+        return result
+
+    async def _retrying(
+        self,
+        attempt: Callable[[str], Awaitable[T]],
+        model: str,
+        hedge: bool,
+        can_retry: Optional[Callable[[], bool]],
+    ) -> T:
+        for n in range(self.retries + 1):
+            try:
+                return await (self._hedged(attempt, model) if hedge else self._timed(attempt, model))
+            except Exception as exc:
+                last = n == self.retries or self.breaker.state == "open"
+                if last or not is_retryable(exc) or (can_retry is not None and not can_retry()):
+                    raise
+            self.retried += 1
+            await asyncio.sleep(random.uniform(0, min(self.retry_max_s, self.retry_base_s * 2 ** n)))
+        raise AssertionError("unreachable")
+
+    async def _timed(
+        self,
+        attempt: Callable[[str], Awaitable[T]],
+        model: str,
+        clock: Optional[RequestClock] = None,
+        record: bool = True,
+    ) -> T:
+        """One attempt; with ``record`` its latency becomes a hedge-delay sample.
+
+        The sample runs from when the attempt's request went out (``clock``), so
+        time spent waiting for a scheduler slot does not count as provider
+        latency. An attempt cancelled before it answered (its hedge won, or the
+        caller gave up) is recorded as a censored sample, the time it had run so
+        far: dropping it would leave out exactly the slow tail the p95 is for.
+        One cancelled while still queued never reached the provider and is skipped.
+        """
+        self.attempts += 1
+        clock = clock or RequestClock()
+        token = request_clock.set(clock)
+        try:
+            result = await attempt(model)
+        except asyncio.CancelledError:
+            if record and clock.started is not None:
+                self.latencies.append(round(time.monotonic() - clock.started, 3))
+                self.censored += 1
+            raise
+        finally:
+            request_clock.reset(token)
+        if record and clock.started is not None:
+            self.latencies.append(round(time.monotonic() - clock.started, 3))
+        return result
+
+    async def _hedged(self, attempt: Callable[[str], Awaitable[T]], model: str) -> T:
+        # Only the primary is sampled: it measures what the provider would have
+        # taken unhedged, while a backup's time depends on when the primary ended.
+        clock = RequestClock()
+        primary = asyncio.ensure_future(self._timed(attempt, model, clock))
+        tasks = [primary]
+        try:
+            # The hedge delay counts from when the primary left the queue; a
+            # duplicate of a request still waiting for a slot would only queue too.
+            sent = asyncio.ensure_future(clock.sent.wait())
+            try:
+                await asyncio.wait([primary, sent], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sent.cancel()
+            if not primary.done():
+                await asyncio.wait(tasks, timeout=clock.started + self.hedge_delay() - time.monotonic())
+            if primary.done():
+                return primary.result()
+            if self.hedges >= max(1.0, self.hedge_budget * self.calls):
+                return await primary
+            self.hedges += 1
+            backup = asyncio.ensure_future(self._timed(attempt, self.hedge_model or model, record=False))
+            tasks.append(backup)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error  # type: ignore[misc]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def save(self) -> None:
+        if not self.path or not self.latencies:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": LATENCY_VERSION, "samples": list(self.latencies)}, f)
+        os.replace(tmp, self.path)
+
+    def stats(self) -> Dict:
+        samples = [v * 1000 for v in self.latencies]
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retried,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "censored_samples": self.censored,
+            "breaker_state": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "short_circuits": self.breaker.short_circuits,
+            "hedge_delay_s": round(self.hedge_delay(), 3),
+            "latency_p50_ms": percentile(samples, 50),
+            "latency_p95_ms": percentile(samples, 95),
+            "latency_p99_ms": percentile(samples, 99),
+        }
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+GEMINI_RPS = float(os.getenv("GEMINI_RPS", "5"))
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "5"))
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+GEMINI_CONCURRENCY_MIN = int(os.getenv("GEMINI_CONCURRENCY_MIN", "1"))
+GEMINI_CONCURRENCY_MAX = int(os.getenv("GEMINI_CONCURRENCY_MAX", "16"))
+
+FEISHU_RPS = float(os.getenv("FEISHU_RPS", "20"))
+FEISHU_BURST = float(os.getenv("FEISHU_BURST", "20"))
+FEISHU_CONCURRENCY = int(os.getenv("FEISHU_CONCURRENCY", "8"))
+FEISHU_CONCURRENCY_MIN = int(os.getenv("FEISHU_CONCURRENCY_MIN", "1"))
+FEISHU_CONCURRENCY_MAX = int(os.getenv("FEISHU_CONCURRENCY_MAX", "32"))
+# Feishu custom bots allow 5 req/s (100 req/min) per webhook.
+FEISHU_WEBHOOK_RPS = float(os.getenv("FEISHU_WEBHOOK_RPS", "5"))
+FEISHU_WEBHOOK_BURST = float(os.getenv("FEISHU_WEBHOOK_BURST", "5"))
+
+AIMD_BACKOFF_INTERVAL = float(os.getenv("AIMD_BACKOFF_INTERVAL", "1"))
+
+
+def is_congestion_status(status: Optional[int]) -> bool:
+    """429 and 5xx (or no response at all) mean the provider wants us to slow down."""
+    return status is None or status == 429 or status >= 500
+
+
+class TokenBucket:
+    """Classic token bucket; ``rate <= 0`` disables throttling."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        # The lock keeps waiters FIFO so a burst cannot starve earlier callers.
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                self.waited += 1
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class AIMDLimiter:
+    """Concurrency limit with additive increase on success and multiplicative decrease on congestion."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease: float = 0.5) -> None:
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.decrease = decrease
+        self.in_flight = 0
+        self.congestion_events = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, congested: Optional[bool]) -> None:
+        """Free a slot; ``congested=None`` (a cancelled request) gives no feedback either way."""
+        async with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if congested:
+                self.congestion_events += 1
+                # Responses already in flight during one overload burst count as one signal.
+                if now - self._last_decrease >= AIMD_BACKOFF_INTERVAL:
+                    self.limit = max(float(self.minimum), self.limit * self.decrease)
+                    self._last_decrease = now
+            elif congested is not None:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class Slot:
+    def __init__(self) -> None:
+        self.status: Optional[int] = None
+
+    def record(self, status: int) -> None:
+        self.status = status
+
+
+class _Provider:
+    def __init__(self, rps: float, burst: float, concurrency: int, cmin: int, cmax: int,
+                 key_rps: float = 0.0, key_burst: float = 1.0) -> None:
+        self.bucket = TokenBucket(rps, burst)
+        self.limiter = AIMDLimiter(concurrency, cmin, cmax)
+        self.key_rps = key_rps
+        self.key_burst = key_burst
+        self.key_buckets: Dict[str, TokenBucket] = {}
+
+    def key_bucket(self, key: Optional[str]) -> Optional[TokenBucket]:
+        if not key or self.key_rps <= 0:
+            return None
+        bucket = self.key_buckets.get(key)
+        if bucket is None:
+            bucket = self.key_buckets[key] = TokenBucket(self.key_rps, self.key_burst)
+        return bucket
+
+
+class Scheduler:
+    """Run-scoped admission control in front of the Gemini and Feishu providers.
+
+    Every outbound request takes a token from its provider bucket (and from the
+    per-key bucket, e.g. one per Feishu webhook), then a slot from the provider's
+    AIMD concurrency limit. The slot's recorded status drives the AIMD feedback.
+    """
+
+    def __init__(self, providers: Optional[Dict[str, _Provider]] = None) -> None:
+        self._providers = providers if providers is not None else {
+            "gemini": _Provider(GEMINI_RPS, GEMINI_BURST, GEMINI_CONCURRENCY,
+                                GEMINI_CONCURRENCY_MIN, GEMINI_CONCURRENCY_MAX),
+            "feishu": _Provider(FEISHU_RPS, FEISHU_BURST, FEISHU_CONCURRENCY,
+                                FEISHU_CONCURRENCY_MIN, FEISHU_CONCURRENCY_MAX,
+                                FEISHU_WEBHOOK_RPS, FEISHU_WEBHOOK_BURST),
+        }
+
+    @asynccontextmanager
+    async def slot(self, provider: Optional[str], key: Optional[str] = None) -> AsyncIterator[Slot]:
+        p = self._providers.get(provider or "")
+        slot = Slot()
+        if p is None:
+            yield slot
+            return
+        key_bucket = p.key_bucket(key)
+        if key_bucket is not None:
+            await key_bucket.acquire()
+        await p.bucket.acquire()
+        await p.limiter.acquire()
+        cancelled = False
+        try:
+            yield slot
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # Cancelled before any response (e.g. the losing side of a hedge) says nothing about the provider.
+            quiet = cancelled and slot.status is None
+            await p.limiter.release(None if quiet else is_congestion_status(slot.status))
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            name: {
+                "concurrency_limit": round(p.limiter.limit, 2),
+                "congestion_events": p.limiter.congestion_events,
+                "throttled": p.bucket.waited + sum(b.waited for b in p.key_buckets.values()),
+            }
+            for name, p in self._providers.items()
+        }
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from .data_io import DELIVERIES_CSV, DELIVERY_HEADER, write_delivery_rows
+
+# Imported on every cron tick (main.py), so the launcher and merge import their
+# heavier modules lazily.
+
+# Token buckets and concurrency limits are per process, so the launcher splits
+# these across shards. Per-webhook limits (FEISHU_WEBHOOK_RPS/BURST) stay whole:
+# every user of a webhook lands on the same shard, so only one process sends to it.
+SHARED_RATE_ENV = ("GEMINI_RPS", "GEMINI_BURST", "FEISHU_RPS", "FEISHU_BURST")
+SHARED_CONCURRENCY_ENV = (
+    "GEMINI_CONCURRENCY",
+    "GEMINI_CONCURRENCY_MIN",
+    "GEMINI_CONCURRENCY_MAX",
+    "FEISHU_CONCURRENCY",
+    "FEISHU_CONCURRENCY_MIN",
+    "FEISHU_CONCURRENCY_MAX",
+)
+
+
+class Shard(NamedTuple):
+    index: int
+    count: int
+
+    @property
+    def suffix(self) -> str:
+        return f"shard{self.index}of{self.count}"
+
+    def owns(self, user: Dict) -> bool:
+        return shard_of(shard_key(user), self.count) == self.index
+
+
+def parse_shard(text: Optional[str]) -> Optional[Shard]:
+    """Parse ``i/N`` (0 <= i < N); empty means unsharded."""
+    if not text:
+        return None
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"shard must look like i/N, got {text!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard index out of range: {text!r}")
+    return None if count == 1 else Shard(index, count)
+
+
+def shard_key(user: Dict) -> str:
+    """The webhook, so users sharing a group bot stay on one shard (and in one outbox); else the public_id."""
+    return user.get("feishu_webhook") or user["public_id"]
+
+
+def shard_of(key: str, count: int) -> int:
+    """Stable across processes and Python versions (unlike ``hash``), so a user always lands on one shard."""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+_current: Optional[Shard] = parse_shard(os.getenv("PLANNER_SHARD", ""))
+
+
+def current_shard() -> Optional[Shard]:
+    return _current
+
+
+def set_current_shard(shard: Optional[Shard]) -> None:
+    """Select this process's shard; call before the run opens its ledger, journal and store."""
+    global _current
+    _current = shard
+
+
+def sharded_path(path: str, shard: Optional[Shard] = None) -> str:
+    """``deliveries.csv`` -> ``deliveries.shard0of4.csv`` for the current shard; unchanged when unsharded."""
+    shard = shard or _current
+    if shard is None:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{shard.suffix}{ext}"
+
+
+def owned(pairs: List, shard: Optional[Shard] = None) -> List:
+    """Keep the (user, local_now) pairs this shard serves."""
+    shard = shard or _current
+    if shard is None:
+        return pairs
+    return [(u, t) for u, t in pairs if shard.owns(u)]
+
+
+# -- merge ---------------------------------------------------------------------
+
+
+def _shard_files(path: str) -> List[str]:
+    stem, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(stem)}.shard*of*{ext}"))
+
+
+def _merge_csv(path: str) -> int:
+    rows: List[List[str]] = []
+    parts = _shard_files(path)
+    for part in parts:
+        with open(part, "r", encoding="utf-8", newline="") as f:
+            rows.extend(row for row in csv.reader(f) if row and row != DELIVERY_HEADER)
+    if rows:
+        rows.sort(key=lambda r: r[0])  # ISO timestamps, so one log reads in delivery order
+        write_delivery_rows(rows, path)
+    for part in parts:
+        os.remove(part)
+    return len(rows)
+
+
+def _merge_sqlite(path: str) -> int:
+    import sqlite3
+
+    from .journal import SqliteBackend
+
+    parts = _shard_files(path)
+    if not parts:
+        return 0
+    merged = 0
+    backend = SqliteBackend(path)
+    try:
+        for part in parts:
+            conn = sqlite3.connect(part)
+            try:
+                rows = conn.execute(f"SELECT {', '.join(DELIVERY_HEADER)} FROM deliveries ORDER BY ts").fetchall()
+            finally:
+                conn.close()
+            backend.write_rows([list(r) for r in rows])
+            merged += len(rows)
+    finally:
+        backend.close()
+    for part in parts:
+        for extra in ("", "-wal", "-shm"):
+            try:
+                os.remove(part + extra)
+            except FileNotFoundError:
+                pass
+    return merged
+
+
+def _merge_ledger() -> int:
+    from .ledger import LEDGER_DIR
+
+    merged = 0
+    for part in sorted(glob.glob(os.path.join(LEDGER_DIR, "*.shard*of*.jsonl"))):
+        date_str = os.path.basename(part).split(".", 1)[0]
+        with open(part, "rb") as src:
+            data = src.read()
+        if data and not data.endswith(b"\n"):
+            data = data[: data.rfind(b"\n") + 1]  # drop a torn last line
+        with open(os.path.join(LEDGER_DIR, f"{date_str}.jsonl"), "ab") as dst:
+            dst.write(data)
+        merged += data.count(b"\n")
+        os.remove(part)
+    return merged
+
+
+def _merge_segments() -> int:
+    from .agenda_store import AGENDA_SEGMENTS_DIR, SegmentStore, copy_agendas
+
+    merged = 0
+    for part in sorted(glob.glob(os.path.join(AGENDA_SEGMENTS_DIR, "shard*of*"))):
+        merged += copy_agendas(SegmentStore(part), SegmentStore())
+        shutil.rmtree(part)
+    return merged
+
+
+def merge() -> Dict[str, int]:
+    """Fold every shard's deliveries, ledger and agenda segments into the unsharded files.
+
+    Run once all shards have exited; shard files are removed after merging.
+    Holds the unsharded ledger lock, so it refuses (LedgerBusy) while a shard is live.
+    """
+    from .journal import DELIVERIES_DB
+    from .ledger import Ledger
+
+    with Ledger():
+        return {
+            "deliveries_csv": _merge_csv(DELIVERIES_CSV),
+            "deliveries_sqlite": _merge_sqlite(DELIVERIES_DB),
+            "ledger": _merge_ledger(),
+            "agenda_segments": _merge_segments(),
+        }
+
+
+# -- launcher --------------------------------------------------------------------
+
+
+def _shard_env(count: int) -> Dict[str, str]:
+    from . import scheduler
+
+    env = dict(os.environ)
+    env.pop("PLANNER_SHARD", None)
+    for key in SHARED_RATE_ENV:
+        share = float(getattr(scheduler, key)) / count
+        env[key] = str(max(1.0, share) if key.endswith("BURST") else share)
+    for key in SHARED_CONCURRENCY_ENV:
+        env[key] = str(max(1, int(getattr(scheduler, key)) // count))
+    return env
+
+
+def launch(count: int, extra_args: Optional[List[str]] = None, merge_after: bool = True) -> int:
+    """Run ``python -m app.main --shard i/count`` for every i as a pool of local processes.
+
+    Each shard writes only its own files, so they need no shared locks; the
+    outputs are merged once all of them have exited. Returns the worst exit code.
+    """
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+
+    env = _shard_env(count)
+    started = time.perf_counter()
+
+    def run(index: int) -> int:
+        cmd = [sys.executable, "-m", "app.main", "--shard", f"{index}/{count}", *(extra_args or [])]
+        return subprocess.run(cmd, env=env).returncode
+
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        codes = list(pool.map(run, range(count)))
+    if merge_after:
+        merged = merge()
+        print(json.dumps({"shards": count, "wall_s": round(time.perf_counter() - started, 3), "exit": codes, "merged": merged}))
+    return max(codes, default=0)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.shard")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="run N shards locally, then merge their outputs")
+    run.add_argument("count", type=int)
+    run.add_argument("--no-merge", action="store_true")
+    sub.add_parser("merge", help="fold shard outputs into data/deliveries.csv and friends")
+    args = parser.parse_args(argv)
+    if args.cmd == "run":
+        sys.exit(launch(args.count, merge_after=not args.no_merge))
+    print(json.dumps(merge()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
-from typing import Optional
+import os
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import pytz
 
+PUSH_HOUR = int(os.getenv("PUSH_HOUR", "7"))
+PUSH_WINDOW_MIN = int(os.getenv("PUSH_WINDOW_MIN", "7"))
+PREGEN_LEAD_HOURS = float(os.getenv("PREGEN_LEAD_HOURS", "3"))
+
 
 def now_utc() -> datetime:
     """Return current UTC datetime with tzinfo set to UTC."""
@@ -49,9 +55,107 @@ def in_push_window(local_dt: datetime, hour: int = 7, window_minutes: int = 7) -
     """
     if local_dt.tzinfo is None:
         raise ValueError("local_dt must be timezone-aware")
+    return _within_window(local_dt, hour, window_minutes)
+
 
+def _within_window(local_dt: datetime, hour: int, window_minutes: int) -> bool:
+    # Works on naive wall-clock times as well as aware ones sharing one tzinfo.
     target = local_dt.replace(hour=hour, minute=0, second=0, microsecond=0)
     # Handle day boundary if current time is near midnight and hour is 0/23 edge cases
     # Compute absolute delta
     delta = abs((local_dt - target).total_seconds())
     return delta <= window_minutes * 60
+
+
+def _in_pregen_window(local_dt: datetime, hour: int, window_minutes: int, lead_hours: float) -> bool:
+    # Minutes since local midnight, so the range never reaches back into the previous day.
+    minute_of_day = local_dt.hour * 60 + local_dt.minute
+    window_open = hour * 60 - window_minutes
+    return window_open - lead_hours * 60 <= minute_of_day < window_open
+
+
+def next_push_utc(utc_dt: datetime, tz_name: str, hour: int = 7) -> datetime:
+    """First UTC instant strictly after ``utc_dt`` at which ``tz_name`` reads ``hour``:00.
+
+    DST-aware: on a fall-back day the earlier of the two hour:00 instants is
+    used; on a spring-forward day where hour:00 does not exist, the time is
+    read with the pre-transition offset, i.e. the moment the gap ends.
+    """
+    try:
+        tz = pytz.timezone(tz_name)
+    except Exception as exc:
+        raise ValueError(f"Invalid timezone name: {tz_name}") from exc
+    utc_dt = utc_dt.astimezone(pytz.utc)
+    day = utc_dt.astimezone(tz).date()
+    while True:
+        naive = datetime.combine(day, time(hour))
+        try:
+            local = tz.localize(naive, is_dst=None)
+        except pytz.AmbiguousTimeError:
+            local = tz.localize(naive, is_dst=True)
+        except pytz.NonExistentTimeError:
+            local = tz.localize(naive, is_dst=False)
+        fire = local.astimezone(pytz.utc)
+        if fire > utc_dt:
+            return fire
+        day += timedelta(days=1)
+
+
+def _offset_table(tz_name: str) -> Tuple[List[datetime], List[timedelta]]:
+    """Return (naive UTC transition instants, UTC offset in effect from each one)."""
+    try:
+        tz = pytz.timezone(tz_name)
+    except Exception as exc:
+        raise ValueError(f"Invalid timezone name: {tz_name}") from exc
+    times = getattr(tz, "_utc_transition_times", None)
+    if times:
+        return list(times), [info[0] for info in tz._transition_info]
+    return [datetime.min], [tz.utcoffset(datetime(2000, 1, 1))]
+
+
+class PushWindowIndex:
+    """Users bucketed by timezone, with each zone's UTC offset transitions precomputed.
+
+    A tick costs one bisect per distinct timezone instead of one ``to_local``
+    per user, and DST days stay correct because the offset is looked up from
+    the zone's transition table for the exact UTC instant.
+    """
+
+    def __init__(self, users_by_tz: Dict[str, List[Dict]]) -> None:
+        self.buckets = users_by_tz
+        self.invalid: List[str] = []
+        self._tables: Dict[str, Tuple[List[datetime], List[timedelta]]] = {}
+        for tz_name in users_by_tz:
+            try:
+                self._tables[tz_name] = _offset_table(tz_name)
+            except ValueError:
+                self.invalid.append(tz_name)
+
+    def invalid_users(self) -> Dict[str, List[Dict]]:
+        """Users whose timezone name is unknown, by that name; they are never due."""
+        return {tz_name: self.buckets[tz_name] for tz_name in self.invalid}
+
+    def local_wall_times(self, utc_dt: datetime) -> Dict[str, datetime]:
+        """Naive local wall-clock time of ``utc_dt`` in every indexed timezone."""
+        utc_naive = utc_dt.astimezone(pytz.utc).replace(tzinfo=None)
+        result: Dict[str, datetime] = {}
+        for tz_name, (times, offsets) in self._tables.items():
+            idx = max(0, bisect_right(times, utc_naive) - 1)
+            result[tz_name] = utc_naive + offsets[idx]
+        return result
+
+    def due(self, utc_dt: datetime, hour: int = 7, window_minutes: int = 7) -> Iterator[Tuple[datetime, List[Dict]]]:
+        """Yield (aware local datetime, users) for each timezone bucket inside the push window."""
+        for tz_name, wall in self.local_wall_times(utc_dt).items():
+            if _within_window(wall, hour, window_minutes):
+                yield to_local(utc_dt, tz_name), self.buckets[tz_name]
+
+    def pregen_due(
+        self, utc_dt: datetime, hour: int = 7, window_minutes: int = 7, lead_hours: float = 3
+    ) -> Iterator[Tuple[datetime, List[Dict]]]:
+        """Yield buckets whose local day has started and whose push window opens within ``lead_hours``."""
+        if lead_hours <= 0:
+            return
+        for tz_name, wall in self.local_wall_times(utc_dt).items():
+            if _in_pregen_window(wall, hour, window_minutes, lead_hours):
+                yield to_local(utc_dt, tz_name), self.buckets[tz_name]
@@ -0,0 +1,87 @@
+"""Agenda lookups and on-disk footprint: SegmentStore vs. the one-file-per-agenda DirStore.
+
+Writes USERS x DAYS synthetic agendas into each layout under a temp dir, then
+reports files created (what a git checkout has to materialize), allocated
+bytes, a cold lookup (fresh store, first read of the day) and warm lookups.
+
+Run from planner-feishu-gemini/:  python -m bench.bench_agenda_store
+"""
+from __future__ import annotations
+
+import os
+import random
+import tempfile
+import time
+from typing import Dict, Tuple
+
+from app.agenda_store import DirStore, SegmentStore
+
+USERS = 2_000
+DAYS = 7
+LOOKUPS = 5_000
+
+
+def _agenda(public_id: str, date_str: str) -> Dict:
+    return {
+        "date": date_str,
+        "focus": f"{public_id} 的重点：完成周报并准备评审",
+        "blocks": [
+            {"start": "09:30", "end": "11:30", "task": "写周报", "priority": "A"},
+            {"start": "14:00", "end": "15:00", "task": "评审会议", "priority": "B"},
+            {"start": "16:00", "end": "17:30", "task": "整理需求", "priority": "B"},
+        ],
+        "reminders": ["午休 12:00-13:30"],
+        "risks": [],
+        "plan_hash": "0123456789abcdef",
+    }
+
+
+def _footprint(root: str) -> Tuple[int, int, int]:
+    files = dirs = allocated = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirs += len(dirnames)
+        for name in filenames:
+            files += 1
+            allocated += os.stat(os.path.join(dirpath, name)).st_blocks * 512
+    return files, dirs, allocated
+
+
+def _run(label: str, make, root: str, dates) -> None:
+    store = make(root)
+    started = time.perf_counter()
+    for date_str in dates:
+        for i in range(USERS):
+            store.put(f"user{i}", date_str, _agenda(f"user{i}", date_str))
+    store.close()
+    write_s = time.perf_counter() - started
+    files, dirs, allocated = _footprint(root)
+
+    store = make(root)
+    started = time.perf_counter()
+    assert store.get("user0", dates[-1]) is not None
+    cold_us = (time.perf_counter() - started) * 1e6
+
+    rng = random.Random(0)
+    keys = [(f"user{rng.randrange(USERS)}", rng.choice(dates)) for _ in range(LOOKUPS)]
+    for _, date_str in keys:  # load every day's index before timing
+        store.get("user0", date_str)
+    started = time.perf_counter()
+    for public_id, date_str in keys:
+        store.get(public_id, date_str)
+    warm_us = (time.perf_counter() - started) / LOOKUPS * 1e6
+    print(
+        f"{label:<8} {files:>8} {dirs:>6} {allocated / 1e6:>10.1f} {write_s:>9.2f} {cold_us:>10.0f} {warm_us:>10.1f}"
+    )
+
+
+def main() -> None:
+    dates = [f"2025-09-{d:02d}" for d in range(1, DAYS + 1)]
+    print(f"{USERS} users x {DAYS} days")
+    print(f"{'store':<8} {'files':>8} {'dirs':>6} {'alloc MB':>10} {'write s':>9} {'cold us':>10} {'warm us':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        _run("dir", DirStore, os.path.join(tmp, "agendas"), dates)
+        _run("segment", SegmentStore, os.path.join(tmp, "segments"), dates)
+
+
+if __name__ == "__main__":
+    main()
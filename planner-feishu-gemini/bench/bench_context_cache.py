@@ -0,0 +1,66 @@
+"""Input tokens and latency per JSON call, system instruction inline vs context-cached.
+
+Runs the same per-user prompts against the local stand-in server
+(bench/standin_gemini.py) twice: once sending prompt.json.system.txt inline
+with every call, once through a ContextCache handle. A third pass expires the
+handle server-side mid-run to show the transparent inline fallback.
+
+Run from planner-feishu-gemini/:  python -m bench.bench_context_cache
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import tempfile
+
+from bench import standin_gemini
+
+SERVER = standin_gemini.start(base_ms=20, per_token_ms=0.05)
+os.environ["GEMINI_BASE_URL"] = SERVER.url
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+
+from app import gemini  # noqa: E402  (reads GEMINI_BASE_URL at import)
+from app.clients import ClientRegistry, percentile  # noqa: E402
+from app.prompts import PROMPT_JSON_PATH, PROMPT_JSON_SYSTEM_PATH, template  # noqa: E402
+
+USERS = 40
+PREFS = "工作日 9:30-18:30; 午休 12:00-13:30; 晚上尽量不加班"
+PLAN = "今日目标：\n- 完成雅思学习第一章，需要60min\n- 完成高等数学第二章学习，需要150min\n硬截止：今天必须做完雅思内容\n"
+
+
+async def _run(context, expire_after=None):
+    system = template(PROMPT_JSON_SYSTEM_PATH).render()
+    usages = []
+    async with ClientRegistry() as clients:
+        for i in range(USERS):
+            if expire_after is not None and i == expire_after:
+                SERVER.expire_all()
+            prompt = template(PROMPT_JSON_PATH).render(today="2025-09-26", content=f"{PLAN}- 用户{i}", prefs=PREFS)
+            usage = {}
+            await gemini.generate_text(prompt, clients=clients, system=system, context=context, usage=usage)
+            usages.append(usage)
+    return usages
+
+
+def _row(name, usages, context=None):
+    prompt = sum(u.get("promptTokenCount", 0) for u in usages)
+    cached = sum(u.get("cachedContentTokenCount", 0) for u in usages)
+    p50 = percentile([u["latency_ms"] for u in usages], 50)
+    extra = f"  {context.stats()}" if context else ""
+    print(f"{name:<10} {prompt / len(usages):>10.0f} {(prompt - cached) / len(usages):>10.0f} {p50:>8.1f}{extra}")
+
+
+def main() -> None:
+    print(f"{'mode':<10} {'in_tokens':>10} {'uncached':>10} {'p50_ms':>8}")
+    _row("inline", asyncio.run(_run(None)))
+    with tempfile.TemporaryDirectory() as tmp:
+        context = gemini.ContextCache(path=os.path.join(tmp, "ctx.json"))
+        _row("cached", asyncio.run(_run(context)), context)
+        context = gemini.ContextCache(path=os.path.join(tmp, "ctx.json"))
+        _row("expired", asyncio.run(_run(context, expire_after=USERS // 2)), context)
+    print(f"server requests: {SERVER.requests}")
+    SERVER.shutdown()
+
+
+if __name__ == "__main__":
+    main()
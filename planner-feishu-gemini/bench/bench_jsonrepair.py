@@ -0,0 +1,94 @@
+"""Repair success rate and throughput of app.jsonrepair vs. the old string-pass chain.
+
+Corpus: bench/corpus/gemini_malformed.jsonl, one {"name", "raw"} per line.
+A case counts as repaired when it validates into an Agenda with at least one block.
+
+Run from planner-feishu-gemini/:  python -m bench.bench_jsonrepair
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Callable, List, Tuple
+
+from app import jsonrepair
+from app.pipeline import _to_agenda
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus", "gemini_malformed.jsonl")
+ROUNDS = 200
+
+
+def _legacy_loads(raw: str) -> dict:
+    """The parse chain main.py used before app.jsonrepair, kept for comparison."""
+    t = raw.strip()
+    if t.startswith("```"):
+        t = t.split("\n", 1)[1] if "\n" in t else ""
+        if t.endswith("```"):
+            t = t[: -3]
+    if t.lower().startswith("json\n"):
+        t = t[5:]
+    t = t.strip()
+    if (t.startswith("'") and t.endswith("'")) or (t.startswith('"') and t.endswith('"')):
+        t = t[1:-1].strip()
+    start = t.find('{')
+    if start == -1:
+        t = '{' + t + '}'
+    else:
+        depth = 0
+        for idx in range(start, len(t)):
+            if t[idx] == '{':
+                depth += 1
+            elif t[idx] == '}':
+                depth -= 1
+                if depth == 0:
+                    t = t[start:idx + 1]
+                    break
+        else:
+            t = t[start:]
+    for old, new in ((',\n}', '\n}'), (',\n ]', '\n ]'), (', }', ' }'), (', ]', ' ]')):
+        t = t.replace(old, new)
+    try:
+        return json.loads(t)
+    except Exception:
+        return json.loads(t.replace("'", '"'))
+
+
+def _repair_loads(raw: str) -> dict:
+    return jsonrepair.loads(raw)[0]
+
+
+def _score(parse: Callable[[str], dict], cases: List[Tuple[str, str]]) -> Tuple[List[bool], float]:
+    results = []
+    for _, raw in cases:
+        try:
+            agenda = _to_agenda(parse(raw), "2025-09-26")
+            results.append(bool(agenda["blocks"]))
+        except Exception:
+            results.append(False)
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        for _, raw in cases:
+            try:
+                parse(raw)
+            except Exception:
+                pass
+    rate = ROUNDS * len(cases) / (time.perf_counter() - started)
+    return results, rate
+
+
+def main() -> None:
+    with open(CORPUS, "r", encoding="utf-8") as f:
+        cases = [(c["name"], c["raw"]) for c in map(json.loads, f)]
+    legacy, legacy_rate = _score(_legacy_loads, cases)
+    repaired, repair_rate = _score(_repair_loads, cases)
+    print(f"{'case':<24} {'legacy':>7} {'repair':>7}")
+    for (name, _), a, b in zip(cases, legacy, repaired):
+        print(f"{name:<24} {'ok' if a else '-':>7} {'ok' if b else '-':>7}")
+    n = len(cases)
+    print(f"{'success rate':<24} {sum(legacy) / n:>7.0%} {sum(repaired) / n:>7.0%}")
+    print(f"{'docs/sec':<24} {legacy_rate:>7.0f} {repair_rate:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Agendas/sec of the rule-based local planner on structured plans.
+
+Each case is parsed, packed and validated into an Agenda end to end, which is
+the whole cost of the LOCAL_PLANNER fast path (no network round trip).
+
+Run from planner-feishu-gemini/:  python -m bench.bench_local_planner
+"""
+from __future__ import annotations
+
+import time
+
+from app.local_planner import plan
+
+PREFS = "工作日 9:30-18:30; 午休 12:00-13:30; 晚上尽量不加班"
+CASES = {
+    "demo": "今日目标：\n- 完成雅思学习第一章，需要60min\n- 完成高等数学第二章学习，需要150min\n硬截止：今天必须做完雅思内容\n",
+    "deadlines": "- 写周报 1h，11:00前\n- 评审材料 45分钟\n- 回复邮件 20min\n- 需求梳理 2小时\n截止：17:00前交需求梳理\n",
+    "many_goals": "".join(f"- 任务{i} {15 + (i % 4) * 15}min\n" for i in range(8)),
+}
+ROUNDS = 2000
+
+
+def main() -> None:
+    print(f"{'case':<12} {'blocks':>7} {'agendas/sec':>12} {'us/agenda':>10}")
+    for name, plan_md in CASES.items():
+        agenda = plan(plan_md, PREFS, "2025-09-26")
+        blocks = len(agenda["blocks"]) if agenda else 0
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            plan(plan_md, PREFS, "2025-09-26")
+        elapsed = time.perf_counter() - started
+        print(f"{name:<12} {blocks:>7} {ROUNDS / elapsed:>12.0f} {elapsed / ROUNDS * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
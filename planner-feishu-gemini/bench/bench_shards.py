@@ -0,0 +1,119 @@
+"""Scaling curve of ``python -m app.main --shards N`` for N = 1..8 against local stand-ins.
+
+For each shard count a fresh temp directory gets the same synthetic users
+(see bench/load.py), the launcher runs N shard processes against one Gemini
+and one Feishu stand-in, and the merge folds their outputs into
+data/deliveries.csv. Reports wall time, users/sec, speed-up over one shard,
+and checks that every user was delivered exactly once and no shard files were
+left behind. Provider rate limits are off and the concurrency caps (which
+the launcher splits across shards) are set high, so the curve shows CPU and
+event-loop scaling rather than token buckets or semaphores.
+
+Run from planner-feishu-gemini/:
+    python -m bench.bench_shards --users 400
+    python -m bench.bench_shards --users 400 --counts 1,2,4 --env AGENDA_STORE=segment
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from bench import standin_feishu, standin_gemini
+from bench.load import PUSH_WINDOW_MIN, _write_users, _zones_in_window
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _delivered(root: str) -> Counter:
+    counts: Counter = Counter()
+    path = os.path.join(root, "data", "deliveries.csv")
+    if not os.path.exists(path):
+        return counts  # no shard sent anything: report 0 delivered instead of crashing
+    with open(path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row["status"] == "ok":
+                counts[row["public_id"]] += 1
+    return counts
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=400)
+    ap.add_argument("--counts", default="1,2,3,4,6,8", help="comma-separated shard counts")
+    ap.add_argument("--gemini-ms", type=float, default=300)
+    ap.add_argument("--gemini-sigma", type=float, default=0.5)
+    ap.add_argument("--feishu-ms", type=float, default=50)
+    ap.add_argument("--structured", type=float, default=0.0, help="share of plans the local planner can take")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app settings")
+    args = ap.parse_args()
+
+    gemini = standin_gemini.start(base_ms=args.gemini_ms, sigma=args.gemini_sigma)
+    feishu = standin_feishu.start(base_ms=args.feishu_ms)
+    hour, zones = _zones_in_window(datetime.now(timezone.utc))
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": APP_DIR,
+        "PUSH_HOUR": str(hour),
+        "PUSH_WINDOW_MIN": str(PUSH_WINDOW_MIN),
+        "PREGEN_LEAD_HOURS": "0",
+        "GEMINI_BASE_URL": gemini.url,
+        "GOOGLE_API_KEY": "load",
+        "LLM_CACHE": "0",
+        "GEMINI_RPS": "0",
+        "FEISHU_RPS": "0",
+        "FEISHU_WEBHOOK_RPS": "0",
+        "GEMINI_CONCURRENCY": "512",
+        "GEMINI_CONCURRENCY_MAX": "512",
+        "FEISHU_CONCURRENCY": "512",
+        "FEISHU_CONCURRENCY_MAX": "512",
+    })
+    env.update(kv.split("=", 1) for kv in args.env)
+
+    print(f"users={args.users} push_hour={hour:02d} gemini_ms={args.gemini_ms} feishu_ms={args.feishu_ms}")
+    print(f"{'shards':>6} {'wall_s':>8} {'users/s':>8} {'speedup':>8} {'ok':>6} {'dupes':>6} {'leftover':>8}")
+    base_wall = None
+    try:
+        for count in (int(c) for c in args.counts.split(",")):
+            root = tempfile.mkdtemp(prefix="planner-shards-")
+            try:
+                _write_users(root, args.users, zones, feishu.url, args.structured, "")
+                started = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, "-m", "app.main", "--shards", str(count)],
+                    cwd=root,
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    check=True,
+                )
+                wall = time.perf_counter() - started
+                delivered = _delivered(root)
+                # Metrics and cache files stay per shard by design; only merged outputs must be gone.
+                leftover = [
+                    path
+                    for pattern in ("deliveries.shard*", os.path.join("ledger", "*.shard*"), os.path.join("agenda_segments", "shard*"))
+                    for path in glob.glob(os.path.join(root, "data", pattern))
+                ]
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+            base_wall = base_wall or wall
+            dupes = sum(1 for n in delivered.values() if n > 1)
+            print(
+                f"{count:>6} {wall:>8.2f} {args.users / wall:>8.1f} {base_wall / wall:>8.2f}"
+                f" {len(delivered):>6} {dupes:>6} {len(leftover):>8}"
+            )
+    finally:
+        gemini.shutdown()
+        feishu.shutdown()
+
+
+if __name__ == "__main__":
+    main()
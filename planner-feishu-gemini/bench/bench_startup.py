@@ -0,0 +1,124 @@
+"""Wall time and imports of an empty cron tick (``python -m app.main`` with nobody due).
+
+Writes N synthetic users whose push hour is twelve hours away into a temp
+directory, then runs the real entry point K times under ``-X importtime``.
+Reports the median and max wall time next to a bare interpreter start, the
+slowest imports of one run, and whether any module that should load lazily
+(asyncio, httpx, pydantic, numpy, the pipeline) was imported. For comparison,
+it also times importing ``app.pipeline``, which is what a tick with due users
+pays on top. With ``--handled`` the users are inside a wide push window
+(PUSH_WINDOW_MIN=720, as the workflow runs) but the ledger already lists
+them as delivered today, which must be just as cheap.
+Exits non-zero when the median exceeds ``--target-ms``.
+
+Run from planner-feishu-gemini/:
+    python -m bench.bench_startup
+    python -m bench.bench_startup --handled
+    python -m bench.bench_startup --users 20000 --runs 20 --target-ms 200
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY = ("asyncio", "httpx", "pydantic", "numpy", "app.pipeline", "app.types", "app.gemini")
+# Interpreter start plus users.csv and the timezone index; a due tick imports the pipeline on top.
+EMPTY_TICK_TARGET_MS = 150.0
+
+
+def _write_users(root: str, n: int) -> None:
+    os.makedirs(os.path.join(root, "data"))
+    with open(os.path.join(root, "data", "users.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["public_id", "timezone", "feishu_webhook", "feishu_secret", "active", "prefs"])
+        for i in range(n):
+            writer.writerow([f"idle{i:05d}", "UTC", "http://127.0.0.1:9/hook", "", "true", ""])
+
+
+def _write_ledger(root: str, n: int, now: datetime) -> None:
+    """Mark every user delivered for today's push slot."""
+    os.makedirs(os.path.join(root, "data", "ledger"))
+    with open(os.path.join(root, "data", "ledger", f"{now:%Y-%m-%d}.jsonl"), "w", encoding="utf-8") as f:
+        for i in range(n):
+            rec = {"public_id": f"idle{i:05d}", "slot": f"{now.hour:02d}:00", "state": "delivered", "ts": 0, "run": "bench"}
+            f.write(json.dumps(rec) + "\n")
+
+
+def _run(cmd: List[str], cwd: str, env: Dict[str, str]) -> Tuple[float, str]:
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return (time.perf_counter() - started) * 1000, proc.stderr
+
+
+def _imports(stderr: str) -> Dict[str, int]:
+    """Module -> cumulative import time (us) from ``-X importtime`` output."""
+    out: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        out[name] = int(cumulative)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--target-ms", type=float, default=EMPTY_TICK_TARGET_MS)
+    ap.add_argument("--handled", action="store_true", help="users are due but already delivered today")
+    args = ap.parse_args()
+
+    now = datetime.now(timezone.utc)
+    if args.handled:
+        env = dict(os.environ, PYTHONPATH=APP_DIR, PUSH_HOUR=str(now.hour), PUSH_WINDOW_MIN="720")
+    else:
+        env = dict(os.environ, PYTHONPATH=APP_DIR, PUSH_HOUR=str((now.hour + 12) % 24))
+    root = tempfile.mkdtemp(prefix="planner-startup-")
+    try:
+        _write_users(root, args.users)
+        if args.handled:
+            _write_ledger(root, args.users, now)
+        bare = [_run([sys.executable, "-c", "pass"], root, env)[0] for _ in range(args.runs)]
+        ticks: List[float] = []
+        stderr = ""
+        for _ in range(args.runs):
+            wall, stderr = _run([sys.executable, "-X", "importtime", "-m", "app.main"], root, env)
+            ticks.append(wall)
+        _, pipeline_err = _run([sys.executable, "-X", "importtime", "-c", "import app.pipeline"], root, env)
+        leftovers = os.listdir(os.path.join(root, "data"))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    imports = _imports(stderr)
+    median = statistics.median(ticks)
+    print(f"users={args.users} runs={args.runs} handled={args.handled}")
+    print(f"bare interpreter  median_ms={statistics.median(bare):.1f}")
+    print(f"empty tick        median_ms={median:.1f} max_ms={max(ticks):.1f} target_ms={args.target_ms:.0f}")
+    print(f"pipeline import   cumulative_ms={_imports(pipeline_err).get('app.pipeline', 0) / 1000:.1f} (paid only when someone is due)")
+    print(f"files written     {sorted(set(leftovers) - {'users.csv', 'ledger'}) or 'none'}")
+    loaded = [name for name in LAZY if name in imports]
+    print(f"lazy modules loaded: {loaded or 'none'}")
+    print("\nslowest imports (cumulative ms):")
+    top = sorted(imports.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    for name, cumulative in top:
+        print(f"  {cumulative / 1000:>8.1f}  {name}")
+    if median > args.target_ms or loaded:
+        print("\nFAIL: empty tick over target or imported lazy modules")
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Per-tick push-window cost: PushWindowIndex vs. the per-user to_local loop.
+
+Run from planner-feishu-gemini/:  python -m bench.bench_tz_index
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import pytz
+
+from app.timewin import PushWindowIndex, in_push_window, to_local
+
+TIMEZONES = [
+    "Asia/Shanghai", "Asia/Tokyo", "Asia/Kolkata", "Asia/Singapore", "Europe/London", "Europe/Berlin",
+    "America/New_York", "America/Los_Angeles", "America/Sao_Paulo", "Australia/Sydney", "UTC", "Etc/GMT+8",
+]
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+LEGACY_MAX = 100_000
+TICKS = 20
+
+
+def _buckets(n: int) -> Dict[str, List[Dict]]:
+    user = {"public_id": "u"}
+    per_tz, extra = divmod(n, len(TIMEZONES))
+    return {tz: [user] * (per_tz + (1 if i < extra else 0)) for i, tz in enumerate(TIMEZONES)}
+
+
+def _legacy_tick(buckets: Dict[str, List[Dict]], utc_now: datetime) -> int:
+    due = 0
+    for tz, users in buckets.items():
+        for _ in users:
+            if in_push_window(to_local(utc_now, tz), hour=7, window_minutes=7):
+                due += 1
+    return due
+
+
+def _index_tick(index: PushWindowIndex, utc_now: datetime) -> int:
+    return sum(len(users) for _, users in index.due(utc_now, hour=7, window_minutes=7))
+
+
+def main() -> None:
+    utc_now = datetime(2025, 3, 30, 1, 0, tzinfo=pytz.utc)  # Europe DST switch instant
+    print(f"{'users':>10}  {'index us/tick':>14}  {'legacy us/tick':>15}")
+    for n in SIZES:
+        buckets = _buckets(n)
+        index = PushWindowIndex(buckets)
+        started = time.perf_counter()
+        for _ in range(TICKS):
+            _index_tick(index, utc_now)
+        index_us = (time.perf_counter() - started) / TICKS * 1e6
+        legacy = "skipped"
+        if n <= LEGACY_MAX:
+            started = time.perf_counter()
+            _legacy_tick(buckets, utc_now)
+            legacy = f"{(time.perf_counter() - started) * 1e6:.0f}"
+        print(f"{n:>10}  {index_us:>14.1f}  {legacy:>15}")
+
+
+if __name__ == "__main__":
+    main()
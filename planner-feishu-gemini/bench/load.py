@@ -0,0 +1,192 @@
+"""End-to-end load benchmark of ``main.main`` against local Gemini and Feishu stand-ins.
+
+Generates N synthetic users (users.csv, weekly plans) in a temp directory,
+with timezones chosen so every user is inside the push window right now,
+starts the stand-in servers in-process (bench/standin_gemini.py,
+bench/standin_feishu.py) and runs the real pipeline once. Reports users/sec,
+per-stage latency and event-loop lag from the run's metrics, peak RSS of this process (stand-in
+threads included) and the outbound request counts seen by the stand-ins.
+Fully offline; token buckets are off unless overridden with ``--env``.
+
+Run from planner-feishu-gemini/:
+    python -m bench.load --users 500
+    python -m bench.load --users 200 --gemini-error-rate 0.05 --env GEMINI_STREAM=1
+    python -m bench.load --users 500 --users-per-webhook 10 --env FEISHU_COALESCE=0
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+from zoneinfo import ZoneInfo, available_timezones
+
+from bench import standin_feishu, standin_gemini
+
+PROSE_PLAN = (
+    "# 本周计划\n本周主要推进季度报告和新人培训，周三下午有评审。\n"
+    "## 周一\n整理上周数据，和产品对齐需求，下午写报告初稿。\n"
+    "## 周三\n评审会准备，修改报告，带新人熟悉代码库。\n"
+    "## 周五\n复盘本周，安排下周，清理待办。\n"
+)
+STRUCTURED_PLAN = "今日目标：\n- 写周报 60min\n- 评审材料 45分钟\n- 回复邮件 20min\n硬截止：今天必须做完周报\n"
+PREFS = "工作日 9:30-18:30; 午休 12:00-13:30; 晚上尽量不加班"
+# Every zone is within 30 minutes of its nearest hour; the window is wider so
+# zones picked near its edge do not drift out while a long run is going.
+PUSH_WINDOW_MIN = 45
+ZONE_MARGIN_MIN = 15
+STAGES = (
+    "process_user", "load_agenda", "load_plan", "local_planner", "prompt", "gemini", "json_repair",
+    "validate", "constraints", "gemini_text", "write_agenda", "render", "feishu",
+)
+
+
+def _zones_in_window(
+    utc_now: datetime, window_min: int = PUSH_WINDOW_MIN, margin_min: int = ZONE_MARGIN_MIN
+) -> Tuple[int, List[str]]:
+    """A push hour and the timezones at least ``margin_min`` inside its ±``window_min`` window."""
+    reach = window_min - margin_min
+    by_hour: Dict[int, List[str]] = {}
+    for name in sorted(available_timezones()):
+        if "/" not in name or name.startswith(("Etc/", "SystemV/")):
+            continue
+        local = utc_now.astimezone(ZoneInfo(name))
+        minute = local.hour * 60 + local.minute + local.second / 60
+        nearest = int((minute + 30) // 60)
+        if abs(minute - nearest * 60) <= reach:
+            by_hour.setdefault(nearest % 24, []).append(name)
+    hour = max(by_hour, key=lambda h: len(by_hour[h]))
+    return hour, by_hour[hour]
+
+
+def _write_users(
+    root: str, n: int, zones: List[str], feishu_url: str, structured: float, secret: str, per_webhook: int = 1
+) -> None:
+    plans = os.path.join(root, "data", "plans")
+    os.makedirs(plans)
+    rng = random.Random(42)
+    with open(os.path.join(root, "data", "users.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["public_id", "timezone", "feishu_webhook", "feishu_secret", "active", "prefs"])
+        for i in range(n):
+            public_id = f"load{i:05d}"
+            # Consecutive users share a group bot; zones cycle, so each user still has its own timezone.
+            hook = i // max(1, per_webhook)
+            writer.writerow([public_id, zones[i % len(zones)], f"{feishu_url}/hook/{hook}", secret, "true", PREFS])
+            plan = STRUCTURED_PLAN if rng.random() < structured else PROSE_PLAN + f"备注：用户 {i}\n"
+            with open(os.path.join(plans, f"{public_id}.weekly.md"), "w", encoding="utf-8") as p:
+                p.write(plan)
+
+
+def _deliveries(root: str) -> Dict[str, int]:
+    counts = {"ok": 0, "fail": 0}
+    try:
+        with open(os.path.join(root, "data", "deliveries.csv"), "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                counts[row["status"]] = counts.get(row["status"], 0) + 1
+    except FileNotFoundError:
+        pass
+    return counts
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--gemini-ms", type=float, default=300, help="median Gemini latency")
+    ap.add_argument("--gemini-sigma", type=float, default=0.5, help="log-normal spread of Gemini latency")
+    ap.add_argument("--gemini-error-rate", type=float, default=0.02)
+    ap.add_argument("--malformed-rate", type=float, default=0.05)
+    ap.add_argument("--feishu-ms", type=float, default=50)
+    ap.add_argument("--feishu-sigma", type=float, default=0.3)
+    ap.add_argument("--feishu-error-rate", type=float, default=0.0)
+    ap.add_argument("--structured", type=float, default=0.0, help="share of plans the local planner can take")
+    ap.add_argument("--secret", default="", help="sign every webhook call with this secret")
+    ap.add_argument("--users-per-webhook", type=int, default=1, help="users sharing one group bot")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app settings")
+    ap.add_argument("--keep", action="store_true", help="keep the temp data directory")
+    args = ap.parse_args()
+
+    gemini = standin_gemini.start(
+        base_ms=args.gemini_ms,
+        sigma=args.gemini_sigma,
+        error_rate=args.gemini_error_rate,
+        malformed_rate=args.malformed_rate,
+    )
+    feishu = standin_feishu.start(base_ms=args.feishu_ms, sigma=args.feishu_sigma, error_rate=args.feishu_error_rate)
+    hour, zones = _zones_in_window(datetime.now(timezone.utc))
+    env = {
+        "PUSH_HOUR": str(hour),
+        "PUSH_WINDOW_MIN": str(PUSH_WINDOW_MIN),
+        "PREGEN_LEAD_HOURS": "0",
+        "GEMINI_BASE_URL": gemini.url,
+        "GOOGLE_API_KEY": "load",
+        "LLM_CACHE": "0",
+        "GEMINI_RPS": "0",
+        "FEISHU_RPS": "0",
+        "FEISHU_WEBHOOK_RPS": "0",
+        "METRICS": "1",
+    }
+    env.update(kv.split("=", 1) for kv in args.env)
+    os.environ.update(env)
+
+    from app import main as app_main  # noqa: E402  (settings are read at import)
+
+    root = tempfile.mkdtemp(prefix="planner-load-")
+    cwd = os.getcwd()
+    try:
+        _write_users(root, args.users, zones, feishu.url, args.structured, args.secret, args.users_per_webhook)
+        os.chdir(root)
+        out = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(out):
+            asyncio.run(app_main.main())
+        wall = time.perf_counter() - started
+        lines = [line for line in out.getvalue().splitlines() if line.startswith("{")]
+        summary = json.loads(lines[-1]) if lines else {}
+        deliveries = _deliveries(root)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"data kept in {root}", file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+        gemini.shutdown()
+        feishu.shutdown()
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"users={args.users} zones={len(zones)} push_hour={hour:02d}")
+    print(f"wall_s={wall:.2f} users_per_s={args.users / wall:.1f} peak_rss_mb={peak_rss_mb:.1f}")
+    print(f"deliveries ok={deliveries.get('ok', 0)} fail={deliveries.get('fail', 0)}")
+    print(f"gemini requests={gemini.requests}")
+    print(f"feishu {feishu.stats()}")
+    print(f"\n{'stage':<14} {'count':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    stages = summary.get("stages", {})
+    for name in STAGES:
+        s = stages.get(name)
+        if s:
+            print(f"{name:<14} {s['count']:>6} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f}")
+    lag = summary.get("loop_lag", {}).get("all")
+    if lag:
+        print(f"{'loop_lag':<14} {lag['count']:>6} {lag['p50_ms']:>9.1f} {lag['p95_ms']:>9.1f} {lag['p99_ms']:>9.1f}")
+    if "io" in summary:
+        print(f"io {summary['io']}")
+    if "outbox" in summary:
+        print(f"outbox {summary['outbox']}")
+    print(f"\ncounters {summary.get('counters', {})}")
+    if "resilience" in summary:
+        print(f"resilience {summary['resilience']}")
+
+
+if __name__ == "__main__":
+    main()
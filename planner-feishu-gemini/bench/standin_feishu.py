@@ -0,0 +1,94 @@
+"""Local stand-in for Feishu custom-bot webhooks, for offline benches.
+
+Any ``POST /hook/<id>`` is accepted and answered like Feishu does
+(``{"StatusCode": 0, ...}``) after a log-normal latency around ``base_ms``;
+``error_rate`` of requests get a 429. Requests and message bytes are
+counted per webhook path, so benches can compare outbound request counts.
+
+Usage:
+    server = start(base_ms=30)
+    webhook = f"{server.url}/hook/team-1"
+"""
+from __future__ import annotations
+
+import http.server
+import json
+import random
+import threading
+import time
+from typing import Dict
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FeishuStandin"
+
+    def _reply(self, status: int, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        hook = self.path.split("?")[0]
+        time.sleep(self.server.latency_ms() / 1000)
+        if random.random() < self.server.error_rate:
+            self.server.count(hook, 0, ok=False)
+            self._reply(429, {"code": 9499, "msg": "too many request"})
+            return
+        self.server.count(hook, len(raw), ok=True)
+        self._reply(200, {"StatusCode": 0, "StatusMessage": "success", "code": 0, "msg": "success"})
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class FeishuStandin(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, base_ms: float, sigma: float = 0.0, error_rate: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.base_ms = base_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.per_hook: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address) -> None:
+        pass  # the app cancels hedged or aborted requests mid-response; that is expected here
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def latency_ms(self) -> float:
+        return self.base_ms * (random.lognormvariate(0, self.sigma) if self.sigma > 0 else 1.0)
+
+    def count(self, hook: str, size: int, ok: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += 0 if ok else 1
+            self.bytes += size
+            self.per_hook[hook] = self.per_hook.get(hook, 0) + 1
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "webhooks": len(self.per_hook),
+            "max_per_webhook": max(self.per_hook.values(), default=0),
+        }
+
+
+def start(base_ms: float = 30, sigma: float = 0.0, error_rate: float = 0.0) -> FeishuStandin:
+    server = FeishuStandin(base_ms, sigma, error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,191 @@
+"""Local stand-in for the Gemini endpoints the app uses, for offline benches.
+
+Implements ``cachedContents`` create/PATCH, ``generateContent`` and
+``streamGenerateContent`` (SSE). Responses carry ``usageMetadata`` with
+``promptTokenCount`` and ``cachedContentTokenCount``; latency is a base drawn
+from a log-normal around ``base_ms`` (spread ``sigma``) plus a per-token cost
+for the *uncached* input, so the effect of context caching shows up the same
+way it does against the real API. An unknown or expired ``cachedContent``
+name is rejected with 404. ``error_rate`` of generate calls answer 503 and
+``malformed_rate`` return text the app has to repair or cannot use.
+
+Usage:
+    server = start(base_ms=20, per_token_ms=0.05)
+    os.environ["GEMINI_BASE_URL"] = server.url
+    ...
+    server.shutdown()
+"""
+from __future__ import annotations
+
+import http.server
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.prompts import estimate_tokens
+
+AGENDA = {
+    "date": "D",
+    "focus": "stand-in",
+    "blocks": [{"start": "09:00", "end": "10:00", "task": "stand-in", "priority": "M"}],
+    "reminders": [],
+    "risks": [],
+}
+
+
+# Prose around the JSON, a code fence, a trailing comma, and a reply cut off mid-object.
+MALFORMED = (
+    lambda text: f"好的，以下是今天的日程安排：\n{text}\n祝你高效！",
+    lambda text: f"```json\n{text}\n```",
+    lambda text: text[:-1] + ",}",
+    lambda text: text[: len(text) // 2],
+)
+
+
+def _text_of(content: Optional[Dict]) -> str:
+    return "".join(p.get("text", "") for p in (content or {}).get("parts", []))
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StandinServer"
+
+    def _reply(self, status: int, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Dict:
+        n = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def do_PATCH(self) -> None:
+        body = self._body()
+        name = self.path.split("?")[0].split("/v1beta/", 1)[-1]
+        entry = self.server.contents.get(name)
+        if entry is None:
+            self._reply(404, {"error": {"code": 404, "message": f"{name} not found"}})
+            return
+        entry["expires"] = time.time() + float(str(body.get("ttl", "3600s")).rstrip("s"))
+        self.server.count("patch")
+        self._reply(200, {"name": name})
+
+    def do_POST(self) -> None:
+        body = self._body()
+        path = self.path.split("?")[0]
+        if path.endswith("/cachedContents"):
+            tokens = estimate_tokens(_text_of(body.get("systemInstruction")))
+            if tokens < self.server.min_cache_tokens:
+                self._reply(400, {"error": {"code": 400, "message": "cached content is too small"}})
+                return
+            name = f"cachedContents/c{len(self.server.contents) + 1}"
+            ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+            self.server.contents[name] = {"tokens": tokens, "expires": time.time() + ttl}
+            self.server.count("create")
+            self._reply(200, {"name": name})
+            return
+
+        cached = 0
+        if "cachedContent" in body:
+            entry = self.server.contents.get(body["cachedContent"])
+            if entry is None or entry["expires"] < time.time():
+                self._reply(404, {"error": {"code": 404, "message": "cachedContent not found"}})
+                return
+            cached = entry["tokens"]
+        uncached = estimate_tokens(_text_of(body.get("systemInstruction")))
+        uncached += sum(estimate_tokens(_text_of(c)) for c in body.get("contents", []))
+        usage = {"promptTokenCount": cached + uncached, "cachedContentTokenCount": cached}
+        if not cached:
+            usage.pop("cachedContentTokenCount")
+        self.server.count("generate_cached" if cached else "generate_inline")
+        time.sleep(self.server.latency_ms(uncached) / 1000)
+        if random.random() < self.server.error_rate:
+            self.server.count("error")
+            self._reply(503, {"error": {"code": 503, "message": "model overloaded"}})
+            return
+        text = json.dumps(AGENDA, ensure_ascii=False)
+        if random.random() < self.server.malformed_rate:
+            self.server.count("malformed")
+            text = random.choice(MALFORMED)(text)
+
+        if ":streamGenerateContent" in path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(text), 40):
+                event = {"candidates": [{"content": {"parts": [{"text": text[i:i + 40]}]}}]}
+                if i + 40 >= len(text):
+                    event["usageMetadata"] = usage
+                data = f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        self._reply(200, {"candidates": [{"content": {"parts": [{"text": text}]}}], "usageMetadata": usage})
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class StandinServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        base_ms: float,
+        per_token_ms: float,
+        min_cache_tokens: int,
+        sigma: float = 0.0,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.base_ms = base_ms
+        self.per_token_ms = per_token_ms
+        self.min_cache_tokens = min_cache_tokens
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.contents: Dict[str, Dict] = {}
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address) -> None:
+        pass  # the app cancels hedged or aborted requests mid-response; that is expected here
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def latency_ms(self, uncached_tokens: int) -> float:
+        base = self.base_ms * (random.lognormvariate(0, self.sigma) if self.sigma > 0 else 1.0)
+        return base + uncached_tokens * self.per_token_ms
+
+    def count(self, kind: str) -> None:
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def expire_all(self) -> List[str]:
+        """Drop every cached content, as if their TTLs had lapsed server-side."""
+        names = list(self.contents)
+        self.contents.clear()
+        return names
+
+
+def start(
+    base_ms: float = 20,
+    per_token_ms: float = 0.05,
+    min_cache_tokens: int = 0,
+    sigma: float = 0.0,
+    error_rate: float = 0.0,
+    malformed_rate: float = 0.0,
+) -> StandinServer:
+    server = StandinServer(base_ms, per_token_ms, min_cache_tokens, sigma, error_rate, malformed_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
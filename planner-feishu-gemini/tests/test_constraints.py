@@ -0,0 +1,12 @@
+from app import constraints
+
+
+def test_repair_does_not_overlap_a_split_block():
+    cons = constraints.constraints_for_date("午休 12:00-13:00", "2025-09-26")
+    agenda = {"blocks": [
+        {"start": "11:00", "end": "12:05", "task": "A"},
+        {"start": "11:30", "end": "11:50", "task": "B"},
+    ]}
+    repaired, _, lost = constraints.repair(agenda, cons)
+    assert constraints.validate(repaired, cons) == []
+    assert lost == ["A"]
@@ -0,0 +1,32 @@
+from app.prompts import plan_content, split_sections
+
+PLAN = """本周目标：完成季度报告
+
+## 周三
+周三前把报告交给老板
+整理数据，准备周五的评审
+
+## 周五
+- 评审会
+"""
+
+
+def test_weekday_mention_in_body_is_not_a_heading():
+    _, sections = split_sections(PLAN)
+    assert [s.title for s in sections] == ["## 周三", "## 周五"]
+    assert "整理数据，准备周五的评审" in sections[0].lines
+
+
+def test_day_section_keeps_lines_that_mention_other_days():
+    content = plan_content(PLAN, "2025-09-24")  # a Wednesday
+    assert content.section == "## 周三"
+    assert "周三前把报告交给老板" in content.text
+    assert "准备周五的评审" in content.text
+    assert "评审会" not in content.text
+
+
+def test_plain_day_labels_are_headings():
+    plan = "周一至周五：\n- 写代码\n9月27日（周六）\n- 休息\n"
+    _, sections = split_sections(plan)
+    assert [s.title for s in sections] == ["周一至周五：", "9月27日（周六）"]
+    assert plan_content(plan, "2025-09-27").section == "9月27日（周六）"